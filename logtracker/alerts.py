@@ -0,0 +1,220 @@
+#!/usr/bin/env python3.6
+
+"""
+    alerts module: rules raising alerts on records of watched files
+    ("more than 50 ERROR lines in 1 minute in app.log", "any line matching OOMKilled").
+
+    Patterns of all rules of a file are combined in one regular expression: records
+    not matching it (nearly all of them) are tested once. Matches are counted in
+    ring counters over rule window. Alerts are sent to a webhook (json POST) and/or
+    a command (json on standard input), at most once per rule cooldown.
+"""
+
+import asyncio
+import collections
+import fnmatch
+import json
+import logging
+import re
+import subprocess
+import time
+import urllib.request
+import logtracker.event
+
+class RingCounter:
+    """ count of events in a sliding window, kept in fixed number of buckets """
+
+    def __init__(self, window: float, buckets: int = 60):
+        """
+            constructor
+            :param window: window duration (s)
+            :param buckets: number of buckets window is split in
+        """
+        self._width = window / buckets
+        self._counts = [0] * buckets
+        self._current = 0 # index (time / width) of current bucket
+        self._total = 0
+
+    def _advance(self, now: float):
+        """ clear buckets elapsed since last call """
+        index = int(now / self._width)
+        elapsed = index - self._current
+        if elapsed <= 0:
+            return
+        size = len(self._counts)
+        if elapsed >= size:
+            self._counts = [0] * size
+            self._total = 0
+        else:
+            for i in range(self._current + 1, index + 1):
+                self._total -= self._counts[i % size]
+                self._counts[i % size] = 0
+        self._current = index
+
+    def add(self, count: int, now: float):
+        """ add count events at time now """
+        self._advance(now)
+        self._counts[self._current % len(self._counts)] += count
+        self._total += count
+
+    def total(self, now: float) -> int:
+        """ count of events in window ending at now """
+        self._advance(now)
+        return self._total
+
+class Rule:
+    """ alert rule: threshold matches of pattern in window (s) in files """
+
+    def __init__(self, name: str, pattern: str, files: str = '', threshold: int = 1,
+                 window: float = 60, cooldown: float = 300):
+        """
+            constructor
+            :param name: rule name (in alerts)
+            :param pattern: regular expression of matching records
+            :param files: path (or glob pattern) of files rule applies to ('': all files)
+            :param threshold: number of matches in window raising alert
+            :param window: window duration (s)
+            :param cooldown: min delay (s) between two alerts of rule and file
+        """
+        self.name = name
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.files = files
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+
+    def applies(self, path: str) -> bool:
+        """ True if rule applies to file """
+        return not self.files or fnmatch.fnmatch(path, self.files)
+
+class RuleState:
+    """ state of a rule for a file: counter, last alert and alerts deduplicated since """
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.counter = RingCounter(rule.window)
+        self.last_alert = None
+        self.suppressed = 0
+
+class FileMatcher:
+    """ rules of a file and their combined pattern """
+    #numbered group references (\1, (?(1)...)) point to other groups once combined
+    NUMBERED_REF = re.compile(r'(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?\(\d)')
+
+    def __init__(self, rules: list):
+        self.states = [RuleState(rule) for rule in rules]
+        self.search = lambda record: True # no prefilter
+        if len(rules) > 1 and any(FileMatcher.NUMBERED_REF.search(rule.pattern)
+                                  for rule in rules):
+            return
+        try:
+            self.search = re.compile('|'.join('(?:%s)' % rule.pattern for rule in rules)).search
+        except re.error:
+            pass # patterns can't be combined (same group names...)
+
+class AlertEngine:
+    """
+        AlertEngine evaluates rules on SplitRecordsEvent posted in event manager and
+        sends alerts to sinks from thread pool (event loop never waits for them).
+    """
+    LOGGER = logging.getLogger('logtracker.alerts.AlertEngine')
+    #alerts kept for /alerts route
+    HISTORY = 100
+    SINK_TIMEOUT = 10
+
+    def __init__(self, rules: list, webhook: str = '', command: str = '', loop=None):
+        """
+            constructor
+            :param rules: list of Rule
+            :param webhook: url alerts are posted to (json)
+            :param command: shell command run with alert (json) on standard input
+            :param loop: event loop sinks are called from (default: current loop)
+        """
+        self._rules = rules
+        self._webhook = webhook
+        self._command = command
+        self._loop = loop
+        self._matchers = dict()
+        self.alerts = collections.deque(maxlen=AlertEngine.HISTORY)
+
+    def matcher(self, path: str) -> FileMatcher:
+        """ matcher of file rules (built once per file) """
+        matcher = self._matchers.get(path)
+        if matcher is None:
+            matcher = self._matchers[path] = FileMatcher(
+                [rule for rule in self._rules if rule.applies(path)])
+        return matcher
+
+    def on_records(self, records_event):
+        """ callback for SplitRecordsEvent: count matches and raise alerts """
+        matcher = self.matcher(records_event.path)
+        if not matcher.states:
+            return
+        search = matcher.search
+        matched = [record for record in records_event.records if search(record)]
+        if not matched:
+            return
+        now = time.time()
+        for state in matcher.states:
+            last = None
+            count = 0
+            for record in matched:
+                if state.rule.regex.search(record):
+                    last = record
+                    count += 1
+            if count:
+                state.counter.add(count, now)
+                self._evaluate(state, records_event.path, last, now)
+
+    def _evaluate(self, state: RuleState, path: str, record: str, now: float):
+        """ raise alert if rule threshold is reached, unless rule is in cooldown """
+        rule = state.rule
+        count = state.counter.total(now)
+        if count < rule.threshold:
+            return
+        if state.last_alert is not None and now - state.last_alert < rule.cooldown:
+            state.suppressed += 1
+            return
+        alert = {"rule": rule.name, "file": path, "count": count, "threshold": rule.threshold,
+                 "window": rule.window, "line": record, "time": now,
+                 "suppressed": state.suppressed}
+        state.last_alert = now
+        state.suppressed = 0
+        AlertEngine.LOGGER.warning("Alert '%s' on %s: %d match(es) in %ss", rule.name, path,
+                                   count, rule.window)
+        self.alerts.append(alert)
+        self.send(alert)
+
+    def send(self, alert: dict):
+        """ send alert to sinks from thread pool """
+        if not (self._webhook or self._command):
+            return
+        loop = self._loop or asyncio.get_event_loop()
+        loop.run_in_executor(logtracker.event.Service.THREAD_POOL, self._send, alert)
+
+    def _send(self, alert: dict):
+        """ thread pool: post alert to webhook and/or run command """
+        data = json.dumps(alert).encode('utf-8')
+        if self._webhook:
+            request = urllib.request.Request(self._webhook, data,
+                                             {'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request, timeout=AlertEngine.SINK_TIMEOUT):
+                    pass
+            except OSError as exc:
+                AlertEngine.LOGGER.error("Alert webhook %s failed: %s", self._webhook, str(exc))
+        if self._command:
+            try:
+                subprocess.run(self._command, shell=True, input=data, check=True,
+                               timeout=AlertEngine.SINK_TIMEOUT)
+            except (OSError, subprocess.SubprocessError) as exc:
+                AlertEngine.LOGGER.error("Alert command '%s' failed: %s", self._command,
+                                         str(exc))
+
+#alert engine of application (None when there are no rules)
+ENGINE = None
+
+def recent_alerts() -> list:
+    """ last alerts raised """
+    return list(ENGINE.alerts) if ENGINE is not None else []
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3.6
+
+"""
+    assets module: in-memory cache of static html files with precompressed
+    variants and strong ETags, and cache of json documents per config version
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import os.path
+import threading
+
+# pylint: disable=import-error
+import inotify.constants
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def etag_match(if_none_match: str, etags) -> bool:
+    """ return True if If-None-Match header value matches one of etags """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip() in etags for tag in if_none_match.split(','))
+
+def accepts(accept_encoding: str, coding: str) -> bool:
+    """ return True if Accept-Encoding header value accepts coding """
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() == coding:
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+class Asset:
+    """ static file content and its precompressed variants """
+
+    def __init__(self, body: bytes, mimetype: str):
+        """ constructor: compress body and compute etags """
+        self.body = body
+        self.mimetype = mimetype
+        digest = hashlib.sha1(body).hexdigest()
+        self.etags = {None: '"%s"' % digest}
+        self.variants = {}
+
+        compressed = gzip.compress(body, 9)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = compressed
+            self.etags['gzip'] = '"%s-gz"' % digest
+        if brotli is not None:
+            compressed = brotli.compress(body)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+                self.etags['br'] = '"%s-br"' % digest
+
+    def select(self, accept_encoding: str):
+        """ return (coding, body) best variant accepted by client """
+        for coding in ('br', 'gzip'):
+            if coding in self.variants and accepts(accept_encoding, coding):
+                return coding, self.variants[coding]
+        return None, self.body
+
+class AssetCache:
+    """
+        AssetCache loads html folder files once in memory. Entries are invalidated
+        by file notifications (see FileNotifierService) and reloaded on next request.
+    """
+    LOGGER = logging.getLogger('logtracker.assets.AssetCache')
+    MAX_SIZE = 8 << 20
+    INVALIDATE_EVENTS = inotify.constants.IN_MODIFY | inotify.constants.IN_CLOSE_WRITE | \
+        inotify.constants.IN_ATTRIB | inotify.constants.IN_MOVE_SELF | \
+        inotify.constants.IN_DELETE_SELF
+    #file replaced (rename or delete): watch follows old inode and must be added again
+    REPLACED_EVENTS = inotify.constants.IN_MOVE_SELF | inotify.constants.IN_DELETE_SELF
+    NO_CACHE = ('index.html',)
+
+    def __init__(self, root: str, max_age: int = 3600):
+        """
+            constructor
+            :param root: folder of static files
+            :param max_age: Cache-Control max-age of assets (index.html is always revalidated)
+        """
+        self._root = os.path.realpath(root)
+        self._max_age = max_age
+        self._assets = dict()
+        self._lock = threading.Lock()
+        #paths of files loaded once, watched by caller
+        self._watched = set()
+        #function(path) called when a file not loaded before is cached (new file)
+        self.watch = None
+
+    @property
+    def root(self):
+        """ static files folder """
+        return self._root
+
+    def _path(self, filename: str):
+        """ return absolute path of filename or None if outside root """
+        path = os.path.realpath(os.path.join(self._root, filename))
+        if not path.startswith(self._root + os.sep):
+            return None
+        return path
+
+    def preload(self) -> list:
+        """ load every file of root folder, return list of loaded paths """
+        loaded = []
+        if os.path.isdir(self._root):
+            for filename in sorted(os.listdir(self._root)):
+                if self.get(filename) is not None:
+                    loaded.append(os.path.join(self._root, filename))
+        AssetCache.LOGGER.info('%d static files loaded from %s', len(loaded), self._root)
+        return loaded
+
+    def get(self, filename: str):
+        """ return cached Asset, load it if missing. None if file can't be cached """
+        asset = self._assets.get(filename)
+        if asset is not None:
+            return asset
+
+        path = self._path(filename)
+        if path is None or not os.path.isfile(path) or \
+                os.path.getsize(path) > AssetCache.MAX_SIZE:
+            return None
+
+        with open(path, 'rb') as fdesc:
+            body = fdesc.read()
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=UTF-8'
+        asset = Asset(body, mimetype)
+        with self._lock:
+            self._assets[filename] = asset
+            new = path not in self._watched
+            self._watched.add(path)
+        if new and self.watch is not None:
+            self.watch(path)
+        return asset
+
+    def invalidate(self, path: str):
+        """ remove file from cache """
+        filename = os.path.relpath(os.path.realpath(path), self._root)
+        with self._lock:
+            if self._assets.pop(filename, None) is not None:
+                AssetCache.LOGGER.info('Static file %s invalidated', filename)
+
+    def on_file_event(self, file_event) -> bool:
+        """
+            callback for FileNotifierService: invalidate modified files
+            :return: True if file was replaced and must be watched again
+        """
+        if file_event.has(AssetCache.INVALIDATE_EVENTS):
+            self.invalidate(file_event.filename)
+        if not file_event.has(AssetCache.REPLACED_EVENTS):
+            return False
+        # file deleted for now: watched when it is cached again
+        with self._lock:
+            self._watched.discard(os.path.realpath(file_event.filename))
+        return True
+
+    def lookup(self, filename: str, accept_encoding: str = '', if_none_match: str = ''):
+        """
+            build response for static file
+            :return: (status, headers list, body) or None if file not cached
+        """
+        asset = self.get(filename)
+        if asset is None:
+            return None
+
+        coding, body = asset.select(accept_encoding)
+        cache_control = 'no-cache' if filename in AssetCache.NO_CACHE else \
+            'public, max-age=%d' % self._max_age
+        headers = [('ETag', asset.etags[coding]), ('Cache-Control', cache_control),
+                   ('Vary', 'Accept-Encoding')]
+
+        if etag_match(if_none_match, asset.etags.values()):
+            return 304, headers, b''
+
+        headers.append(('Content-Type', asset.mimetype))
+        if coding is not None:
+            headers.append(('Content-Encoding', coding))
+        return 200, headers, body
+
+class JsonCache:
+    """ json documents serialized once per config version """
+
+    def __init__(self):
+        """ constructor """
+        self._docs = dict()
+
+    def get(self, name: str, version: int, builder):
+        """
+            return (body, etag) of document
+            :param name: document name
+            :param version: config version, document rebuilt when it changes
+            :param builder: function returning object to serialize
+        """
+        doc = self._docs.get(name)
+        if doc is None or doc[0] != version:
+            body = json.dumps(builder()).encode('utf-8')
+            doc = (version, body, '"%s"' % hashlib.sha1(body).hexdigest())
+            self._docs[name] = doc
+        return doc[1], doc[2]
+
+JSON = JsonCache()
+CACHE = None
+
+def get_cache(root: str, max_age: int = 3600) -> AssetCache:
+    """ return asset cache of root folder (created and preloaded on first call) """
+    global CACHE # pylint: disable=global-statement
+    if CACHE is None or CACHE.root != os.path.realpath(root):
+        cache = AssetCache(root, max_age)
+        cache.preload()
+        CACHE = cache
+    return CACHE
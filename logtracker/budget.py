@@ -0,0 +1,141 @@
+#!/usr/bin/env python3.6
+
+"""
+    budget module: memory budget of buffers and queues (file buffers, event queues
+    and backlogs, store queue, forwarder frames, websocket, event stream and tail
+    send buffers, event stream history, timelines reorder windows).
+
+    Components register their usage (bytes) and how to reduce it. Budget usage is
+    process footprint when budget started plus usage of components. Above HIGH
+    ratio of budget, degradations are applied by level, one more level each
+    check while pressure lasts: SHRINK (backlogs dropped, queues flushed), then
+    SAMPLE (records sampled) and DROP (slow clients disconnected). Degradations
+    are restored when usage is back below LOW ratio.
+"""
+
+import logging
+import os
+
+SHRINK = 0
+SAMPLE = 1
+DROP = 2
+LEVELS = ['shrink', 'sample', 'drop']
+
+def rss() -> int:
+    """ resident memory (bytes) of process, 0 if unknown """
+    try:
+        with open('/proc/self/statm') as fdesc:
+            return int(fdesc.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class Consumer:
+    """ registered component: usage function, degrade (size to free -> bytes freed) """
+    __slots__ = ['name', 'usage', 'level', 'degrade', 'restore']
+
+    def __init__(self, name, usage, level, degrade, restore):
+        self.name = name
+        self.usage = usage
+        self.level = level
+        self.degrade = degrade
+        self.restore = restore
+
+class Budget:
+    """ Budget checks usage of registered components from event loop """
+    LOGGER = logging.getLogger('logtracker.budget.Budget')
+    HIGH = 0.9
+    LOW = 0.75
+
+    def __init__(self, limit: int, interval: float = 1.0):
+        """
+            constructor
+            :param limit: memory budget (bytes)
+            :param interval: delay (s) between two checks
+        """
+        self._limit = limit
+        self._interval = interval
+        self._consumers = []
+        self._baseline = 0
+        self._handle = None
+        self._loop = None
+        #current degradation level, None when there is no pressure
+        self.level = None
+
+    def register(self, name: str, usage, level: int = SHRINK, degrade=None, restore=None):
+        """
+            register component
+            :param usage: function returning bytes used by component
+            :param level: degradation level of component (SHRINK, SAMPLE or DROP)
+            :param degrade: function(size) reducing usage by about size bytes,
+                            returning bytes freed
+            :param restore: function called when pressure is over
+        """
+        self._consumers.append(Consumer(name, usage, level, degrade, restore))
+
+    def start(self, loop):
+        """ measure process footprint and check budget periodically """
+        self._loop = loop
+        self._baseline = rss()
+        Budget.LOGGER.info('Memory budget %d MB (process %d MB at start)', self._limit >> 20,
+                           self._baseline >> 20)
+        self._handle = loop.call_later(self._interval, self._periodic)
+
+    def stop(self):
+        """ stop checks, restore degradations """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._restore()
+
+    def _periodic(self):
+        self.check()
+        self._handle = self._loop.call_later(self._interval, self._periodic)
+
+    def usages(self) -> dict:
+        """ bytes used by each component """
+        usages = dict()
+        for consumer in self._consumers:
+            try:
+                usages[consumer.name] = usages.get(consumer.name, 0) + consumer.usage()
+            except Exception as exc: # pylint: disable=broad-except
+                Budget.LOGGER.error('Usage of %s failed: %s', consumer.name, str(exc))
+        return usages
+
+    def check(self):
+        """ apply or restore degradations according to usage """
+        used = self._baseline + sum(self.usages().values())
+        if used > self._limit * Budget.HIGH:
+            self.level = SHRINK if self.level is None else min(self.level + 1, DROP)
+            Budget.LOGGER.warning('Memory budget: %d MB used of %d MB, degradation: %s',
+                                  used >> 20, self._limit >> 20, LEVELS[self.level])
+            excess = used - int(self._limit * Budget.LOW)
+            for consumer in sorted(self._consumers, key=lambda consumer: consumer.level):
+                if consumer.level > self.level:
+                    break
+                # sampling is kept during pressure, clients are dropped only if needed
+                if consumer.degrade is not None and (excess > 0 or consumer.level == SAMPLE):
+                    try:
+                        excess -= consumer.degrade(max(excess, 0)) or 0
+                    except Exception as exc: # pylint: disable=broad-except
+                        Budget.LOGGER.error('Degradation of %s failed: %s', consumer.name,
+                                            str(exc))
+        elif self.level is not None and used < self._limit * Budget.LOW:
+            Budget.LOGGER.info('Memory budget: %d MB used, degradations restored', used >> 20)
+            self._restore()
+
+    def _restore(self):
+        if self.level is None:
+            return
+        self.level = None
+        for consumer in self._consumers:
+            if consumer.restore is not None:
+                consumer.restore()
+
+    def stats(self) -> dict:
+        """ budget, process footprint, usage of components and degradation level """
+        return {"limit": self._limit, "baseline": self._baseline, "rss": rss(),
+                "usages": self.usages(),
+                "level": LEVELS[self.level] if self.level is not None else None}
+
+#budget of application (None when there is no budget)
+BUDGET = None
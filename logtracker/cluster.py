@@ -0,0 +1,374 @@
+#!/usr/bin/env python3.6
+
+"""
+    cluster module: agents forward records of their watched files to an aggregator
+    which serves all of them to browsers as if they were local files.
+
+    protocol (websocket between agent and aggregator):
+        agent -> aggregator: hello (json text): agent name, session and watched files
+        aggregator -> agent: welcome (json text): next expected seq of each file
+        agent -> aggregator: frame (binary): zlib compressed json
+                             {"id": frame id, "batches": [{file, seq, records, repeats}...]}
+                             repeats: [seq, count] of collapsed records (if any)
+        aggregator -> agent: ack (json text): last frame id processed
+    agent keeps frames until acknowledged and sends again after reconnection the ones
+    not fully received, aggregator drops records it already received (seq lower
+    than expected one). A new session (agent restarted) resets expected seqs.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import uuid
+import zlib
+import websockets
+import logtracker.stream
+
+#separator of agent name and file path in aggregated files paths
+SEPARATOR = ':'
+
+def remote_path(agent: str, path: str) -> str:
+    """ path of agent file as seen by aggregator clients """
+    return agent + SEPARATOR + path
+
+def encode_frame(frame_id: int, batches: list) -> bytes:
+    """ encode batches of records: list of (file, seq, records, repeats) """
+    encoded = []
+    for path, seq, records, repeats in batches:
+        batch = {"file": path, "seq": seq, "records": records}
+        if repeats:
+            batch["repeats"] = repeats
+        encoded.append(batch)
+    return zlib.compress(json.dumps({"id": frame_id, "batches": encoded}).encode('utf-8'))
+
+def decode_frame(frame: bytes):
+    """ return (frame id, list of (file, seq, records, repeats)) """
+    message = json.loads(zlib.decompress(frame).decode('utf-8'))
+    return message["id"], [(batch["file"], batch["seq"], batch["records"],
+                            [tuple(repeat) for repeat in batch.get("repeats", [])])
+                           for batch in message["batches"]]
+
+class Forwarder:
+    """
+        Forwarder (agent side) batches RecordsEvent of local files and sends them
+        compressed to aggregator over a persistent websocket connection.
+        Unacknowledged frames are kept (up to MAX_PENDING bytes) and sent again
+        after reconnection.
+    """
+    LOGGER = logging.getLogger('logtracker.cluster.Forwarder')
+    MIN_RETRY = 0.5
+    MAX_RETRY = 10.0
+    MAX_PENDING = 64 << 20
+
+    def __init__(self, url: str, name: str, files: list, batch_delay: float = 0.05,
+                 batch_size: int = 256 << 10):
+        """
+            constructor
+            :param url: aggregator websocket url
+            :param name: agent name (unique among agents)
+            :param files: watched files description (path, color, pattern dicts)
+            :param batch_delay: max delay (s) records wait before being sent
+            :param batch_size: records size (bytes) triggering immediate send
+        """
+        self._url = url
+        self._name = name
+        self._files = files
+        self._batch_delay = batch_delay
+        self._batch_size = batch_size
+        self._batches = []
+        self._batch_bytes = 0
+        self._flush_handle = None
+        #frame id -> (encoded frame, {file: seq after last record}), not acknowledged yet
+        self._pending = collections.OrderedDict()
+        self._session = uuid.uuid4().hex
+        self._pending_bytes = 0
+        self._next_id = 1
+        self._websocket = None
+        self._task = None
+        self._loop = None
+        self.dropped = 0
+
+    @property
+    def connected(self):
+        """ True if connected to aggregator """
+        return self._websocket is not None
+
+    @property
+    def pending(self):
+        """ number of frames not acknowledged """
+        return len(self._pending)
+
+    def buffered(self) -> int:
+        """ bytes of queued records and frames not acknowledged """
+        return self._batch_bytes + self._pending_bytes
+
+    def shrink(self, size: int) -> int:
+        """ drop oldest frames not acknowledged (about size bytes), return bytes freed """
+        freed = 0
+        while self._pending and freed < size:
+            _, (frame, _) = self._pending.popitem(last=False)
+            self._pending_bytes -= len(frame)
+            freed += len(frame)
+            self.dropped += 1
+        if freed:
+            Forwarder.LOGGER.warning('Memory pressure: %d bytes of frames dropped', freed)
+        return freed
+
+    def start(self, loop=None):
+        """ connect to aggregator (and reconnect until stopped) """
+        self._loop = loop or asyncio.get_event_loop()
+        Forwarder.LOGGER.info("Forwarding records to %s as agent '%s'", self._url, self._name)
+        self._task = asyncio.Task(self.run(), loop=self._loop)
+
+    def stop(self):
+        """ stop forwarding, pending frames are lost """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def update_files(self, files: list):
+        """ change watched files description (sent on next connection) """
+        self._files = files
+        if self._websocket is not None:
+            asyncio.Task(self._websocket.close(), loop=self._loop) # reconnect with new hello
+
+    def on_records(self, records_event):
+        """ callback for RecordsEvent: queue records for next frame """
+        path, seq, records = records_event.path, records_event.seq, records_event.records
+        repeats = records_event.repeats
+        if not records and not repeats:
+            return
+        last = self._batches[-1] if self._batches else None
+        if last is not None and last[0] == path and last[1] + len(last[2]) == seq:
+            last[2].extend(records) # contiguous records of same file
+            last[3].extend(repeats)
+        else:
+            self._batches.append((path, seq, list(records), list(repeats)))
+        self._batch_bytes += sum(len(record) for record in records_event.records)
+        if self._batch_bytes >= self._batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self._batch_delay, self.flush)
+
+    def flush(self):
+        """ encode queued records in a frame and send it """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batches:
+            return
+        frame_id = self._next_id
+        self._next_id += 1
+        frame = encode_frame(frame_id, self._batches)
+        ends = dict()
+        for path, seq, records, _ in self._batches:
+            ends[path] = seq + len(records)
+        self._batches = []
+        self._batch_bytes = 0
+
+        self._pending[frame_id] = (frame, ends)
+        self._pending_bytes += len(frame)
+        while self._pending_bytes > Forwarder.MAX_PENDING:
+            _, (dropped, _) = self._pending.popitem(last=False)
+            self._pending_bytes -= len(dropped)
+            self.dropped += 1
+            Forwarder.LOGGER.warning('Aggregator too slow or unreachable, frame dropped')
+        if self._websocket is not None:
+            asyncio.Task(self._send(frame), loop=self._loop)
+
+    async def _send(self, frame):
+        """ send frame, connection errors are handled by run """
+        try:
+            await self._websocket.send(frame)
+        except (websockets.ConnectionClosed, AttributeError):
+            pass # sent again after reconnection
+
+    def _ack(self, frame_id):
+        """ remove acknowledged frames """
+        while self._pending and next(iter(self._pending)) <= frame_id:
+            _, (frame, _) = self._pending.popitem(last=False)
+            self._pending_bytes -= len(frame)
+
+    def _resume(self, seqs):
+        """ drop pending frames aggregator already received """
+        for frame_id, (frame, ends) in list(self._pending.items()):
+            if all(end <= seqs.get(path, 0) for path, end in ends.items()):
+                del self._pending[frame_id]
+                self._pending_bytes -= len(frame)
+
+    async def _send_pending(self, websocket):
+        """ send pending frames in order, including frames flushed meanwhile """
+        last_id = 0
+        while True:
+            frames = [(frame_id, frame) for frame_id, (frame, _) in self._pending.items()
+                      if frame_id > last_id]
+            if not frames:
+                return
+            for frame_id, frame in frames:
+                await websocket.send(frame)
+                last_id = frame_id
+
+    async def run(self):
+        """ connection loop """
+        retry = Forwarder.MIN_RETRY
+        while True:
+            try:
+                async with websockets.connect(self._url, max_size=None) as websocket:
+                    await websocket.send(json.dumps({"type": "hello", "agent": self._name,
+                                                     "session": self._session,
+                                                     "files": self._files}))
+                    welcome = json.loads(await websocket.recv())
+                    self._resume(welcome.get("seqs", {}))
+                    Forwarder.LOGGER.info('Connected to aggregator %s, %d frame(s) to resend',
+                                          self._url, len(self._pending))
+                    retry = Forwarder.MIN_RETRY
+                    await self._send_pending(websocket)
+                    # no await since last pending frame sent: next frames follow in order
+                    self._websocket = websocket
+                    async for message in websocket:
+                        message = json.loads(message)
+                        if message.get("type") == "ack":
+                            self._ack(message["id"])
+            except asyncio.CancelledError:
+                raise
+            except (OSError, websockets.WebSocketException, ValueError) as exc:
+                Forwarder.LOGGER.warning('Aggregator %s connection failed: %s', self._url,
+                                         str(exc))
+            finally:
+                self._websocket = None
+            await asyncio.sleep(retry)
+            retry = min(retry * 2, Forwarder.MAX_RETRY)
+
+class Aggregator:
+    """
+        Aggregator accepts agents connections, posts their records as RecordsEvent
+        (file path prefixed with agent name) in event manager and keeps the list
+        of remote files.
+    """
+    LOGGER = logging.getLogger('logtracker.cluster.Aggregator')
+
+    def __init__(self, host: str, port: int, manager, on_files_changed=None):
+        """
+            constructor
+            :param host: host agents connect to
+            :param port: port agents connect to
+            :param manager: event.Manager receiving RecordsEvent
+            :param on_files_changed: called when an agent connects or disconnects
+        """
+        self._host = host
+        self._port = port
+        self._manager = manager
+        self._on_files_changed = on_files_changed
+        self._server = None
+        #agent name -> list of files description
+        self._agents = dict()
+        #remote path -> next expected seq, kept after disconnection for resume
+        self._seqs = dict()
+        #agent name -> session of last connection
+        self._sessions = dict()
+        self.version = 0
+
+    @property
+    def agents(self):
+        """ names of connected agents """
+        return list(self._agents)
+
+    def files(self):
+        """ files description of connected agents, paths prefixed with agent name """
+        result = []
+        for agent, files in self._agents.items():
+            for file in files:
+                result.append(dict(file, path=remote_path(agent, file["path"])))
+        return result
+
+    async def start(self):
+        """ listen to agents """
+        Aggregator.LOGGER.info("Aggregator listening to agents: host='%s' port=%d",
+                               self._host, self._port)
+        self._server = await websockets.serve(self.on_agent, self._host, self._port,
+                                              max_size=None)
+
+    def stop(self):
+        """ close agents server """
+        if self._server is not None:
+            Aggregator.LOGGER.info("Stop aggregator")
+            self._server.close()
+            self._server = None
+
+    def _files_changed(self):
+        self.version += 1
+        if self._on_files_changed:
+            self._on_files_changed()
+
+    async def on_agent(self, websocket, _path=None):
+        """ agent connection handler """
+        try:
+            hello = json.loads(await websocket.recv())
+            agent = hello["agent"]
+        except (ValueError, KeyError, websockets.ConnectionClosed) as exc:
+            Aggregator.LOGGER.warning('Invalid agent hello: %s', str(exc))
+            return
+        if agent in self._agents:
+            Aggregator.LOGGER.warning("Agent '%s' already connected, connection refused", agent)
+            return
+
+        files = hello.get("files", [])
+        session = hello.get("session")
+        if self._sessions.get(agent) != session:
+            # agent restarted: its records are numbered from 0 again
+            prefix = remote_path(agent, '')
+            self._seqs = {path: seq for path, seq in self._seqs.items()
+                          if not path.startswith(prefix)}
+            self._sessions[agent] = session
+        await websocket.send(json.dumps({"type": "welcome", "seqs": {
+            file["path"]: self._seqs.get(remote_path(agent, file["path"]), 0)
+            for file in files}}))
+        Aggregator.LOGGER.info("Agent '%s' connected with %d file(s)", agent, len(files))
+        self._agents[agent] = files
+        self._files_changed()
+        try:
+            async for frame in websocket:
+                if isinstance(frame, str):
+                    continue
+                frame_id, batches = decode_frame(frame)
+                for path, seq, records, repeats in batches:
+                    self.post_records(remote_path(agent, path), seq, records, repeats)
+                await websocket.send(json.dumps({"type": "ack", "id": frame_id}))
+        except websockets.ConnectionClosed:
+            pass
+        except (ValueError, KeyError, zlib.error) as exc:
+            Aggregator.LOGGER.error("Invalid frame from agent '%s': %s", agent, str(exc))
+        finally:
+            Aggregator.LOGGER.info("Agent '%s' disconnected", agent)
+            del self._agents[agent]
+            self._files_changed()
+
+    def post_records(self, path: str, seq: int, records: list, repeats: list = None):
+        """
+            post records not received yet, with repeat counts of collapsed records
+            (counts are totals: sent again after reconnection, they are harmless)
+        """
+        expected = self._seqs.get(path, 0)
+        skip = min(max(expected - seq, 0), len(records))
+        records = records[skip:]
+        if not records and not repeats:
+            return # already received before reconnection
+        seq = max(seq + skip, expected)
+        self._seqs[path] = max(expected, seq + len(records))
+        self._manager.post_event(logtracker.stream.RecordsEvent(path, seq, records,
+                                                                repeats=repeats))
+
+#aggregator of application (None when not running aggregator role)
+AGGREGATOR = None
+
+def version() -> int:
+    """ version of remote files list, changes when agents connect or disconnect """
+    return AGGREGATOR.version if AGGREGATOR is not None else 0
+
+def remote_files() -> list:
+    """ files description of connected agents """
+    return AGGREGATOR.files() if AGGREGATOR is not None else []
@@ -3,7 +3,10 @@
 import logging
 import os
 import os.path
+import re
+import socket
 import yaml
+import logtracker.logs
 
 class ConfigException(Exception):
     """ Exception for config error """
@@ -19,14 +22,50 @@ class Config:
     DEFAULT_WS_PORT = 9906
     DEFAULT_WS_URL  = 'ws://localhost'
     DEFAULT_LOG_FOLDER = "/tmp"
+    DEFAULT_LOG_LEVEL = 'INFO'
+    DEFAULT_HOTPATH_LEVEL = 'DEBUG'
+    DEFAULT_LOG_RATE_LIMIT = 10
+    DEFAULT_LOG_QUEUE_SIZE = 10000
     DEFAULT_HTML_FOLDER = 'logtracker/html'
+    DEFAULT_HTTP_MODE = 'thread'
+    DEFAULT_CACHE_MAX_AGE = 3600
+    DEFAULT_PROFILE_MAX_SECONDS = 30
+    DEFAULT_PROFILE_INTERVAL_MS = 10
+    DEFAULT_MEMORY_TOP = 20
+    DEFAULT_MEMORY_FRAMES = 1
+    DEFAULT_MEMORY_MAX_SECONDS = 600
+    DEFAULT_NOTIFIER_BACKEND = 'thread'
+    DEFAULT_POLL_MIN_MS = 250
+    DEFAULT_POLL_MAX_MS = 5000
+    DEFAULT_INDEX_SPAN_MB = 4
+    DEFAULT_MAX_INDEXES = 16
+    DEFAULT_HISTORY_MAX_READ_KB = 256
+    DEFAULT_MAX_RECORD_KB = 1024
+    DEFAULT_TICK_READ_KB = 1024
+    DEFAULT_CLUSTER_ROLE = 'standalone'
+    DEFAULT_AGENT_PORT = 9908
+    DEFAULT_BATCH_MS = 50
+    DEFAULT_BATCH_MAX_KB = 256
+    DEFAULT_TAIL_SOCKET = '/tmp/logtracker.sock'
+    DEFAULT_STORE_DIRECTORY = '/tmp/logtracker-store'
+    DEFAULT_STORE_MAX_MB = 256
+    DEFAULT_STORE_BLOCK_KB = 64
+    DEFAULT_STORE_FLUSH_MS = 1000
+    DEFAULT_RULE_WINDOW_S = 60
+    DEFAULT_RULE_COOLDOWN_S = 300
+    DEFAULT_TIMELINE_WINDOW_MS = 500
+    DEFAULT_BUDGET_CHECK_MS = 1000
 
     # pylint: disable=C0326
     SERVER_TAG = 'server'
     HTTP_TAG   = 'http'
     HTML_TAG   = 'html'
+    HTTP_MODE_TAG = 'mode'
+    CACHE_MAX_AGE_TAG = 'cache_max_age'
     WS_TAG     = 'websocket'
     WS_URL_TAG = 'url'
+    WS_WORKERS_TAG = 'workers'
+    WS_TIMELINE_WINDOW_TAG = 'timeline_window_ms'
     HOST_TAG   = 'host'
     PORT_TAG   = 'port'
     SSL_TAG    = 'ssl'
@@ -34,14 +73,86 @@ class Config:
     LOGS_TAG   = 'logs'
     LOGS_FOLDER_TAG = 'folder'
     LOGS_PREFIX_TAG = 'prefix'
+    LOGS_LEVEL_TAG = 'level'
+    LOGS_HOTPATH_TAG = 'hotpath_level'
+    LOGS_RATE_TAG = 'rate_limit'
+    LOGS_QUEUE_TAG = 'queue_size'
     FILES_TAG  = 'files'
     FILES_PATH_TAG = 'path'
     FILES_PATTERN_TAG = 'pattern'
     FILES_COLOR_TAG = 'color'
+    FILES_WATCH_TAG = 'watch'
+    FILES_COLLAPSE_TAG = 'collapse'
+    ADMIN_TAG  = 'admin'
+    ADMIN_PROFILER_TAG = 'profiler'
+    ADMIN_PROFILE_MAX_TAG = 'profile_max_seconds'
+    ADMIN_PROFILE_INTERVAL_TAG = 'profile_interval_ms'
+    ADMIN_MEMORY_TAG = 'memory'
+    ADMIN_MEMORY_TOP_TAG = 'memory_top'
+    ADMIN_MEMORY_FRAMES_TAG = 'memory_frames'
+    ADMIN_MEMORY_MAX_TAG = 'memory_max_seconds'
+    NOTIFIER_TAG = 'notifier'
+    NOTIFIER_BACKEND_TAG = 'backend'
+    NOTIFIER_POLL_MIN_TAG = 'poll_min_ms'
+    NOTIFIER_POLL_MAX_TAG = 'poll_max_ms'
+    HISTORY_TAG = 'history'
+    HISTORY_SPAN_TAG = 'index_span_mb'
+    HISTORY_INDEXES_TAG = 'max_indexes'
+    HISTORY_MAX_READ_TAG = 'max_read_kb'
+    CLUSTER_TAG = 'cluster'
+    CLUSTER_ROLE_TAG = 'role'
+    CLUSTER_URL_TAG = 'aggregator_url'
+    CLUSTER_NAME_TAG = 'agent_name'
+    CLUSTER_HOST_TAG = 'agent_host'
+    CLUSTER_PORT_TAG = 'agent_port'
+    CLUSTER_BATCH_MS_TAG = 'batch_ms'
+    CLUSTER_BATCH_MAX_TAG = 'batch_max_kb'
+    TAIL_TAG = 'tail'
+    TAIL_ENABLED_TAG = 'enabled'
+    TAIL_SOCKET_TAG = 'socket'
+    STORE_TAG = 'store'
+    STORE_ACTIVE_TAG = 'active'
+    STORE_DIRECTORY_TAG = 'directory'
+    STORE_MAX_MB_TAG = 'max_size_mb'
+    STORE_MAX_AGE_TAG = 'max_age_hours'
+    STORE_BLOCK_KB_TAG = 'block_kb'
+    STORE_FLUSH_MS_TAG = 'flush_ms'
+    ALERTS_TAG = 'alerts'
+    ALERTS_WEBHOOK_TAG = 'webhook'
+    ALERTS_COMMAND_TAG = 'command'
+    ALERTS_RULES_TAG = 'rules'
+    RULE_NAME_TAG = 'name'
+    RULE_FILE_TAG = 'file'
+    RULE_PATTERN_TAG = 'pattern'
+    RULE_THRESHOLD_TAG = 'threshold'
+    RULE_WINDOW_TAG = 'window_s'
+    RULE_COOLDOWN_TAG = 'cooldown_s'
+    BUDGET_TAG = 'budget'
+    BUDGET_MEMORY_TAG = 'memory_mb'
+    BUDGET_CHECK_TAG = 'check_ms'
+    LIMITS_TAG = 'limits'
+    LIMITS_LINES_TAG = 'max_lines_per_s'
+    LIMITS_BYTES_TAG = 'max_bytes_per_s'
+    LIMITS_RECORD_TAG = 'max_record_kb'
+    LIMITS_TICK_TAG = 'tick_read_kb'
 
+    # http serving modes: wsgiref thread, asyncio loop, shared with websocket port
+    HTTP_MODES = ['thread', 'async', 'shared']
+    # inotify backends: polling thread, file descriptor registered in asyncio loop
+    NOTIFIER_BACKENDS = ['thread', 'async']
+    # file watch modes: inotify notifications, stat polling (NFS, overlay...)
+    WATCH_MODES = ['inotify', 'poll']
+    # repeated records: none (sent), exact (identical ones collapsed) or masked
+    # (records differing only by numbers collapsed)
+    COLLAPSE_MODES = ['none', 'exact', 'masked']
+    # standalone: serve local files, agent: forward local files to aggregator,
+    # aggregator: serve local files and files of connected agents
+    CLUSTER_ROLES = ['standalone', 'agent', 'aggregator']
     COLORS= [ "blue", "red", "orange", "yellow", "green", "pink", "purple", "black", "grey" ]
     #config singleton
     CONFIG = None
+    #incremented each time config is loaded
+    VERSION = 0
 
     def __init__(self, yaml_file):
         """
@@ -81,6 +192,7 @@ class Config:
                     :param name: property name
                     :param dictionary: dictionary object property is appended to
                     :param default: default value if property not found in dictionary children
+                                    or empty (0 or '' are values, not missing properties)
                     :param ctor: contructor to build typed value from other type (string)
                 """
 
@@ -93,7 +205,7 @@ class Config:
                     raise ConfigException("Parent property %s should be dict type" % self._name)
 
                 setattr(self, name,
-                        ctor(dic[name]) if name in dic and dic[name] else default)
+                        ctor(dic[name]) if name in dic and dic[name] is not None else default)
                
             def __str__ (self):
                 return str(self._tostr)
@@ -127,45 +239,158 @@ class Config:
         p.set_prop(Config.SSL_TAG, config, 0, int)
         p.set_prop(Config.CERT_TAG, config, "", str)
         p.set_prop(Config.HTML_TAG, config, Config.DEFAULT_HTML_FOLDER, str)
+        p.set_prop(Config.HTTP_MODE_TAG, config, Config.DEFAULT_HTTP_MODE, str)
+        if p.mode not in Config.HTTP_MODES:
+            raise ConfigException("http mode should be one of %s" % str(Config.HTTP_MODES))
+        p.set_prop(Config.CACHE_MAX_AGE_TAG, config, Config.DEFAULT_CACHE_MAX_AGE, int)
         p = Prop( getattr(self,Config.SERVER_TAG), Config.WS_TAG )
         p.set_prop(Config.WS_URL_TAG, config, Config.DEFAULT_WS_URL, str)
         p.set_prop(Config.HOST_TAG, config, Config.DEFAULT_HOST, str)
         p.set_prop(Config.PORT_TAG, config, Config.DEFAULT_WS_PORT, int)
+        p.set_prop(Config.WS_WORKERS_TAG, config, 0, int)
+        p.set_prop(Config.WS_TIMELINE_WINDOW_TAG, config, Config.DEFAULT_TIMELINE_WINDOW_MS, int)
+        if p.workers and getattr(self, Config.SERVER_TAG).http.mode == 'shared':
+            raise ConfigException("websocket workers can't serve http routes (shared mode)")
 
         p = Prop(self, Config.LOGS_TAG)
         p.set_prop(Config.LOGS_FOLDER_TAG, config, Config.DEFAULT_LOG_FOLDER, str)
         p.set_prop(Config.LOGS_PREFIX_TAG, config, "", str)
+        p.set_prop(Config.LOGS_LEVEL_TAG, config, Config.DEFAULT_LOG_LEVEL, str)
+        p.set_prop(Config.LOGS_HOTPATH_TAG, config, Config.DEFAULT_HOTPATH_LEVEL, str)
+        p.set_prop(Config.LOGS_RATE_TAG, config, Config.DEFAULT_LOG_RATE_LIMIT, int)
+        p.set_prop(Config.LOGS_QUEUE_TAG, config, Config.DEFAULT_LOG_QUEUE_SIZE, int)
+
+        #admin routes (profiling), disabled by default
+        p = Prop(self, Config.ADMIN_TAG)
+        p.set_prop(Config.ADMIN_PROFILER_TAG, config, 0, int)
+        p.set_prop(Config.ADMIN_PROFILE_MAX_TAG, config, Config.DEFAULT_PROFILE_MAX_SECONDS, int)
+        p.set_prop(Config.ADMIN_PROFILE_INTERVAL_TAG, config,
+                   Config.DEFAULT_PROFILE_INTERVAL_MS, int)
+        p.set_prop(Config.ADMIN_MEMORY_TAG, config, 0, int)
+        p.set_prop(Config.ADMIN_MEMORY_TOP_TAG, config, Config.DEFAULT_MEMORY_TOP, int)
+        p.set_prop(Config.ADMIN_MEMORY_FRAMES_TAG, config, Config.DEFAULT_MEMORY_FRAMES, int)
+        p.set_prop(Config.ADMIN_MEMORY_MAX_TAG, config, Config.DEFAULT_MEMORY_MAX_SECONDS, int)
+
+        p = Prop(self, Config.NOTIFIER_TAG)
+        p.set_prop(Config.NOTIFIER_BACKEND_TAG, config, Config.DEFAULT_NOTIFIER_BACKEND, str)
+        if p.backend not in Config.NOTIFIER_BACKENDS:
+            raise ConfigException("notifier backend should be one of %s" %
+                                  str(Config.NOTIFIER_BACKENDS))
+        p.set_prop(Config.NOTIFIER_POLL_MIN_TAG, config, Config.DEFAULT_POLL_MIN_MS, int)
+        p.set_prop(Config.NOTIFIER_POLL_MAX_TAG, config, Config.DEFAULT_POLL_MAX_MS, int)
+
+        #rotated files reading
+        p = Prop(self, Config.HISTORY_TAG)
+        p.set_prop(Config.HISTORY_SPAN_TAG, config, Config.DEFAULT_INDEX_SPAN_MB, int)
+        p.set_prop(Config.HISTORY_INDEXES_TAG, config, Config.DEFAULT_MAX_INDEXES, int)
+        p.set_prop(Config.HISTORY_MAX_READ_TAG, config, Config.DEFAULT_HISTORY_MAX_READ_KB, int)
+
+        p = Prop(self, Config.CLUSTER_TAG)
+        p.set_prop(Config.CLUSTER_ROLE_TAG, config, Config.DEFAULT_CLUSTER_ROLE, str)
+        if p.role not in Config.CLUSTER_ROLES:
+            raise ConfigException("cluster role should be one of %s" % str(Config.CLUSTER_ROLES))
+        p.set_prop(Config.CLUSTER_URL_TAG, config, "", str)
+        if p.role == 'agent' and not p.aggregator_url:
+            raise ConfigException("cluster aggregator_url is required for agent role")
+        p.set_prop(Config.CLUSTER_NAME_TAG, config, socket.gethostname(), str)
+        p.set_prop(Config.CLUSTER_HOST_TAG, config, Config.DEFAULT_HOST, str)
+        p.set_prop(Config.CLUSTER_PORT_TAG, config, Config.DEFAULT_AGENT_PORT, int)
+        p.set_prop(Config.CLUSTER_BATCH_MS_TAG, config, Config.DEFAULT_BATCH_MS, int)
+        p.set_prop(Config.CLUSTER_BATCH_MAX_TAG, config, Config.DEFAULT_BATCH_MAX_KB, int)
+
+        #'logtracker tail' clients socket
+        p = Prop(self, Config.TAIL_TAG)
+        p.set_prop(Config.TAIL_ENABLED_TAG, config, 0, int)
+        p.set_prop(Config.TAIL_SOCKET_TAG, config, Config.DEFAULT_TAIL_SOCKET, str)
+
+        #records kept in local segments (disabled by default)
+        p = Prop(self, Config.STORE_TAG)
+        p.set_prop(Config.STORE_ACTIVE_TAG, config, 0, int)
+        p.set_prop(Config.STORE_DIRECTORY_TAG, config, Config.DEFAULT_STORE_DIRECTORY, str)
+        p.set_prop(Config.STORE_MAX_MB_TAG, config, Config.DEFAULT_STORE_MAX_MB, int)
+        p.set_prop(Config.STORE_MAX_AGE_TAG, config, 0, float)
+        p.set_prop(Config.STORE_BLOCK_KB_TAG, config, Config.DEFAULT_STORE_BLOCK_KB, int)
+        p.set_prop(Config.STORE_FLUSH_MS_TAG, config, Config.DEFAULT_STORE_FLUSH_MS, int)
+
+        #memory budget of buffers and queues (0: no budget)
+        p = Prop(self, Config.BUDGET_TAG)
+        p.set_prop(Config.BUDGET_MEMORY_TAG, config, 0, int)
+        p.set_prop(Config.BUDGET_CHECK_TAG, config, Config.DEFAULT_BUDGET_CHECK_MS, int)
+
+        #alert rules and sinks
+        p = Prop(self, Config.ALERTS_TAG)
+        p.set_prop(Config.ALERTS_WEBHOOK_TAG, config, "", str)
+        p.set_prop(Config.ALERTS_COMMAND_TAG, config, "", str)
+        setattr(p, Config.ALERTS_RULES_TAG, [])
+        rules_list = getattr(p, Config.ALERTS_RULES_TAG)
+        alerts = config.get(Config.ALERTS_TAG) or {}
+        for index, rule in enumerate(alerts.get(Config.ALERTS_RULES_TAG) or []):
+            if not isinstance(rule, dict) or not rule.get(Config.RULE_PATTERN_TAG):
+                raise ConfigException("alert rule %d has no pattern" % index)
+            p = Prop(rules_list)
+            p.set_prop(Config.RULE_NAME_TAG, rule, 'rule%d' % index, str)
+            p.set_prop(Config.RULE_FILE_TAG, rule, '', str)
+            p.set_prop(Config.RULE_PATTERN_TAG, rule, '', str)
+            p.set_prop(Config.RULE_THRESHOLD_TAG, rule, 1, int)
+            p.set_prop(Config.RULE_WINDOW_TAG, rule, Config.DEFAULT_RULE_WINDOW_S, float)
+            p.set_prop(Config.RULE_COOLDOWN_TAG, rule, Config.DEFAULT_RULE_COOLDOWN_S, float)
+            try:
+                re.compile(p.pattern)
+            except re.error as exc:
+                raise ConfigException("alert rule '%s' pattern: %s" % (p.name, str(exc)))
+
+        #files rate limits (0: no limit), files can override them
+        p = Prop(self, Config.LIMITS_TAG)
+        p.set_prop(Config.LIMITS_LINES_TAG, config, 0, int)
+        p.set_prop(Config.LIMITS_BYTES_TAG, config, 0, int)
+        #max record size and bytes of a file extracted at once (0: no limit)
+        p.set_prop(Config.LIMITS_RECORD_TAG, config, Config.DEFAULT_MAX_RECORD_KB, int)
+        p.set_prop(Config.LIMITS_TICK_TAG, config, Config.DEFAULT_TICK_READ_KB, int)
+        limits = p
 
         setattr(self, Config.FILES_TAG, [])
         files_list = getattr(self, Config.FILES_TAG)
 
         #set tracked files list
         if Config.FILES_TAG in config:
-            tags = [Config.FILES_PATH_TAG,  Config.FILES_PATTERN_TAG, Config.FILES_COLOR_TAG]
+            tags = [Config.FILES_PATH_TAG,  Config.FILES_PATTERN_TAG, Config.FILES_COLOR_TAG,
+                    Config.FILES_WATCH_TAG]
             for f in config[Config.FILES_TAG]:
                 if tags[0] in f and len(f[tags[0]])>0:
                     p = Prop(files_list)
                     p.set_prop(tags[0], f, '', str)
                     p.set_prop(tags[1], f, '\n', str)
                     p.set_prop(tags[2], f, 'auto', str)
+                    p.set_prop(tags[3], f, 'inotify', str)
+                    if p.watch not in Config.WATCH_MODES:
+                        raise ConfigException("file watch should be one of %s" %
+                                              str(Config.WATCH_MODES))
+                    p.set_prop(Config.LIMITS_LINES_TAG, f, limits.max_lines_per_s, int)
+                    p.set_prop(Config.LIMITS_BYTES_TAG, f, limits.max_bytes_per_s, int)
+                    p.set_prop(Config.FILES_COLLAPSE_TAG, f, 'none', str)
+                    if p.collapse not in Config.COLLAPSE_MODES:
+                        raise ConfigException("file collapse should be one of %s" %
+                                              str(Config.COLLAPSE_MODES))
 
     @staticmethod
-    def init_logs(log_folder, prefix):
-        """ init appplication logs """
+    def init_logs(log_folder, prefix, level='INFO', hotpath_level='DEBUG', rate_limit=10,
+                  queue_size=10000):
+        """
+            init appplication logs: written by a background thread (see logtracker.logs)
+            :param level: logs level name
+            :param hotpath_level: level name of logs emitted for every event
+            :param rate_limit: max messages per second and call site (0: no limit)
+            :param queue_size: max pending messages
+        """
         if not os.path.exists(log_folder):
             os.makedirs(log_folder)
 
-        fhandler = logging.FileHandler(os.path.join(log_folder, prefix + 'logtracker.log'))
-        chandler = logging.StreamHandler()
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-        fhandler.setFormatter(formatter)
-        chandler.setFormatter(formatter)
+        levels = [logging.getLevelName(name.upper()) for name in (level, hotpath_level)]
+        if not all(isinstance(lvl, int) for lvl in levels):
+            raise ConfigException("invalid log level '%s' or '%s'" % (level, hotpath_level))
 
-        logger = logging.getLogger('logtracker')
-        logger.setLevel(logging.INFO)
-        logger.addHandler(fhandler)
-        logger.addHandler(chandler)
+        logtracker.logs.setup(os.path.join(log_folder, prefix + 'logtracker.log'),
+                              levels[0], levels[1], rate_limit, queue_size)
 
     @classmethod
     def load(cls, file='config.yaml'):
@@ -176,6 +401,7 @@ class Config:
             :rtype: Config
         """
         cls.CONFIG = Config(file)
+        cls.VERSION += 1
         return cls.CONFIG
 
     @classmethod
@@ -185,6 +411,36 @@ class Config:
         """
         return cls.CONFIG
 
+def diff_files(old_files, new_files):
+    """
+        compare watched files lists of two configurations
+        :return: tuple (added, removed, changed) of files lists. changed files
+                 have the same path but a different pattern, color, watch mode,
+                 rate limits or collapse mode
+    """
+    old = {f.path: f for f in old_files}
+    new = {f.path: f for f in new_files}
+    added = [f for path, f in new.items() if path not in old]
+    removed = [f for path, f in old.items() if path not in new]
+    changed = [f for path, f in new.items() if path in old and
+               (f.pattern != old[path].pattern or f.color != old[path].color or
+                f.watch != old[path].watch or
+                f.max_lines_per_s != old[path].max_lines_per_s or
+                f.max_bytes_per_s != old[path].max_bytes_per_s or
+                f.collapse != old[path].collapse)]
+    return added, removed, changed
+
+def alerts_changed(old_alerts, new_alerts):
+    """
+        compare alert settings of two configurations
+        :return: True if sinks or rules (in order) differ
+    """
+    def settings(alerts):
+        return (alerts.webhook, alerts.command,
+                [(rule.name, rule.file, rule.pattern, rule.threshold,
+                  rule.window_s, rule.cooldown_s) for rule in alerts.rules])
+    return settings(old_alerts) != settings(new_alerts)
+
 def load(file='config.yaml'):
     """
         create and return Config singleton
@@ -4,9 +4,14 @@
     Service base class impl and events associated
 """
 
+import collections
 import concurrent.futures
 import asyncio
 import logging
+import os
+import threading
+import time
+import logtracker.logs
 
 # pylint: disable=invalid-name, too-few-public-methods, useless-super-delegation
 
@@ -83,14 +88,21 @@ class Service:
     	Base class for service implementation: a service run a background method which gets
         inputs or to output events. These mechanism are achieved with asyncio loops
 	"""
-    THREAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+    #shared pool for short-lived work, sized from cpu count
+    THREAD_POOL = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(32, (os.cpu_count() or 1) + 4), thread_name_prefix='logtracker')
     LOGGER = logging.getLogger('logtracker.service.DefaultLogger')
+    #long-running services get their own thread instead of a pool worker
+    DEDICATED_THREAD = False
+    #max delay between two heartbeats before service is reported stalled (None: not checked)
+    HEARTBEAT_TIMEOUT = None
 
     def __init__(self):
         """
             constructor
         """
         self._future = None
+        self._heartbeat = time.monotonic()
 
     # pylint: disable=missing-function-docstring
     def onstart(self, *args):
@@ -99,12 +111,39 @@ class Service:
     def onstop(self):
         pass
 
+    @staticmethod
+    def run_in_thread(name, fnc, *args):
+        """
+            run function in a new named thread
+            :return: concurrent.futures.Future set with function result
+        """
+        future = concurrent.futures.Future()
+
+        def target():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = fnc(*args)
+                if not future.done():
+                    future.set_result(result)
+            except BaseException as exc: # pylint: disable=broad-except
+                if not future.done():
+                    future.set_exception(exc)
+
+        threading.Thread(target=target, name=name, daemon=True).start()
+        return future
+
     def start(self, *args):
         """
             start the service
         """
         self.onstart(*args)
-        self._future = Service.THREAD_POOL.submit(self.run, *args)
+        self.heartbeat()
+        if type(self).DEDICATED_THREAD:
+            self._future = Service.run_in_thread('logtracker.%s' % type(self).__name__,
+                                                 self.run, *args)
+        else:
+            self._future = Service.THREAD_POOL.submit(self.run, *args)
 
     def stop(self):
         """
@@ -122,6 +161,25 @@ class Service:
 
         return self._future.result()
 
+    def heartbeat(self):
+        """ called periodically by run method to signal it is alive """
+        self._heartbeat = time.monotonic()
+
+    @property
+    def last_heartbeat(self):
+        """ time.monotonic() of last heartbeat """
+        return self._heartbeat
+
+    @property
+    def running(self):
+        """ True if run method is still running """
+        return self._future is not None and not self._future.done()
+
+    @property
+    def future(self):
+        """ future of run method """
+        return self._future
+
     def run(self, *args):
         """
             default method to execute as service background task
@@ -129,14 +187,144 @@ class Service:
         """
         raise NotImplementedError("methode run has to be overriden by child class")
 
+class Handler:
+    """ registered callback and its statistics (handling time, errors) """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def _record(self, elapsed: float):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+    def _failed(self, event_obj, exc):
+        self.errors += 1
+        Manager.LOGGER.error('Handler %s failed on %s: %s', self.callback, event_obj, str(exc))
+
+    def dispatch(self, event_obj):
+        """ call callback inline (in manager loop) """
+        start = time.perf_counter()
+        try:
+            self.callback(event_obj)
+        except Exception as exc: # pylint: disable=broad-except
+            self._failed(event_obj, exc)
+        self._record(time.perf_counter() - start)
+
+    def buffered(self) -> int:
+        """ approximate bytes of queued events """
+        return 0
+
+    def shrink(self, size: int) -> int:
+        """ drop oldest queued events (about size bytes), return bytes freed """
+        return 0
+
+    def start(self, loop):
+        """ nothing to start for inline handlers """
+
+    def stop(self):
+        """ nothing to stop for inline handlers """
+
+    def stats(self) -> dict:
+        """ handler statistics """
+        return {"handler": getattr(self.callback, '__qualname__', str(self.callback)),
+                "calls": self.calls, "errors": self.errors,
+                "avg_ms": self.total_time / self.calls * 1000 if self.calls else 0,
+                "max_ms": self.max_time * 1000}
+
+class AsyncHandler(Handler):
+    """
+        coroutine function callback: events are queued and handled by at most
+        concurrency tasks, so that a slow handler builds its own backlog without
+        delaying other handlers. Oldest events are dropped above max_backlog.
+    """
+
+    def __init__(self, callback, concurrency: int = 1, max_backlog: int = 10000):
+        super().__init__(callback)
+        self.concurrency = concurrency
+        self.max_backlog = max_backlog
+        self.dropped = 0
+        self.total_wait = 0.0
+        self._queue = collections.deque()
+        self._ready = None
+        self._tasks = []
+
+    def dispatch(self, event_obj):
+        """ queue event for handler tasks """
+        if len(self._queue) >= self.max_backlog:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append((time.perf_counter(), event_obj))
+        if self._ready is not None:
+            self._ready.set()
+
+    def buffered(self) -> int:
+        return sum(Manager.event_size(event_obj) for _, event_obj in self._queue)
+
+    def shrink(self, size: int) -> int:
+        freed = 0
+        while self._queue and freed < size:
+            freed += Manager.event_size(self._queue.popleft()[1])
+            self.dropped += 1
+        return freed
+
+    def start(self, loop):
+        """ start handler tasks in event loop """
+        if self._tasks:
+            return
+        self._ready = asyncio.Event()
+        if self._queue:
+            self._ready.set()
+        self._tasks = [asyncio.Task(self._worker(), loop=loop) for _ in range(self.concurrency)]
+
+    def stop(self):
+        """ cancel handler tasks, queued events are dropped """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._ready = None
+
+    async def _worker(self):
+        """ handle queued events until cancelled """
+        while True:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            posted, event_obj = self._queue.popleft()
+            start = time.perf_counter()
+            self.total_wait += start - posted
+            try:
+                await self.callback(event_obj)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc: # pylint: disable=broad-except
+                self._failed(event_obj, exc)
+            self._record(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({"backlog": len(self._queue), "dropped": self.dropped,
+                      "concurrency": self.concurrency,
+                      "wait_ms": self.total_wait / self.calls * 1000 if self.calls else 0})
+        return stats
+
 class Manager:
     """
         run event loop. components can register callbacks with particular event types then
-        post messages to be consumed in the event loop
+        post messages to be consumed in the event loop. Plain callbacks are called in
+        manager loop, coroutine functions are run by their own tasks (see AsyncHandler)
     """
 
     LOOP = asyncio.get_event_loop()
     LOGGER = logging.getLogger('logtracker.event.Manager')
+    #memory size of events without size attribute
+    EVENT_SIZE = 256
 
     def __init__(self):
         """
@@ -145,17 +333,28 @@ class Manager:
         self._event_registry = dict()
         self._queue = asyncio.Queue()
         self._loop = False
+        self._event_loop = None
 
     def stop(self):
         """ Stop manager when running """
         self._loop = False
         Manager.LOGGER.info('Stop Event Manager')
+        for handlers in self._event_registry.values():
+            for handler in handlers:
+                handler.stop()
         self.post_event(None)
 
     def post_event(self, event_obj: object):
         """ post event asynchronously in event queue """
         self._queue.put_nowait(event_obj)
 
+    def post_event_threadsafe(self, event_obj: object):
+        """ post event in event queue from another thread than the event loop one """
+        if self._event_loop is None:
+            self.post_event(event_obj)
+        else:
+            self._event_loop.call_soon_threadsafe(self._queue.put_nowait, event_obj)
+
     async def run(self):
         """
             run method: start event loop as coroutine (async)
@@ -164,27 +363,33 @@ class Manager:
             raise "Event Manager Already started\n"
 
         self._loop = True
+        self._event_loop = asyncio.get_event_loop()
+        for handlers in self._event_registry.values():
+            for handler in handlers:
+                handler.start(self._event_loop)
 
         Manager.LOGGER.info('Start Manager run loop')
         while self._loop:
             event_obj = await self._queue.get()
 
-            Manager.LOGGER.info('Event: %s', event_obj)
+            Manager.LOGGER.log(logtracker.logs.HOTPATH_LEVEL, 'Event: %s', event_obj)
 
-            if type(event_obj) in self._event_registry:
-                for callback in self._event_registry[type(event_obj)]:
-                    if asyncio.iscoroutine(callback):
-                        callback.send(event_obj)
-                    else:
-                        callback(event_obj)
+            handlers = self._event_registry.get(type(event_obj))
+            if handlers:
+                for handler in handlers:
+                    handler.dispatch(event_obj)
 
             self._queue.task_done()
 
-    def register_event(self, event_type, callback):
+    def register_event(self, event_type, callback, concurrency: int = 1,
+                       max_backlog: int = 10000):
         """
             register event and associated callback
             :param event_type: type object representing event (class object, built-in type)
-            :param callback: callback associated with event_type to be called at runtime
+            :param callback: callback associated with event_type to be called at runtime,
+                             function or coroutine function
+            :param concurrency: max events handled at the same time by a coroutine function
+            :param max_backlog: max events queued for a coroutine function (oldest dropped)
         """
         if callback is None:
             raise ValueError("callback paraneter is NoneType")
@@ -192,7 +397,14 @@ class Manager:
         if event_type and event_type not in self._event_registry:
             self._event_registry[event_type] = []
 
-        self._event_registry[event_type].append(callback)
+        if asyncio.iscoroutinefunction(callback):
+            handler = AsyncHandler(callback, concurrency, max_backlog)
+        else:
+            handler = Handler(callback)
+        if self._loop:
+            handler.start(self._event_loop)
+        # copy: registry may change while an event is dispatched
+        self._event_registry[event_type] = self._event_registry[event_type] + [handler]
 
     def unregister_event(self, event_type, callback):
         """
@@ -203,8 +415,211 @@ class Manager:
             raise ValueError("callback paraneter is NoneType")
 
         if event_type in self._event_registry:
-            l = self._event_registry[event_type]
-            if callback in l:
-                l.remove(callback)
-                if len(l) == 0:
-                    del self._event_registry[event_type]
+            handlers = self._event_registry[event_type]
+            for handler in handlers:
+                if handler.callback == callback:
+                    handler.stop()
+                    handlers = [item for item in handlers if item is not handler]
+                    break
+            if handlers:
+                self._event_registry[event_type] = handlers
+            else:
+                del self._event_registry[event_type]
+
+    def registered(self, event_type) -> bool:
+        """ True if event_type has handlers (events without handler need not be posted) """
+        return event_type in self._event_registry
+
+    @staticmethod
+    def event_size(event_obj) -> int:
+        """ approximate memory size of event """
+        return getattr(event_obj, 'size', Manager.EVENT_SIZE)
+
+    def buffered(self) -> int:
+        """ approximate bytes of events in queue and handlers backlogs """
+        return self._queue.qsize() * Manager.EVENT_SIZE + sum(
+            handler.buffered() for handlers in list(self._event_registry.values())
+            for handler in handlers)
+
+    def shrink(self, size: int) -> int:
+        """ drop oldest events of handlers backlogs (largest first), return bytes freed """
+        handlers = sorted((handler for handlers in self._event_registry.values()
+                           for handler in handlers), key=lambda handler: -handler.buffered())
+        freed = 0
+        for handler in handlers:
+            if freed >= size:
+                break
+            freed += handler.shrink(size - freed)
+        if freed:
+            Manager.LOGGER.warning('Memory pressure: %d bytes of handlers backlogs dropped', freed)
+        return freed
+
+    def stats(self) -> dict:
+        """ handlers statistics by event type name """
+        return {event_type.__name__: [handler.stats() for handler in handlers]
+                for event_type, handlers in list(self._event_registry.items())}
+
+class Supervisor:
+    """
+        start long-running services, watch their liveness (run method alive and
+        heartbeats) from a dedicated thread and restart them with exponential backoff
+        when they stop unexpectedly. Event loop responsiveness can be watched too.
+    """
+    LOGGER = logging.getLogger('logtracker.event.Supervisor')
+    CHECK_INTERVAL = 1.0
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+    #backoff is reset when service has been running for this delay
+    STABLE_DELAY = 60.0
+    LOOP_HEARTBEAT = 1.0
+    LOOP_TIMEOUT = 5.0
+
+    class _Entry:
+        """ supervised service state """
+        # pylint: disable=too-many-instance-attributes
+        def __init__(self, name, service, args):
+            self.name = name
+            self.service = service
+            self.args = args
+            self.restarts = 0
+            self.backoff = Supervisor.MIN_BACKOFF
+            self.restart_at = None
+            self.started_at = time.monotonic()
+            self.error = None
+            self.stalled = False
+
+    def __init__(self):
+        """ constructor """
+        self._entries = dict()
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._loop_beat = None
+        self._manager = None
+
+    def supervise(self, service, *args, name=None):
+        """
+            start service and restart it if its run method ends unexpectedly
+            :param service: Service object
+            :param args: arguments of Service.start
+            :param name: name reported by health (default: class name)
+        """
+        name = name or type(service).__name__
+        with self._lock:
+            if name in self._entries:
+                raise RuntimeError("Service %s already supervised" % name)
+            service.start(*args)
+            self._entries[name] = Supervisor._Entry(name, service, args)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._monitor, daemon=True,
+                                                name='logtracker.Supervisor')
+                self._thread.start()
+
+    def release(self, service):
+        """ stop supervising service (before stopping it) """
+        with self._lock:
+            for name, entry in list(self._entries.items()):
+                if entry.service is service:
+                    del self._entries[name]
+
+    def watch_loop(self, loop):
+        """ schedule heartbeats on event loop to report it stalled when blocked """
+        def beat():
+            self._loop_beat = time.monotonic()
+            loop.call_later(Supervisor.LOOP_HEARTBEAT, beat)
+        loop.call_soon_threadsafe(beat)
+
+    def watch_manager(self, manager):
+        """ report event manager handlers statistics (see handlers) """
+        self._manager = manager
+
+    def handlers(self):
+        """ event handlers statistics by event type: latency, backlog of async ones """
+        return self._manager.stats() if self._manager is not None else dict()
+
+    def stop(self):
+        """ stop monitor thread (services are not stopped) """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._loop_beat = None
+
+    def _monitor(self):
+        """ monitor thread loop """
+        while not self._stop_event.wait(Supervisor.CHECK_INTERVAL):
+            self.check()
+
+    def check(self):
+        """ check services liveness and restart dead ones when their backoff expired """
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._entries.values():
+                service = entry.service
+                if service.running:
+                    timeout = type(service).HEARTBEAT_TIMEOUT
+                    stalled = timeout is not None and now - service.last_heartbeat > timeout
+                    if stalled and not entry.stalled:
+                        Supervisor.LOGGER.error('Service %s stalled: no heartbeat for %.1fs',
+                                                entry.name, now - service.last_heartbeat)
+                    entry.stalled = stalled
+                    if now - entry.started_at > Supervisor.STABLE_DELAY:
+                        entry.backoff = Supervisor.MIN_BACKOFF
+                    continue
+
+                if entry.restart_at is None:
+                    exc = service.future.exception() if service.future else None
+                    entry.error = str(exc) if exc else 'run method returned'
+                    entry.restart_at = now + entry.backoff
+                    Supervisor.LOGGER.error('Service %s stopped (%s), restart in %.1fs',
+                                            entry.name, entry.error, entry.backoff)
+                elif now >= entry.restart_at:
+                    self._restart(entry, now)
+
+    def _restart(self, entry, now):
+        """ stop and start service again """
+        try:
+            entry.service.stop()
+        except Exception as exc: # pylint: disable=broad-except
+            Supervisor.LOGGER.warning('Service %s stop failed: %s', entry.name, str(exc))
+        try:
+            entry.service.start(*entry.args)
+            entry.restarts += 1
+            entry.started_at = now
+            entry.restart_at = None
+            Supervisor.LOGGER.info('Service %s restarted (%d)', entry.name, entry.restarts)
+        except Exception as exc: # pylint: disable=broad-except
+            entry.error = str(exc)
+            entry.restart_at = now + entry.backoff
+            Supervisor.LOGGER.error('Service %s restart failed: %s', entry.name, str(exc))
+        entry.backoff = min(entry.backoff * 2, Supervisor.MAX_BACKOFF)
+
+    def health(self):
+        """
+            return services health: dict name -> {state, restarts, heartbeat_age, error}
+            state is one of 'running', 'stalled' or 'restarting'
+        """
+        now = time.monotonic()
+        health = dict()
+        with self._lock:
+            for name, entry in self._entries.items():
+                if not entry.service.running:
+                    state = 'restarting'
+                else:
+                    state = 'stalled' if entry.stalled else 'running'
+                health[name] = {"state": state, "restarts": entry.restarts,
+                                "heartbeat_age": now - entry.service.last_heartbeat,
+                                "error": entry.error}
+        if self._loop_beat is not None:
+            age = now - self._loop_beat
+            health['event_loop'] = {"state": 'stalled' if age > Supervisor.LOOP_TIMEOUT
+                                             else 'running',
+                                    "restarts": 0, "heartbeat_age": age, "error": None}
+        return health
+
+    def healthy(self):
+        """ True if every supervised service is running """
+        return all(item['state'] == 'running' for item in self.health().values())
+
+SUPERVISOR = Supervisor()
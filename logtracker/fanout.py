@@ -0,0 +1,213 @@
+#!/usr/bin/env python3.6
+
+"""
+    fanout module: serve websocket clients from several worker processes.
+
+    Each worker process runs a WSServer bound to the same port with SO_REUSEPORT:
+    the kernel spreads incoming connections between them, so that websocket
+    framing of a message for every client is shared by cores. Ingest process
+    encodes each message once and writes it to workers pipes (frame: length on
+    4 bytes, utf-8 message); pipes are never written from event loop when full,
+    a worker lagging behind has its messages dropped above MAX_PENDING bytes.
+"""
+
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import signal
+import struct
+
+FRAME = struct.Struct('!I')
+
+def _worker_main(host: str, port: int, reader, level: int, timeline_window: float):
+    """ worker process: websocket server fed with messages read from pipe """
+    # pylint: disable=import-outside-toplevel
+    import logtracker.servers
+    logging.basicConfig(level=level,
+                        format='%(asctime)s ws-worker[%(process)d] %(levelname)s %(message)s')
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # stopped by parent (pipe closed)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    ws_server = logtracker.servers.WSServer(host, port, reuse_port=True,
+                                            timeline_window=timeline_window)
+    ws_server.start(loop)
+    fdesc = reader.fileno()
+    buffer = bytearray()
+
+    def on_readable():
+        data = os.read(fdesc, 1 << 16)
+        if not data:
+            loop.stop() # ingest process stopped
+            return
+        buffer.extend(data)
+        offset = 0
+        while len(buffer) - offset >= FRAME.size:
+            (length,) = FRAME.unpack_from(buffer, offset)
+            if len(buffer) - offset - FRAME.size < length:
+                break
+            start = offset + FRAME.size
+            message = buffer[start:start + length].decode('utf-8')
+            ws_server.feed_timelines(message)
+            asyncio.Task(ws_server.push_message(message), loop=loop)
+            offset = start + length
+        del buffer[:offset]
+
+    loop.add_reader(fdesc, on_readable)
+    try:
+        loop.run_forever()
+    finally:
+        loop.remove_reader(fdesc)
+        ws_server.stop()
+        # let clients connections close
+        tasks = asyncio.all_tasks(loop)
+        if tasks:
+            loop.run_until_complete(asyncio.wait(tasks, timeout=WSWorkerPool.STOP_TIMEOUT - 1))
+        loop.close()
+
+class Worker:
+    """ worker process and messages waiting to be written to its pipe """
+
+    def __init__(self, process, writer):
+        self.process = process
+        self.writer = writer
+        self.frames = collections.deque()
+        self.offset = 0 # bytes of first frame already written
+        self.pending = 0
+        self.dropped = 0
+
+class WSWorkerPool:
+    """
+        WSWorkerPool starts websocket worker processes and publishes messages to
+        them. It has the push_message interface of WSServer.
+    """
+    LOGGER = logging.getLogger('logtracker.fanout.WSWorkerPool')
+    #bytes waiting for a worker above which its new messages are dropped
+    MAX_PENDING = 16 << 20
+    STOP_TIMEOUT = 5
+
+    def __init__(self, host='localhost', port=8080, workers=2, timeline_window=0.5):
+        """
+            constructor
+            :param workers: number of websocket worker processes
+            :param timeline_window: reorder window (s) of timeline clients of workers
+        """
+        self._host = host
+        self._port = port
+        self._count = workers
+        self._timeline_window = timeline_window
+        self._workers = []
+        self._loop = None
+        self._context = multiprocessing.get_context('spawn')
+
+    @property
+    def workers(self) -> list:
+        """ running workers """
+        return list(self._workers)
+
+    def start(self, loop=None):
+        """ start worker processes """
+        if self._workers:
+            raise RuntimeError("WSWorkerPool already started")
+        self._loop = loop or asyncio.get_event_loop()
+        WSWorkerPool.LOGGER.info("Start %d websocket worker(s): host='%s' port=%d",
+                                 self._count, self._host, self._port)
+        self._workers = [self._spawn() for _ in range(self._count)]
+
+    def _spawn(self) -> Worker:
+        """ start a worker process connected by a pipe """
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker_main, name='logtracker-ws', daemon=True,
+            args=(self._host, self._port, reader, logging.getLogger().getEffectiveLevel(),
+                  self._timeline_window))
+        process.start()
+        reader.close()
+        os.set_blocking(writer.fileno(), False)
+        return Worker(process, writer)
+
+    def stop(self):
+        """ stop worker processes: closed pipe ends them """
+        if not self._workers:
+            raise RuntimeError("WSWorkerPool not started yet")
+        WSWorkerPool.LOGGER.info("Stop websocket workers")
+        workers, self._workers = self._workers, []
+        for worker in workers:
+            self._close(worker)
+        for worker in workers:
+            worker.process.join(WSWorkerPool.STOP_TIMEOUT)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def _close(self, worker: Worker):
+        """ stop writing to worker """
+        self._loop.remove_writer(worker.writer.fileno())
+        worker.writer.close()
+
+    def buffered(self) -> int:
+        """ bytes waiting to be written to workers """
+        return sum(worker.pending for worker in self._workers)
+
+    def shrink(self, size: int) -> int:
+        """ drop messages waiting for workers (not partially written), return bytes freed """
+        freed = 0
+        for worker in sorted(self._workers, key=lambda worker: -worker.pending):
+            keep = 1 if worker.offset else 0
+            while len(worker.frames) > keep and freed < size:
+                frame = worker.frames.pop()
+                worker.pending -= len(frame)
+                worker.dropped += 1
+                freed += len(frame)
+        return freed
+
+    async def push_message(self, message):
+        """ encode message once and queue it for every worker """
+        if not message or not self._workers:
+            return
+        data = message.encode('utf-8')
+        frame = FRAME.pack(len(data)) + data
+        for worker in self._workers:
+            if worker.pending + len(frame) > WSWorkerPool.MAX_PENDING:
+                worker.dropped += 1
+                if worker.dropped == 1:
+                    WSWorkerPool.LOGGER.warning('Websocket worker %d lagging: messages dropped',
+                                                worker.process.pid)
+                continue
+            idle = not worker.frames
+            worker.frames.append(frame)
+            worker.pending += len(frame)
+            if idle:
+                self._write(worker)
+
+    def _write(self, worker: Worker):
+        """ write queued frames until pipe is full (then wait for it to be writable) """
+        fdesc = worker.writer.fileno()
+        try:
+            while worker.frames:
+                frame = worker.frames[0]
+                written = os.write(fdesc, memoryview(frame)[worker.offset:])
+                worker.offset += written
+                worker.pending -= written
+                if worker.offset < len(frame):
+                    self._loop.add_writer(fdesc, self._write, worker)
+                    return
+                worker.frames.popleft()
+                worker.offset = 0
+        except BlockingIOError:
+            self._loop.add_writer(fdesc, self._write, worker)
+            return
+        except OSError as exc: # worker died (EPIPE)
+            WSWorkerPool.LOGGER.error('Websocket worker %d failed (%s): restart it',
+                                      worker.process.pid, str(exc))
+            self._restart(worker)
+            return
+        self._loop.remove_writer(fdesc)
+        worker.dropped = 0
+
+    def _restart(self, worker: Worker):
+        """ replace dead worker, its queued messages are lost """
+        self._close(worker)
+        worker.process.join(0)
+        index = self._workers.index(worker)
+        self._workers[index] = self._spawn()
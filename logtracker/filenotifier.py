@@ -5,14 +5,22 @@
     (see Unix inotify for more information)
 """
 
+import asyncio
+import collections
+import heapq
+import os
 import os.path
 import io
 import logging
+import struct
+import time
 import traceback
 import re
 
 # pylint: disable=import-error
 import inotify.adapters
+import inotify.calls
+import inotify.constants
 import logtracker
 from logtracker.event import Service, ServiceHandler
 
@@ -32,56 +40,73 @@ class FileDeleted(FileNotifierWarning):
     def __init__(self, obj, msg):
         super().__init__(obj, msg)
 
+class WatchedFile:
+    """ file description for FileNotifierService (same attributes as config files) """
+    def __init__(self, path, pattern='\n', watch='inotify'):
+        self.path = path
+        self.pattern = pattern
+        self.watch = watch
+
+#inotify event bits by name and event names by mask
+EVENT_BITS = {name: bit for bit, name in inotify.constants.MASK_LOOKUP.items()}
+_EVENT_NAMES = dict()
+
+def event_names(mask: int) -> list:
+    """ return list of event names of mask (computed once per mask) """
+    names = _EVENT_NAMES.get(mask)
+    if names is None:
+        names = [name for bit, name in inotify.constants.MASK_LOOKUP.items() if mask & bit]
+        _EVENT_NAMES[mask] = names
+    return names
+
 class FileNotifierEvent:
     """
         FileNotifierService event to be used with EventManager
         FileNotifierEvent should be registered with  EventManager.register_event
+        Events are kept as inotify mask: test bits with has() rather than names.
     """
+    __slots__ = ('mask', 'filename', 'state')
 
     def __init__(self, event):
-        """ constructor """
-        (_, type_name, path, filename) = event
-
-        path = "" if path is None else path
+        """
+            constructor (from inotify.adapters event)
+            :param event: tuple (header, event name or names, path, filename)
+        """
+        (header, type_name, path, filename) = event
 
-        if len(path) > 0 and len(filename) == 0:
-            filename = path
-        elif len(path) > 0 and len(filename) > 0:
+        if path and filename:
             filename = os.path.join(path, filename)
-        self._filename = filename
-        self._file_events = []
-        self._file_state = None
+        elif path:
+            filename = path
+        self.filename = filename
+        self.state = None
 
-        if isinstance(type_name, list):
+        if header is not None:
+            self.mask = header.mask
+        elif isinstance(type_name, list):
+            self.mask = 0
             for evt in type_name:
-                self._file_events.append(evt)
+                self.mask |= EVENT_BITS[evt]
         else:
-            self._file_events.append(type_name)
-
-    def get_filename(self):
-        """
-            filename notified
-            :return: name of the file
-        """
-        return self._filename
-
-    filename = property(fget=get_filename)
-
-    def get_events(self):
-        """ return file events list """
-        return self._file_events
-
-    events = property(fget=get_events)
+            self.mask = EVENT_BITS[type_name]
 
-    def get_state(self):
-        """ getter property state """
-        return self._file_state
+    @classmethod
+    def from_mask(cls, mask: int, filename: str, state=None):
+        """ build event from inotify mask without names conversion """
+        event = cls.__new__(cls)
+        event.mask = mask
+        event.filename = filename
+        event.state = state
+        return event
 
-    def set_state(self, state):
-        """ setter property state """
-        self._file_state = state
+    def has(self, bits: int) -> bool:
+        """ True if any event of bits (inotify.constants masks) occured """
+        return self.mask & bits != 0
 
-    state = property(fget=get_state, fset=set_state)
+    @property
+    def events(self):
+        """ return file events names list """
+        return event_names(self.mask)
 
 class FileState:
     """
@@ -100,87 +125,198 @@ class FileState:
     DELETE_SELF_EV = "IN_DELETE_SELF"
     IGNORED_EV = "IN_IGNORED"
     BUFFER_MIN_SIZE = 1024
+    #appended to records truncated to max record size
+    TRUNCATED = b' [logtracker: record truncated to %d bytes]'
+    #events changing file state
+    STATE_MASK = inotify.constants.IN_MODIFY | inotify.constants.IN_CLOSE_WRITE | \
+        inotify.constants.IN_DELETE_SELF
 
     def __init__(self, file_path: str, pattern :str = '\n'):
         self._file_path = file_path
         #line separator
         self._line_sep = pattern
+        self._regex = FileState.compile_pattern(pattern)
         self._start = self.update_pos()
         self._pos = self._start
         self._state = FileState.INIT_EV
         self._dirty = False
-        self._buffer = bytearray(FileState.BUFFER_MIN_SIZE)
-
-        #self._start -= 256 if  self._pos > 256 else self._pos
-        #self._buffer = self._pos
-
+        #incomplete trailing record kept between two extractions
+        self._buffer = bytearray()
+        #rest of a truncated line is dropped until its end
+        self._skip = False
+        #event posted again to extract pending modification (one queued at a time)
+        self.requeued = None
+
+    @staticmethod
+    def compile_pattern(pattern: str):
+        """
+            compile record start pattern. None is returned for the default
+            new line separator or if the pattern is not a valid regular expression
+        """
+        if pattern == '\n':
+            return None
+        try:
+            return re.compile(pattern.encode('utf-8'))
+        except re.error:
+            FileState.LOGGER.error("RegExp '%s' raise error. check syntax.", pattern)
+            return None
 
     def update_pos(self) -> int:
         """ return current position in file stream """
 
-        if not os.path.exists(self._file_path):
-            raise FileNotFoundError(f'File {self._file_path} not found')
-        pos = 0
-        with open(self._file_path, 'r') as fdesc:
-            fdesc.seek(0, 2)
-            pos = fdesc.tell()
+        # stat only: opening file would notify IN_OPEN and IN_CLOSE_NOWRITE
+        return os.stat(self._file_path).st_size
 
-        return pos
+    def _refresh_pos(self):
+        """ update head position with file size, restart from beginning if truncated """
+        pos = self.update_pos()
+        if pos < self._pos:
+            FileState.LOGGER.warning("File '%s' current pos(%d) < previous pos(%d)",
+                                     self._file_path, pos, self._pos)
+            self._start = 0
+            self._buffer.clear()
+            self._skip = False
+        self._pos = pos
 
     def on_event(self, file_event: FileNotifierEvent):
         """ get events from FileNotifierService """
-        for ev_item in file_event.events:
-            if ev_item == FileState.MODIFY_EV:
-                self._state = FileState.MODIFY_EV
-                self._dirty = True
-
-            elif ev_item == FileState.CLOSE_WR_EV:
-                self._state = FileState.CLOSE_WR_EV
-                pos = self.update_pos()
-                if pos > self._pos:
-                    self._pos = pos
-                else:
-                    FileState.LOGGER.warning("File '%s' current pos(%d) < previous pos(%d)",
-                                             self._file_path, pos, self._pos)
-            elif ev_item == FileState.DELETE_SELF_EV:
-                self._state = FileState.DELETE_SELF_EV
-                self._pos = -1 # file deleted, no more watched
-                FileState.LOGGER.warning("File %s has been deleted", self._file_path)
-                raise FileDeleted("File deleted", self)
-
-    def extract(self, byte_obj: bytearray) -> int:
+        mask = file_event.mask
+        if not mask & FileState.STATE_MASK:
+            return
+        if mask & inotify.constants.IN_MODIFY:
+            self._state = FileState.MODIFY_EV
+            self._dirty = True
+            self._refresh_pos()
+
+        if mask & inotify.constants.IN_CLOSE_WRITE:
+            self._state = FileState.CLOSE_WR_EV
+            self._refresh_pos()
+
+        if mask & inotify.constants.IN_DELETE_SELF:
+            self._state = FileState.DELETE_SELF_EV
+            self._pos = -1 # file deleted, no more watched
+            FileState.LOGGER.warning("File %s has been deleted", self._file_path)
+            raise FileDeleted(self, "File deleted")
+
+    def extract(self, byte_obj: bytearray, max_size: int = 0) -> int:
         """
             read current mofification and copy it in the byte_obj
             :param byte_obj: bytearray
+            :param max_size: max bytes read (0: whole modification), see pending
             :return: number of bytes read
         """
-
-        file = io.FileIO(self._file_path)
-        file.seek(self._start, io.SEEK_SET)
-        buf = io.BufferedReader(file)
-        byte_obj.extend(buf.read(self._pos-self._start))
+        size = self._pos - self._start
+        if max_size:
+            size = min(size, max_size)
+        if size > 0:
+            with io.FileIO(self._file_path) as file:
+                file.seek(self._start, io.SEEK_SET)
+                byte_obj.extend(io.BufferedReader(file).read(size))
+        self._dirty = self._pos - self._start > size
 
         return len(byte_obj)
 
-    def split(self, content: bytearray):
-        """ split the bytes using pattern as separator"""
-        try:
-            rx = re.compile(self._line_sep)
-            
-        except:
-            FileState.LOGGER.error("RegExp '%s' raise error. check syntax.", self._line_sep)
-            return
+    @property
+    def pending(self) -> int:
+        """ bytes of modification not extracted yet (see move_next) """
+        return max(0, self._pos - self._start)
 
+    @staticmethod
+    def truncate(record: bytes, max_record: int) -> bytes:
+        """ record truncated to max_record bytes, with TRUNCATED marker """
+        return bytes(record[:max_record]) + FileState.TRUNCATED % max_record
 
-    def move_next(self):
-        """ update start cursor with head position """
-        self._start = self._pos
+    def split(self, content: bytearray, max_record: int = 0) -> list:
+        """
+            split the bytes in records. with default pattern each line is a record,
+            otherwise a record starts with a line matching pattern and goes on with
+            following lines. Incomplete trailing line is kept for next call.
+            :param content: bytes extracted from file
+            :param max_record: max record size (0: no limit), larger records are
+                               truncated, incomplete trailing line included
+            :return: list of records (bytes)
+        """
+        if self._skip:
+            end = content.find(b'\n')
+            if end < 0:
+                return []
+            content = content[end+1:]
+            self._skip = False
+        self._buffer.extend(content)
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            lines = []
+        else:
+            lines = bytes(self._buffer[:end]).split(b'\n')
+            del self._buffer[:end+1]
+        tail = None
+        if max_record and len(self._buffer) > max_record:
+            # incomplete line is already too large: sent truncated, its end dropped
+            tail = FileState.truncate(self._buffer, max_record)
+            self._buffer.clear()
+            self._skip = True
+
+        if self._regex is None:
+            records = lines
+            if max_record:
+                records = [FileState.truncate(line, max_record) if len(line) > max_record
+                           else line for line in lines]
+        else:
+            records = []
+            truncated = False
+            for line in lines:
+                if records and not self._regex.match(line):
+                    if truncated:
+                        continue
+                    records[-1] += b'\n' + line
+                    if max_record and len(records[-1]) > max_record:
+                        records[-1] = FileState.truncate(records[-1], max_record)
+                        truncated = True
+                else:
+                    truncated = bool(max_record) and len(line) > max_record
+                    records.append(FileState.truncate(line, max_record) if truncated
+                                   else line)
+        if tail is not None:
+            records.append(tail)
+        return records
+
+    @property
+    def buffered(self) -> int:
+        """ bytes of incomplete trailing line kept for next split """
+        return len(self._buffer)
+
+    def get_pattern(self):
+        """ record pattern """
+        return self._line_sep
+
+    def set_pattern(self, pattern: str):
+        """ change record pattern, file position is kept """
+        self._line_sep = pattern
+        self._regex = FileState.compile_pattern(pattern)
+
+    pattern = property(fget=get_pattern, fset=set_pattern)
+
+    def move_next(self, size: int = None):
+        """ update start cursor with head position (or by size bytes extracted) """
+        self._start = self._pos if size is None else self._start + size
+
+    def rewind(self):
+        """ read file again from beginning (file replaced by a new one) """
+        self._start = 0
+        self._pos = 0
+        self._buffer.clear()
+        self._skip = False
 
     @property
     def last_event(self):
         """ get last event from FileNotifyService """
         return self._state
 
+    @property
+    def dirty(self):
+        """ True if file modified since last extraction """
+        return self._dirty
+
     @property
     def file_path(self):
         """ return file path of registered file """
@@ -193,16 +329,82 @@ class FileNotifierService(Service):
         FileNotifierService watch files modification using inotify Unix mechanism.
     """
     LOGGER = logging.getLogger('logtracker.event.FileNotifierService')
+    DEDICATED_THREAD = True
+    #runloop beats at least every poll timeout (1s)
+    HEARTBEAT_TIMEOUT = 10
 
     def __init__(self, file_list, callb):
         """
             Constructor. take file list with file paths to watch.
         """
         super().__init__()
-        self._file_list = file_list
+        self._file_list = list(file_list)
         self._running = False
         self._callback = callb
         self._states = {file.path: FileState(file.path,file.pattern) for file in file_list}
+        #watch descriptor -> FileState: events are dispatched without path lookup
+        self._watches = dict()
+        #watch list changes requested from other threads, applied by runloop
+        self._pending = collections.deque()
+
+    @property
+    def states(self):
+        """ watched files states by path """
+        return self._states
+
+    def add_file(self, file):
+        """
+            watch a new file or update pattern of watched file (position is kept).
+            A watched file is watched again (file replaced by a new one).
+            Can be called from any thread.
+            :param file: object with path and pattern attributes
+        """
+        self._pending.append((True, file))
+
+    def remove_file(self, path):
+        """ stop watching file. Can be called from any thread """
+        self._pending.append((False, path))
+
+    def _watch(self, notifier, path):
+        """ add kernel watch of path for its state (events used by FileState only) """
+        self._watches[notifier.add_watch(path, AsyncFileNotifier.WATCH_MASK)] = \
+            self._states[path]
+
+    def _unwatch(self, notifier, path, superficial=False):
+        """ remove kernel watch of path (superficial: already removed by kernel) """
+        for wdesc, state in list(self._watches.items()):
+            if state.file_path == path:
+                del self._watches[wdesc]
+        try:
+            notifier.remove_watch(path, superficial)
+        except inotify.calls.InotifyError:
+            notifier.remove_watch(path, superficial=True)
+
+    def _apply_pending(self, notifier):
+        """ apply watch list changes """
+        while self._pending:
+            add, arg = self._pending.popleft()
+            path = arg.path if add else arg
+            if path in self._states:
+                self._unwatch(notifier, path)
+            self._file_list = [file for file in self._file_list if file.path != path]
+
+            if not add:
+                FileNotifierService.LOGGER.info("File %s is removed from watchlist", path)
+                self._states.pop(path, None)
+                continue
+
+            try:
+                if path in self._states:
+                    self._states[path].pattern = arg.pattern
+                else:
+                    self._states[path] = FileState(path, arg.pattern)
+                self._watch(notifier, path)
+                self._file_list.append(arg)
+                FileNotifierService.LOGGER.info("File %s is added to watchlist", path)
+            except (FileNotFoundError, inotify.calls.InotifyError) as exc:
+                FileNotifierService.LOGGER.warning("File %s can't be watched: %s", path, str(exc))
+                self._states.pop(path, None)
 
     @ServiceHandler.onstart
     def prepare_start(self):
@@ -234,25 +436,38 @@ class FileNotifierService(Service):
             run event loop for watching files. Do not call directly, use FileNotifierService.start()
         """
         try:
-            i = inotify.adapters.Inotify([file.path for file in self._file_list])
+            i = inotify.adapters.Inotify()
+            for file in self._file_list:
+                self._watch(i, file.path)
 
             while self._running:
-                for event in i.event_gen(yield_nones=False, timeout_s=1):
+                self.heartbeat()
+                self._apply_pending(i)
+                for event in i.event_gen(yield_nones=True, timeout_s=1):
+                    if event is None:
+                        # poll cycle done: apply watch list changes
+                        self.heartbeat()
+                        self._apply_pending(i)
+                        continue
+
                     if self._callback:
+                        header, _, path, _ = event
+                        state = self._watches.get(header.wd)
+                        ev_data = FileNotifierEvent.from_mask(
+                            header.mask, state.file_path if state is not None else path, state)
                         try:
-                            ev_data = FileNotifierEvent(event)
-
-                            if ev_data.filename in self._states:
-                                ev_data.state = self._states[ev_data.filename]
-                                ev_data.state.on_event(ev_data)
+                            if state is not None:
+                                state.on_event(ev_data)
 
                             self._callback(ev_data)
                         except FileDeleted as fde:
                             file_state = fde.source
                             FileNotifierService.LOGGER.info("File %s is removed from watchlist",
                                                             file_state.file_path)
-                            i.remove_watch(file_state.file_path)
+                            # watch already removed by kernel
+                            self._unwatch(i, file_state.file_path, superficial=True)
                             del self._states[file_state.file_path]
+                            self._callback(ev_data)
 
         except Exception as ex:
             FileNotifierService.LOGGER.error('%s in loop: %s:\n %s',
@@ -262,3 +477,390 @@ class FileNotifierService(Service):
                                            "Stop application")
 
         return 0
+
+class AsyncFileNotifier:
+    """
+        AsyncFileNotifier watches files like FileNotifierService without a thread:
+        the inotify file descriptor is registered in the asyncio event loop and
+        all pending kernel events are parsed from one read when it is readable.
+        The callback is called in event loop thread.
+    """
+    LOGGER = logging.getLogger('logtracker.filenotifier.AsyncFileNotifier')
+    #events used by FileState, static files cache and config reload only
+    WATCH_MASK = inotify.constants.IN_MODIFY | inotify.constants.IN_CLOSE_WRITE | \
+        inotify.constants.IN_ATTRIB | inotify.constants.IN_MOVE_SELF | \
+        inotify.constants.IN_DELETE_SELF
+    HEADER = struct.Struct('iIII')
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, file_list, callb):
+        """
+            Constructor. take file list with file paths to watch.
+            :param file_list: objects with path and pattern attributes
+            :param callb: callback called with FileNotifierEvent
+        """
+        self._file_list = list(file_list)
+        self._callback = callb
+        self._states = dict()
+        #watch descriptor -> FileState: events are dispatched without path lookup
+        self._watches = dict()
+        self._fd = None
+        self._loop = None
+
+    @property
+    def states(self):
+        """ watched files states by path """
+        return self._states
+
+    @property
+    def running(self):
+        """ True if inotify descriptor is registered in event loop """
+        return self._fd is not None
+
+    def start(self, loop=None):
+        """ open inotify descriptor, watch files and register it in event loop """
+        if self._fd is not None:
+            raise RuntimeError("Service already running")
+        self._loop = loop or asyncio.get_event_loop()
+        self._fd = inotify.calls.inotify_init()
+        os.set_blocking(self._fd, False)
+        AsyncFileNotifier.LOGGER.info("Starting AsyncFileNotifier, file list: %s",
+                                      str([file.path for file in self._file_list]))
+        for file in self._file_list:
+            self._add(file)
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def stop(self):
+        """ unregister and close inotify descriptor (call from event loop thread) """
+        if self._fd is None:
+            return
+        AsyncFileNotifier.LOGGER.info("Stopping AsyncFileNotifier")
+        self._loop.remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._watches.clear()
+
+    def add_file(self, file):
+        """
+            watch a new file or update pattern of watched file (see
+            FileNotifierService.add_file). Can be called from any thread.
+        """
+        self._loop.call_soon_threadsafe(self._add, file)
+
+    def remove_file(self, path):
+        """ stop watching file. Can be called from any thread """
+        self._loop.call_soon_threadsafe(self._remove, path)
+
+    def _watch_descriptor(self, path):
+        """ return watch descriptor of path or None """
+        for wdesc, state in self._watches.items():
+            if state.file_path == path:
+                return wdesc
+        return None
+
+    def _remove(self, path):
+        """ remove watch of path and its state """
+        self._unwatch(path)
+        self._states.pop(path, None)
+        self._file_list = [file for file in self._file_list if file.path != path]
+        AsyncFileNotifier.LOGGER.info("File %s is removed from watchlist", path)
+
+    def _unwatch(self, path):
+        """ remove kernel watch of path """
+        wdesc = self._watch_descriptor(path)
+        if wdesc is None:
+            return
+        del self._watches[wdesc]
+        try:
+            inotify.calls.inotify_rm_watch(self._fd, wdesc)
+        except inotify.calls.InotifyError:
+            pass # already removed by kernel
+
+    def _add(self, file):
+        """ watch file, keep position of already watched file """
+        if self._fd is None:
+            return
+        path = file.path
+        self._unwatch(path)
+        self._file_list = [item for item in self._file_list if item.path != path]
+        try:
+            if path in self._states:
+                self._states[path].pattern = file.pattern
+            else:
+                self._states[path] = FileState(path, file.pattern)
+            wdesc = inotify.calls.inotify_add_watch(self._fd, path.encode('utf-8'),
+                                                    AsyncFileNotifier.WATCH_MASK)
+            self._watches[wdesc] = self._states[path]
+            self._file_list.append(file)
+        except (FileNotFoundError, inotify.calls.InotifyError) as exc:
+            AsyncFileNotifier.LOGGER.warning("File %s can't be watched: %s", path, str(exc))
+            self._states.pop(path, None)
+
+    def _read(self):
+        """ read all pending events """
+        data = bytearray()
+        while True:
+            try:
+                chunk = os.read(self._fd, AsyncFileNotifier.READ_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data.extend(chunk)
+            if len(chunk) < AsyncFileNotifier.READ_SIZE:
+                break
+        return data
+
+    def _on_readable(self):
+        """ event loop reader callback: parse and dispatch all pending events """
+        data = self._read()
+        header = AsyncFileNotifier.HEADER
+        offset = 0
+        while offset + header.size <= len(data):
+            wdesc, mask, _, length = header.unpack_from(data, offset)
+            offset += header.size + length
+
+            if mask & inotify.constants.IN_Q_OVERFLOW:
+                self._on_overflow()
+                continue
+            state = self._watches.get(wdesc)
+            if state is None:
+                continue
+            if mask & inotify.constants.IN_IGNORED:
+                # watch removed by kernel (file deleted or unmounted)
+                del self._watches[wdesc]
+                mask &= ~inotify.constants.IN_IGNORED
+            if mask:
+                self._dispatch(FileNotifierEvent.from_mask(mask, state.file_path, state))
+
+    def _on_overflow(self):
+        """ kernel queue overflow: some events are lost, check every file again """
+        AsyncFileNotifier.LOGGER.warning("inotify queue overflow, checking all files")
+        for path, state in list(self._states.items()):
+            self._dispatch(FileNotifierEvent.from_mask(inotify.constants.IN_MODIFY, path, state))
+
+    def _dispatch(self, ev_data):
+        """ update file state (set by caller) and call callback """
+        if ev_data.state is not None:
+            try:
+                ev_data.state.on_event(ev_data)
+            except FileDeleted as fde:
+                path = fde.source.file_path
+                AsyncFileNotifier.LOGGER.info("File %s is removed from watchlist", path)
+                self._unwatch(path)
+                del self._states[path]
+            except FileNotFoundError:
+                ev_data.state = None # removed between event and stat
+        if self._callback:
+            try:
+                self._callback(ev_data)
+            except Exception as exc: # pylint: disable=broad-except
+                AsyncFileNotifier.LOGGER.error('Error in file event callback: %s', str(exc))
+
+class PollingFileNotifier:
+    """
+        PollingFileNotifier watches files with os.stat for filesystems where inotify
+        does not work (NFS, overlay...). Due files are stat-ed in one batch in a
+        worker thread; each file poll interval is reset to min_interval when it
+        changes and doubled up to max_interval while it is idle. Same
+        FileNotifierEvent are emitted as inotify backends, in event loop thread.
+    """
+    LOGGER = logging.getLogger('logtracker.filenotifier.PollingFileNotifier')
+    DEFAULT_MIN_INTERVAL = 0.25
+    DEFAULT_MAX_INTERVAL = 5.0
+    #files due within this delay are stat-ed in the same batch
+    BATCH_DELAY = 0.05
+
+    class _Polled:
+        """ polled file: last stat and poll interval """
+        __slots__ = ('file', 'stat', 'interval', 'due')
+
+        def __init__(self, file, stat, interval):
+            self.file = file
+            self.stat = stat
+            self.interval = interval
+            self.due = 0
+
+    def __init__(self, file_list, callb, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL):
+        """
+            Constructor. take file list with file paths to poll.
+            :param file_list: objects with path and pattern attributes
+            :param callb: callback called with FileNotifierEvent
+            :param min_interval: poll interval (s) of changing files
+            :param max_interval: max poll interval (s) of idle files
+        """
+        self._file_list = list(file_list)
+        self._callback = callb
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._states = dict()
+        self._polled = dict()
+        #heap of (due time, path), entries of removed or rescheduled files are skipped
+        self._heap = []
+        self._loop = None
+        self._handle = None
+        self._wake_at = 0
+        self._polling = False
+        self._running = False
+
+    @property
+    def states(self):
+        """ polled files states by path """
+        return self._states
+
+    @property
+    def running(self):
+        """ True if files are polled """
+        return self._running
+
+    def start(self, loop=None):
+        """ start polling files in event loop """
+        if self._running:
+            raise RuntimeError("Service already running")
+        self._loop = loop or asyncio.get_event_loop()
+        self._running = True
+        PollingFileNotifier.LOGGER.info("Starting PollingFileNotifier, file list: %s",
+                                        str([file.path for file in self._file_list]))
+        for file in self._file_list:
+            self._add(file)
+
+    def stop(self):
+        """ stop polling (call from event loop thread) """
+        if not self._running:
+            return
+        PollingFileNotifier.LOGGER.info("Stopping PollingFileNotifier")
+        self._running = False
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def add_file(self, file):
+        """ poll a new file or update pattern of polled file. Can be called from any thread """
+        self._loop.call_soon_threadsafe(self._add, file)
+
+    def remove_file(self, path):
+        """ stop polling file. Can be called from any thread """
+        self._loop.call_soon_threadsafe(self._remove, path)
+
+    def _add(self, file):
+        """ poll file, keep position of already polled file """
+        path = file.path
+        self._file_list = [item for item in self._file_list if item.path != path]
+        try:
+            if path in self._states:
+                self._states[path].pattern = file.pattern
+            else:
+                self._states[path] = FileState(path, file.pattern)
+            polled = PollingFileNotifier._Polled(file, os.stat(path), self._min_interval)
+        except FileNotFoundError as exc:
+            PollingFileNotifier.LOGGER.warning("File %s can't be polled: %s", path, str(exc))
+            self._states.pop(path, None)
+            return
+        self._file_list.append(file)
+        self._polled[path] = polled
+        self._schedule(polled, time.monotonic())
+        PollingFileNotifier.LOGGER.info("File %s is added to polled files", path)
+
+    def _remove(self, path):
+        """ stop polling file """
+        self._file_list = [file for file in self._file_list if file.path != path]
+        self._polled.pop(path, None)
+        self._states.pop(path, None)
+        PollingFileNotifier.LOGGER.info("File %s is removed from polled files", path)
+
+    def _schedule(self, polled, now):
+        """ push next poll of file and wake up poll timer if needed """
+        polled.due = now + polled.interval
+        heapq.heappush(self._heap, (polled.due, polled.file.path))
+        if not self._polling and self._running and \
+                (self._handle is None or self._wake_at > polled.due):
+            self._arm()
+
+    def _arm(self):
+        """ arm timer for first due file """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._heap and self._running:
+            self._wake_at = self._heap[0][0]
+            self._handle = self._loop.call_later(max(0, self._wake_at - time.monotonic()),
+                                                 self._tick)
+
+    def _tick(self):
+        """ timer callback: stat due files in a worker thread """
+        self._handle = None
+        deadline = time.monotonic() + PollingFileNotifier.BATCH_DELAY
+        due = []
+        while self._heap and self._heap[0][0] <= deadline:
+            when, path = heapq.heappop(self._heap)
+            polled = self._polled.get(path)
+            if polled is not None and polled.due == when:
+                due.append(polled)
+        if not due:
+            self._arm()
+            return
+        self._polling = True
+        future = self._loop.run_in_executor(Service.THREAD_POOL, PollingFileNotifier.stat_all,
+                                            [polled.file.path for polled in due])
+        future.add_done_callback(lambda fut: self._on_stats(due, fut))
+
+    @staticmethod
+    def stat_all(paths):
+        """ return list of os.stat results (None for missing files) """
+        stats = []
+        for path in paths:
+            try:
+                stats.append(os.stat(path))
+            except OSError:
+                stats.append(None)
+        return stats
+
+    def _on_stats(self, due, future):
+        """ compare new stats with previous ones, emit events and reschedule """
+        self._polling = False
+        if not self._running:
+            return
+        now = time.monotonic()
+        for polled, stat in zip(due, future.result()):
+            if self._polled.get(polled.file.path) is not polled:
+                continue # removed or re-added while polling
+            if stat is None:
+                del self._polled[polled.file.path]
+                self._dispatch(polled.file.path, inotify.constants.IN_DELETE_SELF)
+                continue
+
+            previous, polled.stat = polled.stat, stat
+            if stat.st_ino != previous.st_ino or stat.st_dev != previous.st_dev:
+                # file replaced: read new file from beginning
+                state = self._states.get(polled.file.path)
+                if state is not None:
+                    state.rewind()
+                self._dispatch(polled.file.path,
+                               inotify.constants.IN_MOVE_SELF | inotify.constants.IN_MODIFY)
+                polled.interval = self._min_interval
+            elif stat.st_size != previous.st_size or stat.st_mtime_ns != previous.st_mtime_ns:
+                self._dispatch(polled.file.path, inotify.constants.IN_MODIFY)
+                polled.interval = self._min_interval
+            else:
+                polled.interval = min(polled.interval * 2, self._max_interval)
+            self._schedule(polled, now)
+        self._arm()
+
+    def _dispatch(self, path, mask):
+        """ update file state and call callback """
+        ev_data = FileNotifierEvent.from_mask(mask, path, self._states.get(path))
+        if ev_data.state is not None:
+            try:
+                ev_data.state.on_event(ev_data)
+            except FileDeleted:
+                PollingFileNotifier.LOGGER.info("File %s is removed from polled files", path)
+                self._polled.pop(path, None)
+                del self._states[path]
+            except FileNotFoundError:
+                ev_data.state = None # removed between stat and event
+        if self._callback:
+            try:
+                self._callback(ev_data)
+            except Exception as exc: # pylint: disable=broad-except
+                PollingFileNotifier.LOGGER.error('Error in file event callback: %s', str(exc))
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3.6
+
+"""
+    history module: read rotated files of a watched file (syslog, syslog.1,
+    syslog.2.gz...). Gzip archives are indexed with seek points (decompressor
+    state and window saved every few MB, as zlib's zran example) so that reads
+    and searches can start in the middle of an archive.
+"""
+
+import bisect
+import collections
+import logging
+import os
+import os.path
+import re
+import threading
+import zlib
+
+class HistoryError(Exception):
+    """ rotated file can't be read (corrupted archive...) """
+
+class Rotation:
+    """ one file of a rotation chain """
+
+    def __init__(self, path: str, index: int):
+        """
+            constructor
+            :param path: file path
+            :param index: position in chain (0: live file, 1: most recent rotation...)
+        """
+        stat = os.stat(path)
+        self.path = path
+        self.index = index
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.compressed = path.endswith('.gz')
+
+    def to_dict(self):
+        """ json description """
+        return {"index": self.index, "path": self.path, "size": self.size,
+                "mtime": self.mtime, "compressed": self.compressed}
+
+#longer numeric suffixes are dates (dateext: -20200101, -2020-01-01, -1577836800)
+MAX_INDEX_DIGITS = 5
+
+def _rotation_key(path: str, base: str):
+    """
+        sort key of rotated file: rotation index first (path.1, path.2...), then
+        dates (most recent first), then most recently modified
+    """
+    suffix = path[len(base) + 1:]
+    if suffix.endswith('.gz'):
+        suffix = suffix[:-3]
+    if suffix.isdigit() and len(suffix) <= MAX_INDEX_DIGITS:
+        return (0, int(suffix), 0)
+    date = suffix.replace('-', '').replace('_', '')
+    if date.isdigit():
+        return (1, -int(date), 0)
+    return (2, 0, -os.path.getmtime(path))
+
+def rotations(path: str) -> list:
+    """
+        return rotation chain of file: file itself followed by its rotated siblings
+        (path.1, path.2.gz, path-20200101.gz...) from the most recent to the oldest
+        :return: list of Rotation
+    """
+    folder, name = os.path.split(path)
+    chain = [path] if os.path.isfile(path) else []
+    siblings = []
+    try:
+        entries = os.listdir(folder or '.')
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        if entry != name and entry.startswith(name) and entry[len(name)] in '.-':
+            sibling = os.path.join(folder, entry)
+            if os.path.isfile(sibling):
+                siblings.append(sibling)
+    siblings.sort(key=lambda sibling: _rotation_key(sibling, path))
+    chain.extend(siblings)
+
+    result = []
+    for index, item in enumerate(chain):
+        try:
+            result.append(Rotation(item, index))
+        except FileNotFoundError:
+            pass # rotated while listing
+    return result
+
+class PlainReader:
+    """ uncompressed file reader, same interface as GzipIndex """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def read(self, offset: int, size: int) -> bytes:
+        """ return size bytes from offset """
+        with open(self._path, 'rb') as fdesc:
+            fdesc.seek(offset)
+            return fdesc.read(size)
+
+    def chunks(self, offset: int = 0):
+        """ generator of (offset, bytes) from offset to end of file """
+        with open(self._path, 'rb') as fdesc:
+            fdesc.seek(offset)
+            while True:
+                data = fdesc.read(PlainReader.CHUNK_SIZE)
+                if not data:
+                    return
+                yield offset, data
+                offset += len(data)
+
+class GzipIndex:
+    """
+        seek points of a gzip file: for every span of uncompressed data, offsets
+        in both streams and a copy of decompressor (which holds the 32KB window).
+        Multi-member archives (concatenated gzip) are supported.
+    """
+    LOGGER = logging.getLogger('logtracker.history.GzipIndex')
+    CHUNK_SIZE = 64 * 1024
+    #gzip header, max window
+    WBITS = 16 + zlib.MAX_WBITS
+
+    def __init__(self, path: str, span: int = 4 << 20):
+        """
+            constructor: decompress file once to build its seek points
+            :param path: gzip file path
+            :param span: uncompressed bytes between seek points
+        """
+        self._path = path
+        self._span = span
+        #parallel lists: uncompressed offsets, compressed offsets, decompressors
+        self._out = []
+        self._in = []
+        self._states = []
+        self.size = 0
+        self._build()
+
+    @property
+    def points(self):
+        """ number of seek points """
+        return len(self._out)
+
+    def _checkpoint(self, out_offset, in_offset, decomp):
+        self._out.append(out_offset)
+        self._in.append(in_offset)
+        self._states.append(decomp.copy())
+
+    def _build(self):
+        """ decompress whole file and save seek points """
+        decomp = zlib.decompressobj(GzipIndex.WBITS)
+        out_offset = 0
+        in_offset = 0
+        self._checkpoint(0, 0, decomp)
+        with open(self._path, 'rb') as fdesc:
+            data = b''
+            while True:
+                if not data:
+                    data = fdesc.read(GzipIndex.CHUNK_SIZE)
+                    if not data:
+                        break
+                out = decomp.decompress(data, GzipIndex.CHUNK_SIZE)
+                # at end of member, remaining input is in unused_data (and unconsumed_tail)
+                left = decomp.unused_data if decomp.eof else decomp.unconsumed_tail
+                in_offset += len(data) - len(left)
+                out_offset += len(out)
+                if decomp.eof:
+                    # next member of a multi-member archive
+                    data = decomp.unused_data
+                    decomp = zlib.decompressobj(GzipIndex.WBITS)
+                    if data.strip(b'\0'):
+                        self._checkpoint(out_offset, in_offset, decomp)
+                    else:
+                        in_offset += len(data) # zero padding
+                        data = b''
+                else:
+                    data = decomp.unconsumed_tail
+                    if out_offset - self._out[-1] >= self._span:
+                        self._checkpoint(out_offset, in_offset, decomp)
+        self.size = out_offset
+        GzipIndex.LOGGER.info('%s indexed: %d bytes, %d seek points', self._path,
+                              self.size, self.points)
+
+    def chunks(self, offset: int = 0):
+        """
+            generator of (offset, bytes) of uncompressed data from offset to end,
+            decompression starts at closest seek point
+        """
+        point = max(0, bisect.bisect_right(self._out, offset) - 1)
+        out_offset = self._out[point]
+        decomp = self._states[point].copy()
+        with open(self._path, 'rb') as fdesc:
+            fdesc.seek(self._in[point])
+            data = b''
+            while True:
+                if not data:
+                    data = fdesc.read(GzipIndex.CHUNK_SIZE)
+                    if not data:
+                        return
+                out = decomp.decompress(data, GzipIndex.CHUNK_SIZE)
+                if decomp.eof:
+                    data = decomp.unused_data
+                    decomp = zlib.decompressobj(GzipIndex.WBITS)
+                    if not data.strip(b'\0'):
+                        data = b''
+                else:
+                    data = decomp.unconsumed_tail
+                end = out_offset + len(out)
+                if end > offset:
+                    start = max(0, offset - out_offset)
+                    yield out_offset + start, out[start:]
+                out_offset = end
+
+    def read(self, offset: int, size: int) -> bytes:
+        """ return size bytes of uncompressed data from offset """
+        result = bytearray()
+        for _, data in self.chunks(offset):
+            result.extend(data[:size - len(result)])
+            if len(result) >= size:
+                break
+        return bytes(result)
+
+def lines(reader, offset: int = 0):
+    """ generator of (offset, line) of complete lines starting at or after offset """
+    pending = bytearray()
+    # start one byte before to know whether offset is a line start
+    skip = offset > 0
+    start = offset - skip
+    for chunk_offset, data in reader.chunks(start):
+        if not pending:
+            start = chunk_offset
+        pending.extend(data)
+        begin = 0
+        end = pending.find(b'\n')
+        while end >= 0:
+            if not skip:
+                yield start + begin, bytes(pending[begin:end])
+            skip = False
+            begin = end + 1
+            end = pending.find(b'\n', begin)
+        del pending[:begin]
+        start += begin
+    if pending:
+        yield start, bytes(pending)
+
+class History:
+    """ cache of readers (gzip indexes are built once per archive version) """
+    LOGGER = logging.getLogger('logtracker.history.History')
+
+    def __init__(self, span: int = 4 << 20, max_indexes: int = 16):
+        """
+            constructor
+            :param span: uncompressed bytes between seek points of gzip indexes
+            :param max_indexes: max gzip indexes kept in memory (least recently used dropped)
+        """
+        self._span = span
+        self._max_indexes = max_indexes
+        self._indexes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, span: int, max_indexes: int):
+        """ change index parameters, drop cached indexes """
+        with self._lock:
+            self._span = span
+            self._max_indexes = max_indexes
+            self._indexes.clear()
+
+    def reader(self, rotation: Rotation):
+        """
+            return reader of rotated file (PlainReader or GzipIndex)
+            :raise HistoryError: archive can't be indexed
+        """
+        if not rotation.compressed:
+            return PlainReader(rotation.path)
+
+        key = (rotation.path, rotation.size, rotation.mtime)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        try:
+            index = GzipIndex(rotation.path, self._span)
+        except (OSError, zlib.error) as exc:
+            raise HistoryError("%s: %s" % (rotation.path, str(exc)))
+        with self._lock:
+            self._indexes[key] = index
+            while len(self._indexes) > self._max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def read(self, rotation: Rotation, offset: int, size: int):
+        """
+            return (records, next offset) of complete lines read from offset,
+            at most size bytes unless a single line is larger
+        """
+        records = []
+        next_offset = offset
+        for line_offset, line in lines(self.reader(rotation), offset):
+            if records and line_offset + len(line) - offset > size:
+                break
+            records.append(line.decode('utf-8', 'replace'))
+            next_offset = line_offset + len(line) + 1
+        return records, next_offset
+
+    def search(self, rotation: Rotation, pattern: str, offset: int = 0, limit: int = 100):
+        """
+            return (matches, next offset): list of (offset, line) of lines matching
+            regular expression pattern from offset, at most limit matches
+        """
+        try:
+            regex = re.compile(pattern.encode('utf-8'))
+        except re.error as exc:
+            raise ValueError("invalid pattern: %s" % str(exc))
+        matches = []
+        next_offset = None
+        for line_offset, line in lines(self.reader(rotation), offset):
+            if regex.search(line):
+                if len(matches) >= limit:
+                    next_offset = line_offset
+                    break
+                matches.append((line_offset, line.decode('utf-8', 'replace')))
+        return matches, next_offset
+
+HISTORY = History()
+
+def open_rotation(path: str, index: int) -> Rotation:
+    """ return rotation index of file rotation chain, raise IndexError if missing """
+    chain = rotations(path)
+    if index < 0 or index >= len(chain):
+        raise IndexError("no rotation %d for %s" % (index, path))
+    return chain[index]
@@ -1,6 +1,10 @@
-
 const colors = ["blue", "red", "green", "yellow", "black", "purple", "pink", "grey"];
 
+// height (px) of a rendered line, see .line style in index.html
+const LINE_HEIGHT = 20;
+// browsers limit element height: above it scroll position is scaled
+const MAX_SCROLL_HEIGHT = 15000000;
+
 var http_req = function(url, opt) {
 	const request = new Request(url, opt);
 	return fetch(request)
@@ -13,10 +17,98 @@ var http_req = function(url, opt) {
 		});
 };
 
+// renders the visible lines of the worker view in a pool of reused nodes:
+// DOM size depends on viewport height, not on number of retained lines
+class LogView {
+	constructor(scroller, colorof){
+		this._scroller = scroller;
+		this._spacer = scroller.querySelector(".spacer");
+		this._lines = scroller.querySelector(".lines");
+		this._colorof = colorof;
+		this._nodes = [];
+		this._count = 0;
+		this._follow = true;
+		this._frame = null;
+		this._requestId = 0;
+		this.onrange = null; // function(start, count, id) asking worker for lines
+		scroller.addEventListener("scroll", () => this.onscroll());
+		window.addEventListener("resize", () => this.update());
+	}
+
+	get scale(){
+		return Math.max(1, this._count * LINE_HEIGHT / MAX_SCROLL_HEIGHT);
+	}
+
+	setcount(count){
+		this._count = count;
+		this.update();
+	}
+
+	onscroll(){
+		var scroller = this._scroller;
+		this._follow = scroller.scrollTop + scroller.clientHeight >= scroller.scrollHeight - LINE_HEIGHT;
+		this.update();
+	}
+
+	// render once per animation frame whatever the number of updates
+	update(){
+		if (this._frame === null)
+			this._frame = requestAnimationFrame(() => this.render());
+	}
+
+	render(){
+		this._frame = null;
+		var scroller = this._scroller;
+		var height = this._count * LINE_HEIGHT / this.scale;
+		this._spacer.style.height = height + "px";
+		if (this._follow)
+			scroller.scrollTop = height;
+
+		var visible = Math.ceil(scroller.clientHeight / LINE_HEIGHT) + 1;
+		var first = Math.floor(scroller.scrollTop * this.scale / LINE_HEIGHT);
+		first = Math.max(0, Math.min(first, this._count - visible + 1));
+		this._first = first;
+		if (this.onrange)
+			this.onrange(first, visible, ++this._requestId);
+	}
+
+	// lines received from worker: [[text, path, repeat, time]...] of view lines from start
+	draw(id, start, lines){
+		if (id != this._requestId)
+			return; // scrolled meanwhile, newer range requested
+		while (this._nodes.length < lines.length){
+			let node = document.createElement("div");
+			this._lines.appendChild(node);
+			this._nodes.push(node);
+		}
+		this._lines.style.transform = "translateY(" +
+			(start * LINE_HEIGHT / this.scale) + "px)";
+		for (let i = 0; i < this._nodes.length; i++){
+			let node = this._nodes[i];
+			if (i < lines.length){
+				let className = "line " + this._colorof(lines[i][1]);
+				if (node.className != className)
+					node.className = className;
+				let text = lines[i][0];
+				if (lines[i][2] > 1)
+					text += "  [x" + lines[i][2] + ", last " +
+						new Date(lines[i][3] * 1000).toLocaleTimeString() + "]";
+				if (node.textContent != text)
+					node.textContent = text;
+				node.style.display = "";
+			}
+			else
+				node.style.display = "none";
+		}
+	}
+}
+
 class Application extends EventTarget {
 	constructor(){
 		super();
 		this._config = null;
+		this._worker = null;
+		this._view = null;
 	}
 
 	get config(){
@@ -26,26 +118,64 @@ class Application extends EventTarget {
 		let event = new CustomEvent(eventname, {detail: arg});
 		app.dispatchEvent(event);
 	}
+	colorof(path){
+		var file = this._config.files.find(f => f.path == path);
+		return file ? file.color : "grey";
+	}
+	// websocket messages are parsed by worker, see worker.js
 	wsconnect() {
-		var url = this._config.ws.url;
-		this._webSocket = new WebSocket(url);
-		this._webSocket.onopen = function(event){
-			console.log("WS Connected");
-		}
-		this._webSocket.onmessage = function(event){
-			console.log("WS Connected");
-		}
+		var self = this;
+		this._worker = new Worker("worker.js");
+		this._worker.onmessage = function(event){
+			var message = event.data;
+			switch (message.type){
+			case "config":
+				self._config.files = message.files;
+				self.assigncolors();
+				self._worker.postMessage({type: "files", files: message.files});
+				break;
+			case "count":
+				self.onstatus(message);
+				self._view.setcount(message.count);
+				break;
+			case "range":
+				self._view.draw(message.id, message.start, message.lines);
+				break;
+			case "error":
+				$("#status").text(message.message);
+				break;
+			}
+		};
+		this._worker.postMessage({type: "connect", url: this._config.ws.url,
+		                          events: this._config.ws.events, files: this._config.files});
 	}
 	startlogtracker(){
 		console.log("start logtracking...");
+		var self = this;
+		this._view = new LogView(document.getElementById("logpanel"), path => self.colorof(path));
+		this._view.onrange = function(start, count, id){
+			self._worker.postMessage({type: "range", id: id, start: start, count: count});
+		};
+		$("#filter").on("change", () => self.onfilter());
 		this.wsconnect();
 	}
 
+	onfilter(){
+		this._worker.postMessage({type: "filter", regex: $("#filter").val()});
+	}
+
+	onstatus(message){
+		var status = message.count + " / " + message.total + " lines";
+		if (message.sampled.length)
+			status += " - sampled: " + message.sampled.join(", ");
+		$("#status").text(status).toggleClass("sampled", message.sampled.length > 0);
+	}
+
 	onready(){
 		var self = this;
 		Promise.all([http_req("/ws"), http_req("/files")])
 		.then(values => {
-			var client_config = {}; 
+			var client_config = {};
 			client_config.ws = values[0];
 			client_config.files = values[1];
 			self.triggerEvent("config", client_config);
@@ -53,10 +183,7 @@ class Application extends EventTarget {
 		.catch(err => { console.error(err); });
 	}
 
-	onconfig(event){
-		console.log("config loaded", event.detail);
-		this._config = event.detail;
-
+	assigncolors(){
 		var done_colors = [];
 
 		for (let i in this._config.files){
@@ -65,15 +192,21 @@ class Application extends EventTarget {
 
 				var available = colors.filter(col => done_colors.indexOf(col)==-1);
 				if (available.length > 0){
-					f.color = available[0];			
+					f.color = available[0];
 					done_colors.push(f.color);
 				}
 			}
 			else
 			{
-				done_colors.push(f.color);			
+				done_colors.push(f.color);
 			}
 		}
+	}
+
+	onconfig(event){
+		console.log("config loaded", event.detail);
+		this._config = event.detail;
+		this.assigncolors();
 		this.triggerEvent("start",null);
 	}
 }
@@ -83,4 +216,4 @@ var app = new Application();
 app.addEventListener("config", app.onconfig);
 app.addEventListener("start", app.startlogtracker);
 
-$(document).ready(() => app.onready());
\ No newline at end of file
+$(document).ready(() => app.onready());
@@ -0,0 +1,208 @@
+// Web Worker of logtracker page: owns the websocket, parses records messages,
+// keeps retained lines and applies the filter. The page only asks for the
+// lines of its viewport (virtual scrolling).
+//
+// page -> worker: {type: "connect", url, events, files} events: event stream path
+//                 {type: "files", files}                 files list changed
+//                 {type: "filter", regex, files}         regex (string) and set of paths
+//                 {type: "range", id, start, count}      lines of view [start, start+count)
+// worker -> page: {type: "config", files}                files list pushed by server
+//                 {type: "count", count, total, sampled} lines in view, received, sampled paths
+//                 {type: "range", id, start, lines: [[text, file path, repeat, time]...]}
+//                 (repeat: count of collapsed repeated line, time: last seen time)
+//                 {type: "error", message}
+
+const MAX_LINES = 1000000;
+// min delay (ms) between two count messages: the page renders once per frame anyway
+const COUNT_DELAY = 16;
+const RETRY_DELAY = 2000;
+// collapsed lines of evicted lines are forgotten above this number
+const MAX_REPEATS = 10000;
+
+// ring buffer of retained lines: line n (absolute number) is at n % MAX_LINES
+class LineBuffer {
+	constructor(capacity){
+		this.capacity = capacity;
+		this.texts = new Array(capacity);
+		this.files = new Uint16Array(capacity);
+		this.total = 0;
+	}
+	get first(){
+		return Math.max(0, this.total - this.capacity);
+	}
+	push(text, file){
+		var i = this.total % this.capacity;
+		this.texts[i] = text;
+		this.files[i] = file;
+		return this.total++;
+	}
+	text(n){
+		return this.texts[n % this.capacity];
+	}
+	file(n){
+		return this.files[n % this.capacity];
+	}
+}
+
+// lines numbers of buffer matching filter, oldest ones removed with buffer ones
+class View {
+	constructor(capacity){
+		this.capacity = capacity;
+		this.ids = new Float64Array(capacity);
+		this.start = 0;
+		this.end = 0;
+	}
+	get count(){
+		return this.end - this.start;
+	}
+	clear(){
+		this.start = this.end = 0;
+	}
+	push(n){
+		this.ids[this.end++ % this.capacity] = n;
+	}
+	get(i){
+		return this.ids[(this.start + i) % this.capacity];
+	}
+	evict(first){
+		while (this.start < this.end && this.ids[this.start % this.capacity] < first)
+			this.start++;
+	}
+}
+
+var buffer = new LineBuffer(MAX_LINES);
+var view = new View(MAX_LINES);
+var files = [];        // file paths, index stored in buffer
+var fileIndex = new Map();
+var filter = {regex: null, files: null};
+var sampled = new Set();
+var repeats = new Map(); // line number -> [count, last seen time] of collapsed lines
+var lastLines = new Map(); // file index -> [seq, line number] of last line
+var countTimer = null;
+var socket = null;
+
+function indexOf(path){
+	var index = fileIndex.get(path);
+	if (index === undefined){
+		index = files.length;
+		files.push(path);
+		fileIndex.set(path, index);
+	}
+	return index;
+}
+
+function matches(text, file){
+	if (filter.files !== null && !filter.files.has(files[file]))
+		return false;
+	return filter.regex === null || filter.regex.test(text);
+}
+
+function postCount(){
+	countTimer = null;
+	postMessage({type: "count", count: view.count, total: buffer.total,
+	             sampled: Array.from(sampled)});
+}
+
+function scheduleCount(){
+	if (countTimer === null)
+		countTimer = setTimeout(postCount, COUNT_DELAY);
+}
+
+function onRecords(message){
+	var file = indexOf(message.file);
+	if (message.sampled)
+		sampled.add(message.file);
+	else
+		sampled.delete(message.file);
+	var firstLine = buffer.total;
+	for (let record of message.records){
+		let n = buffer.push(record, file);
+		view.evict(buffer.first);
+		if (matches(record, file))
+			view.push(n);
+	}
+	for (let [seq, count, time] of message.repeats || []){
+		let last = lastLines.get(file);
+		let n = seq >= message.seq ? firstLine + seq - message.seq :
+			(last !== undefined && last[0] == seq ? last[1] : -1);
+		if (n >= buffer.first)
+			repeats.set(n, [count, time]);
+	}
+	if (message.records.length)
+		lastLines.set(file, [message.seq + message.records.length - 1, buffer.total - 1]);
+	if (repeats.size > MAX_REPEATS){
+		for (let n of repeats.keys())
+			if (n < buffer.first)
+				repeats.delete(n);
+	}
+	scheduleCount();
+}
+
+function refilter(){
+	view.clear();
+	for (let n = buffer.first; n < buffer.total; n++){
+		if (matches(buffer.text(n), buffer.file(n)))
+			view.push(n);
+	}
+	scheduleCount();
+}
+
+function onServerMessage(event){
+	var message = JSON.parse(event.data);
+	if (message.type == "config")
+		postMessage({type: "config", files: message.files});
+	else
+		onRecords(message);
+}
+
+// websocket, or Server-Sent Events stream (events: path) when websocket never
+// opens (proxy blocking it). EventSource reconnects and resumes by itself.
+function connect(url, events){
+	var opened = false;
+	socket = new WebSocket(url);
+	socket.onmessage = onServerMessage;
+	socket.onopen = function(){
+		opened = true;
+	};
+	socket.onclose = function(){
+		if (!opened && events){
+			socket = new EventSource(events);
+			socket.onmessage = onServerMessage;
+		}
+		else
+			setTimeout(() => connect(url, events), RETRY_DELAY);
+	};
+}
+
+onmessage = function(event){
+	var message = event.data;
+	switch (message.type){
+	case "connect":
+		message.files.forEach(f => indexOf(f.path));
+		connect(message.url, message.events);
+		break;
+	case "files":
+		message.files.forEach(f => indexOf(f.path));
+		break;
+	case "filter":
+		try {
+			filter.regex = message.regex ? new RegExp(message.regex) : null;
+		} catch (err) {
+			postMessage({type: "error", message: err.message});
+			return;
+		}
+		filter.files = message.files ? new Set(message.files) : null;
+		refilter();
+		break;
+	case "range":
+		var end = Math.min(message.start + message.count, view.count);
+		var lines = [];
+		for (let i = Math.max(0, message.start); i < end; i++){
+			let n = view.get(i);
+			let repeat = repeats.get(n) || [0, 0];
+			lines.push([buffer.text(n), files[buffer.file(n)], repeat[0], repeat[1]]);
+		}
+		postMessage({type: "range", id: message.id, start: message.start, lines: lines});
+		break;
+	}
+};
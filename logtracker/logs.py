@@ -0,0 +1,128 @@
+#!/usr/bin/env python3.6
+
+"""
+    logs module: application logs are queued and written by a background thread
+    so that the event loop never blocks on disk or console. Each call site is
+    rate limited and suppressed messages are summarized.
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+
+#level of logs emitted for each event on hot path (event dispatch, ws messages...)
+HOTPATH_LEVEL = logging.DEBUG
+
+class RateLimitFilter(logging.Filter):
+    """
+        let at most rate records per call site (file and line) pass during period.
+        first record of next period reports number of suppressed records
+    """
+
+    def __init__(self, rate: int = 10, period: float = 1.0):
+        """
+            constructor
+            :param rate: max number of records per call site and period (0: no limit)
+            :param period: period duration in seconds
+        """
+        super().__init__()
+        self._rate = rate
+        self._period = period
+        self._sites = dict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        """ return False if record must be dropped """
+        if self._rate <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or record.created - site[0] >= self._period:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [record.created, 1, 0]
+                if suppressed:
+                    record.msg = '%s (suppressed %d messages)' % (record.getMessage(), suppressed)
+                    record.args = None
+                return True
+            if site[1] < self._rate:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+    def pending(self):
+        """ return list of (pathname, lineno, suppressed count) not reported yet """
+        with self._lock:
+            return [key + (site[2],) for key, site in self._sites.items() if site[2]]
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ QueueHandler which drops records when queue is full instead of blocking """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+LISTENER = None
+HANDLER = None
+
+def setup(log_file: str, level=logging.INFO, hotpath_level=logging.DEBUG,
+          rate: int = 10, queue_size: int = 10000):
+    """
+        set up 'logtracker' logger: records are queued and written to log_file and
+        console by a listener thread
+        :param log_file: log file path
+        :param level: logger level
+        :param hotpath_level: level of logs emitted on hot path
+        :param rate: max records per call site and second (0: no limit)
+        :param queue_size: max queued records, next ones are dropped
+    """
+    global LISTENER, HANDLER, HOTPATH_LEVEL # pylint: disable=global-statement
+    shutdown()
+
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fhandler = logging.FileHandler(log_file)
+    chandler = logging.StreamHandler()
+    fhandler.setFormatter(formatter)
+    chandler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    HANDLER = DroppingQueueHandler(log_queue)
+    if rate > 0:
+        HANDLER.addFilter(RateLimitFilter(rate))
+    LISTENER = logging.handlers.QueueListener(log_queue, fhandler, chandler)
+    LISTENER.start()
+    HOTPATH_LEVEL = hotpath_level
+
+    logger = logging.getLogger('logtracker')
+    logger.setLevel(level)
+    logger.addHandler(HANDLER)
+
+def shutdown():
+    """ report suppressed messages, write queued records and stop listener thread """
+    global LISTENER, HANDLER # pylint: disable=global-statement
+    if LISTENER is None:
+        return
+
+    logger = logging.getLogger('logtracker.logs')
+    pending = [item for rate_filter in HANDLER.filters for item in rate_filter.pending()]
+    if pending:
+        logger.warning('messages suppressed: %s', ', '.join('%s:%d (%d)' % item
+                                                            for item in pending))
+    if HANDLER.dropped:
+        logger.warning('%d messages dropped (log queue full)', HANDLER.dropped)
+
+    logging.getLogger('logtracker').removeHandler(HANDLER)
+    LISTENER.stop()
+    for handler in LISTENER.handlers:
+        handler.close()
+    LISTENER = None
+    HANDLER = None
@@ -4,109 +4,510 @@
     MAIN
 """
 import sys
+import json
 import logging
 import asyncio
+import os.path
+import inotify.constants
+import logtracker.alerts
+import logtracker.assets
+import logtracker.budget
+import logtracker.cluster
 import logtracker.config
+import logtracker.fanout
 import logtracker.servers
 import logtracker.filenotifier
+import logtracker.history
 import logtracker.event
+import logtracker.logs
+import logtracker.stream
+import logtracker.store
+import logtracker.tail
 
 class Application:
     """ Application class: glue for all components/services """
 
-    def __init__(self):
+    LOGGER = logging.getLogger('logtracker.Application')
+    #delay before reloading modified config file (editors write in several steps)
+    RELOAD_DELAY = 0.2
+    CONFIG_EVENTS = inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVE_SELF | \
+        inotify.constants.IN_ATTRIB | inotify.constants.IN_DELETE_SELF
+    #websocket pushes: one at a time (records order), oldest dropped above backlog
+    PUSH_CONCURRENCY = 1
+    PUSH_BACKLOG = 1000
+
+    def __init__(self, config_file=None):
+        self._config_file = config_file
         self._http = None
         self._ws = None
         self._file_notifier = None
+        self._poll_notifier = None
+        self._internal_notifier = None
+        self._assets = None
+        self._loop = None
+        self._reload_handle = None
+        self._forwarder = None
+        self._aggregator = None
+        self._tail = None
         self._event_manager = logtracker.event.Manager()
+        self._record_stream = logtracker.stream.RecordStream(self._event_manager,
+                                                             Application.file_limits,
+                                                             Application.file_collapse,
+                                                             Application.extract_sizes)
 
-        def on_message(message):
-            #logtracker.event.Manager.LOOP.run_until_complete(ws_server.push_message(message))
-            asyncio.Task(self._ws.push_message(message), loop=logtracker.event.Manager.LOOP)
+        async def on_message(message):
+            if self._ws is not None:
+                await self._ws.push_message(message.to_json())
 
-        self._filenotif_cb = on_message
+        self._records_cb = on_message
 
-    @staticmethod
-    def load_config():
+    def load_config(self):
         """ load app configuration """
-        if len(sys.argv) > 1:
-            logtracker.config.load(file=sys.argv[1])
-        else:
-            logtracker.config.load()
+        if not self._config_file:
+            self._config_file = sys.argv[1] if len(sys.argv) > 1 else 'config.yaml'
+        logtracker.config.load(file=self._config_file)
 
         conf = logtracker.config.get()
-        conf.init_logs(conf.logs.folder, conf.logs.prefix)
+        logtracker.history.HISTORY.configure(conf.history.index_span_mb << 20,
+                                             conf.history.max_indexes)
+        conf.init_logs(conf.logs.folder, conf.logs.prefix, conf.logs.level,
+                       conf.logs.hotpath_level, conf.logs.rate_limit, conf.logs.queue_size)
 
     def start_http(self):
         """ start http service """
         http_config = logtracker.config.get().server.http
-        http = logtracker.servers.HttpServer(http_config.host, http_config.port)
-        http.start()
+        if http_config.mode == 'shared':
+            return # served by websocket server
+        if http_config.mode == 'async':
+            http = logtracker.servers.AsyncHttpServer(http_config.host, http_config.port)
+            http.start()
+            self._event_manager.register_event(logtracker.stream.RecordsEvent,
+                                               http.events.on_records)
+        else:
+            http = logtracker.servers.HttpServer(http_config.host, http_config.port)
+            logtracker.event.SUPERVISOR.supervise(http)
         self._http = http
 
     def stop_http(self):
         """ stop http service """
         if self._http:
+            if isinstance(self._http, logtracker.servers.AsyncHttpServer):
+                self._event_manager.unregister_event(logtracker.stream.RecordsEvent,
+                                                     self._http.events.on_records)
+            logtracker.event.SUPERVISOR.release(self._http)
             self._http.stop()
             self._http = None
 
+    def start_internal_notifier(self):
+        """ watch static files (cache invalidation) and config file (hot reload) """
+        http_config = logtracker.config.get().server.http
+        self._assets = logtracker.assets.get_cache(http_config.html, http_config.cache_max_age)
+        files = [logtracker.filenotifier.WatchedFile(path) for path in self._assets.preload()]
+        files.append(logtracker.filenotifier.WatchedFile(os.path.abspath(self._config_file)))
+        self._internal_notifier = self.start_notifier(files, self.on_internal_event,
+                                                      'InternalNotifier')
+        # files added to html folder later are watched once requested
+        self._assets.watch = self.watch_asset
+
+    def stop_internal_notifier(self):
+        """ stop watching static files and config file """
+        if self._assets is not None:
+            self._assets.watch = None
+        if self._internal_notifier:
+            self.stop_notifier(self._internal_notifier)
+            self._internal_notifier = None
+
+    def on_internal_event(self, file_event):
+        """ internal files notifications (called from notifier thread or event loop) """
+        if file_event.filename == os.path.abspath(self._config_file):
+            if file_event.has(Application.CONFIG_EVENTS):
+                self._loop.call_soon_threadsafe(self.schedule_reload)
+        elif self._assets.on_file_event(file_event):
+            # editors and deployments replace files: watch new file once written
+            self._loop.call_soon_threadsafe(self._loop.call_later, Application.RELOAD_DELAY,
+                                            self.watch_asset, file_event.filename)
+
+    def watch_asset(self, path):
+        """ watch new or replaced static file (skipped if it was deleted) """
+        if self._internal_notifier and os.path.isfile(path):
+            self._internal_notifier.add_file(logtracker.filenotifier.WatchedFile(path))
+
+    def schedule_reload(self):
+        """ reload config after a delay, postponed by each new modification """
+        if self._reload_handle is not None:
+            self._reload_handle.cancel()
+        self._reload_handle = self._loop.call_later(Application.RELOAD_DELAY,
+                                                    self.reload_config)
+
+    def reload_config(self):
+        """ reload config file and apply watched files changes only """
+        self._reload_handle = None
+        config_path = os.path.abspath(self._config_file)
+        # config file may have been replaced by a new file: watch it again
+        if self._internal_notifier:
+            self._internal_notifier.add_file(logtracker.filenotifier.WatchedFile(config_path))
+
+        old = logtracker.config.get()
+        try:
+            new = logtracker.config.load(file=self._config_file)
+        except Exception as exc: # pylint: disable=broad-except
+            Application.LOGGER.error("Invalid config file %s, not reloaded: %s",
+                                     config_path, str(exc))
+            return
+
+        added, removed, changed = logtracker.config.diff_files(old.files, new.files)
+        self._record_stream.reset_files([file.path for file in removed + changed])
+        # rebuilding engine would reset rules counters and cooldowns
+        if logtracker.config.alerts_changed(old.alerts, new.alerts):
+            self.stop_alerts()
+            self.start_alerts()
+        Application.LOGGER.info("Config reloaded: %d file(s) added, %d removed, %d changed",
+                                len(added), len(removed), len(changed))
+        if not (added or removed or changed):
+            return
+
+        if self._file_notifier:
+            old_watch = {file.path: file.watch for file in old.files}
+            for file in removed:
+                self.notifier_for(file).remove_file(file.path)
+            for file in added + changed:
+                if file.path in old_watch and old_watch[file.path] != file.watch:
+                    self.notifier_for(old_watch[file.path]).remove_file(file.path)
+                self.notifier_for(file).add_file(file)
+
+        self.push_files()
+
+    @staticmethod
+    def file_limits(path):
+        """ return (max lines/s, max bytes/s) of watched file """
+        conf = logtracker.config.get()
+        for file in conf.files:
+            if file.path == path:
+                return file.max_lines_per_s, file.max_bytes_per_s
+        return conf.limits.max_lines_per_s, conf.limits.max_bytes_per_s
+
+    @staticmethod
+    def extract_sizes():
+        """ return (max record size, max bytes of a file extracted at once) in bytes """
+        limits = logtracker.config.get().limits
+        return limits.max_record_kb << 10, limits.tick_read_kb << 10
+
+    @staticmethod
+    def file_collapse(path):
+        """ return repeated records collapse mode of watched file """
+        for file in logtracker.config.get().files:
+            if file.path == path:
+                return file.collapse
+        return 'none'
+
+    def push_files(self):
+        """ send new files list to browsers or to aggregator """
+        if self._forwarder:
+            self._forwarder.update_files(logtracker.servers.local_files_list())
+        message = json.dumps({"type": "config", "files": logtracker.servers.files_list()})
+        if self._ws:
+            asyncio.Task(self._ws.push_message(message), loop=self._loop)
+        if isinstance(self._http, logtracker.servers.AsyncHttpServer):
+            self._http.events.publish(message)
+        if self._tail:
+            self._tail.push_files()
+
+    def start_notifier(self, files, callback, name):
+        """
+            start a file notifier with configured backend: supervised thread service
+            or inotify descriptor read by event loop (callback called in loop thread)
+        """
+        if logtracker.config.get().notifier.backend == 'async':
+            notifier = logtracker.filenotifier.AsyncFileNotifier(files, callback)
+            notifier.start(self._loop)
+        else:
+            notifier = logtracker.filenotifier.FileNotifierService(files, callback)
+            logtracker.event.SUPERVISOR.supervise(notifier, name=name)
+        return notifier
+
+    @staticmethod
+    def stop_notifier(notifier):
+        """ stop notifier started by start_notifier """
+        logtracker.event.SUPERVISOR.release(notifier)
+        notifier.stop()
+
+    def notifier_for(self, file):
+        """ return notifier of file (or watch mode): polling or inotify one """
+        watch = getattr(file, 'watch', file)
+        return self._poll_notifier if watch == 'poll' else self._file_notifier
+
     def start_files_notifier(self):
-        """ start file notifier service """
-        fnotifier_service = logtracker.filenotifier.FileNotifierService(
-            logtracker.config.get().files, self.on_file_event)
+        """ start file notifiers: inotify backend and polling for 'watch: poll' files """
+        conf = logtracker.config.get()
+        if conf.notifier.backend == 'async':
+            callback = self._event_manager.post_event # already in event loop thread
+        else:
+            callback = self.on_file_event
 
-        fnotifier_service.start()
-        self._file_notifier = fnotifier_service
+        self._event_manager.register_event(
+            logtracker.filenotifier.FileNotifierEvent, self._record_stream.on_file_event)
+        self._file_notifier = self.start_notifier(
+            [file for file in conf.files if file.watch != 'poll'], callback,
+            'FileNotifierService')
+        self._poll_notifier = logtracker.filenotifier.PollingFileNotifier(
+            [file for file in conf.files if file.watch == 'poll'], self._event_manager.post_event,
+            conf.notifier.poll_min_ms / 1000, conf.notifier.poll_max_ms / 1000)
+        self._poll_notifier.start(self._loop)
 
     def stop_files_notifier(self):
         """ stop file notifier service """
         if self._file_notifier:
-            self._file_notifier.stop()
+            self.stop_notifier(self._file_notifier)
+            self._poll_notifier.stop()
             self._file_notifier = None
+            self._poll_notifier = None
+            self._event_manager.unregister_event(
+                logtracker.filenotifier.FileNotifierEvent, self._record_stream.on_file_event)
 
     def start_ws_server(self):
         """ start websocket server """
         host = logtracker.config.get().server.websocket.host
         port = logtracker.config.get().server.websocket.port
-        ws_server = logtracker.servers.WSServer(host, port)
+        workers = logtracker.config.get().server.websocket.workers
+        window = logtracker.config.get().server.websocket.timeline_window_ms / 1000
+        if workers:
+            ws_server = logtracker.fanout.WSWorkerPool(host, port, workers, window)
+        else:
+            shared = logtracker.config.get().server.http.mode == 'shared'
+            ws_server = logtracker.servers.WSServer(host, port, serve_http=shared,
+                                                    timeline_window=window)
+            self._event_manager.register_event(logtracker.stream.RecordsEvent,
+                                               ws_server.on_records)
         ws_server.start()
         self._ws = ws_server
 
-        self._event_manager.register_event(
-            logtracker.filenotifier.FileNotifierEvent, self._filenotif_cb)
+        self._event_manager.register_event(logtracker.stream.RecordsEvent, self._records_cb,
+                                           Application.PUSH_CONCURRENCY,
+                                           Application.PUSH_BACKLOG)
 
     def stop_ws_server(self):
         """ stop service """
         if self._ws:
-            self._event_manager.unregister_event(
-                logtracker.filenotifier.FileNotifierEvent, self._filenotif_cb)
+            self._event_manager.unregister_event(logtracker.stream.RecordsEvent,
+                                                 self._records_cb)
+            if isinstance(self._ws, logtracker.servers.WSServer):
+                self._event_manager.unregister_event(logtracker.stream.RecordsEvent,
+                                                     self._ws.on_records)
             self._ws.stop()
             self._ws = None
 
+    def start_forwarder(self):
+        """ agent role: forward records to aggregator instead of browsers """
+        cluster = logtracker.config.get().cluster
+        self._forwarder = logtracker.cluster.Forwarder(
+            cluster.aggregator_url, cluster.agent_name, logtracker.servers.local_files_list(),
+            cluster.batch_ms / 1000, cluster.batch_max_kb * 1024)
+        self._forwarder.start(self._loop)
+        self._event_manager.register_event(logtracker.stream.RecordsEvent,
+                                           self._forwarder.on_records)
+
+    def stop_forwarder(self):
+        """ stop forwarding records """
+        if self._forwarder:
+            self._event_manager.unregister_event(logtracker.stream.RecordsEvent,
+                                                 self._forwarder.on_records)
+            self._forwarder.stop()
+            self._forwarder = None
+
+    def start_aggregator(self):
+        """ aggregator role: accept agents, their files are served with local ones """
+        cluster = logtracker.config.get().cluster
+        self._aggregator = logtracker.cluster.Aggregator(
+            cluster.agent_host, cluster.agent_port, self._event_manager, self.push_files)
+        logtracker.cluster.AGGREGATOR = self._aggregator
+        asyncio.Task(self._aggregator.start(), loop=self._loop)
+
+    def stop_aggregator(self):
+        """ stop accepting agents """
+        if self._aggregator:
+            self._aggregator.stop()
+            logtracker.cluster.AGGREGATOR = None
+            self._aggregator = None
+
+    def start_tail_server(self):
+        """ serve 'logtracker tail' clients on Unix socket """
+        tail = logtracker.config.get().tail
+        if not tail.enabled:
+            return
+        self._tail = logtracker.tail.TailServer(tail.socket, logtracker.servers.files_list)
+        asyncio.Task(self._tail.start(), loop=self._loop)
+        self._event_manager.register_event(logtracker.stream.RecordsEvent,
+                                           self._tail.on_records)
+
+    def stop_tail_server(self):
+        """ stop serving tail clients """
+        if self._tail:
+            self._event_manager.unregister_event(logtracker.stream.RecordsEvent,
+                                                 self._tail.on_records)
+            self._tail.stop()
+            self._tail = None
+
+    def start_alerts(self):
+        """ evaluate alert rules on records """
+        conf = logtracker.config.get().alerts
+        if not conf.rules:
+            return
+        rules = [logtracker.alerts.Rule(rule.name, rule.pattern, rule.file, rule.threshold,
+                                        rule.window_s, rule.cooldown_s) for rule in conf.rules]
+        engine = logtracker.alerts.AlertEngine(rules, conf.webhook, conf.command, self._loop)
+        logtracker.alerts.ENGINE = engine
+        # rules count every record, sampled or collapsed ones too
+        self._event_manager.register_event(logtracker.stream.SplitRecordsEvent,
+                                           engine.on_records)
+
+    def stop_alerts(self):
+        """ stop evaluating alert rules """
+        engine = logtracker.alerts.ENGINE
+        if engine is not None:
+            self._event_manager.unregister_event(logtracker.stream.SplitRecordsEvent,
+                                                 engine.on_records)
+            logtracker.alerts.ENGINE = None
+
+    def start_store(self):
+        """ keep records in local segments store """
+        conf = logtracker.config.get().store
+        if not conf.active:
+            return
+        store = logtracker.store.Store(conf.directory, conf.max_size_mb << 20,
+                                       conf.max_age_hours * 3600, conf.block_kb << 10,
+                                       conf.flush_ms / 1000)
+        store.open(self._loop)
+        logtracker.store.STORE = store
+        # history keeps every record, sampled or collapsed ones too
+        self._event_manager.register_event(logtracker.stream.SplitRecordsEvent,
+                                           store.on_records)
+
+    def stop_store(self):
+        """ write queued records and close store """
+        store = logtracker.store.STORE
+        if store is not None:
+            self._event_manager.unregister_event(logtracker.stream.SplitRecordsEvent,
+                                                 store.on_records)
+            store.close()
+            logtracker.store.STORE = None
+
+    def files_buffered(self) -> int:
+        """ bytes of incomplete lines kept by file notifiers """
+        notifiers = [notifier for notifier in (self._file_notifier, self._poll_notifier)
+                     if notifier is not None]
+        return sum(state.buffered for notifier in notifiers
+                   for state in list(notifier.states.values()))
+
+    def start_budget(self):
+        """ check memory budget of buffers and queues """
+        conf = logtracker.config.get().budget
+        if not conf.memory_mb:
+            return
+        budget = logtracker.budget.Budget(conf.memory_mb << 20, conf.check_ms / 1000)
+        stream = self._record_stream
+        budget.register('files', self.files_buffered)
+        budget.register('events', self._event_manager.buffered,
+                        degrade=self._event_manager.shrink)
+
+        def store_flush(_):
+            store = logtracker.store.STORE
+            queued = store.queued if store else 0
+            if store is not None:
+                store.flush()
+            return queued
+        budget.register('store', lambda: logtracker.store.STORE.queued
+                        if logtracker.store.STORE else 0, degrade=store_flush)
+        budget.register('stream', lambda: 0, logtracker.budget.SAMPLE,
+                        lambda _: stream.set_pressure(True), lambda: stream.set_pressure(False))
+        if isinstance(self._ws, logtracker.fanout.WSWorkerPool):
+            budget.register('websocket', self._ws.buffered, degrade=self._ws.shrink)
+        elif self._ws is not None:
+            budget.register('websocket', self._ws.buffered, logtracker.budget.DROP,
+                            self._ws.drop_slow)
+            budget.register('timelines', self._ws.timelines_buffered)
+        if isinstance(self._http, logtracker.servers.AsyncHttpServer):
+            events = self._http.events
+            budget.register('event_stream', events.kept, degrade=events.shrink)
+            budget.register('event_stream', events.buffered, logtracker.budget.DROP,
+                            events.drop_slow)
+        if self._forwarder is not None:
+            budget.register('forwarder', self._forwarder.buffered,
+                            degrade=self._forwarder.shrink)
+        if self._tail is not None:
+            budget.register('tail', self._tail.buffered, logtracker.budget.DROP,
+                            self._tail.drop_slow)
+        budget.start(self._loop)
+        logtracker.budget.BUDGET = budget
+
+    @staticmethod
+    def stop_budget():
+        """ stop checking memory budget """
+        if logtracker.budget.BUDGET is not None:
+            logtracker.budget.BUDGET.stop()
+            logtracker.budget.BUDGET = None
+
     def on_file_event(self, file_event):
-        """ push file events from FileNotifierService """
-        self._event_manager.post_event(file_event)
+        """ push file events from FileNotifierService (called from notifier thread) """
+        self._event_manager.post_event_threadsafe(file_event)
 
     def start(self, loop=None):
         """ application running entry point """
         loop = loop or asyncio.get_event_loop()
+        self._loop = loop
         try:
             self.load_config()
-            self.start_ws_server()
-            self.start_http()
+            role = logtracker.config.get().cluster.role
+            if role == 'agent':
+                # agent only forwards records of its files, nothing is served locally
+                self.start_forwarder()
+            else:
+                self.start_ws_server()
+                self.start_http()
+                if role == 'aggregator':
+                    self.start_aggregator()
+                self.start_tail_server()
+                self.start_store()
+                self.start_alerts()
+                self.start_internal_notifier()
             self.start_files_notifier()
+            self._record_stream.start(loop)
+            self.start_budget()
+            loop.create_task(self._event_manager.run())
+            logtracker.event.SUPERVISOR.watch_loop(loop)
+            logtracker.event.SUPERVISOR.watch_manager(self._event_manager)
             loop.run_forever()
         except KeyboardInterrupt:
-            log = logging.getLogger('logtracker.Application')
-            log.info('CTRL+C pressed')
+            Application.LOGGER.info('CTRL+C pressed')
         finally:
             loop.stop()
+            logtracker.event.SUPERVISOR.stop()
+            self._event_manager.stop()
+            self.stop_budget()
+            self._record_stream.stop()
             self.stop_files_notifier()
+            self.stop_internal_notifier()
+            self.stop_alerts()
+            self.stop_store()
+            self.stop_tail_server()
+            self.stop_aggregator()
+            self.stop_forwarder()
             self.stop_ws_server()
             self.stop_http()
             logtracker.event.Service.THREAD_POOL.shutdown()
+            logtracker.logs.shutdown()
 
-if __name__ == "__main__":
-    APPLICATION = Application()
-    APPLICATION.start()
+def main(argv=None):
+    """
+        'logtracker' console entry point
+            logtracker [config.yaml]      run application
+            logtracker tail [options]     print records of running application
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == 'tail':
+        return logtracker.tail.main(argv[1:])
+    Application(argv[0] if argv else None).start()
     print('quit application')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3.6
+
+"""
+    profiler module: on-demand sampling profiler and tracemalloc snapshots
+    used by admin http routes. Both are disabled by default (see config.yaml)
+"""
+
+import collections
+import logging
+import math
+import os.path
+import sys
+import threading
+import time
+import tracemalloc
+
+class ProfilerBusy(Exception):
+    """ a profile or a memory trace is already running """
+
+class SamplingProfiler:
+    """
+        SamplingProfiler periodically captures stacks of every running thread
+        (service thread pool workers, event loop, http server) and aggregates them
+        as collapsed stacks ready for flame graph tools.
+    """
+    LOGGER = logging.getLogger('logtracker.profiler.SamplingProfiler')
+    MIN_INTERVAL = 0.001
+    MAX_DEPTH = 64
+    MAX_STACKS = 10000
+    TRUNCATED = '[truncated]'
+
+    def __init__(self):
+        """ constructor """
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _frame_label(frame):
+        """ format frame for collapsed stacks (';' is reserved as separator) """
+        code = frame.f_code
+        return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+    def _sample(self, stacks, names, own_ident):
+        """ capture one stack per thread and count it """
+        for ident, frame in sys._current_frames().items(): # pylint: disable=protected-access
+            if ident == own_ident:
+                continue
+            labels = []
+            while frame is not None and len(labels) < SamplingProfiler.MAX_DEPTH:
+                labels.append(SamplingProfiler._frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, 'thread-%d' % ident))
+            key = ';'.join(reversed(labels))
+            if key not in stacks and len(stacks) >= SamplingProfiler.MAX_STACKS:
+                key = labels[-1] + ';' + SamplingProfiler.TRUNCATED
+            stacks[key] += 1
+
+    def profile(self, seconds, interval):
+        """
+            sample all threads during seconds (calling thread is blocked meanwhile).
+            only one profile can run at a time
+            :param seconds: profile duration
+            :param interval: delay between samples in seconds (at most seconds)
+            :return: Counter of collapsed stacks
+            :raise ProfilerBusy: another profile is running
+            :raise ValueError: duration or interval is not finite
+        """
+        if not math.isfinite(seconds) or not math.isfinite(interval):
+            raise ValueError("profile duration and interval must be finite")
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("profile already running")
+
+        seconds = max(seconds, 0)
+        interval = min(max(interval, SamplingProfiler.MIN_INTERVAL), seconds)
+        stacks = collections.Counter()
+        own_ident = threading.get_ident()
+        try:
+            SamplingProfiler.LOGGER.info('Start profiling: duration=%.2fs interval=%.3fs',
+                                         seconds, interval)
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                self._sample(stacks, names, own_ident)
+                time.sleep(interval)
+        finally:
+            self._lock.release()
+            SamplingProfiler.LOGGER.info('Stop profiling: %d distinct stacks', len(stacks))
+
+        return stacks
+
+    @staticmethod
+    def collapse(stacks):
+        """ format stacks counter as collapsed text (one 'stack count' per line) """
+        return ''.join('%s %d\n' % (stack, count) for stack, count in stacks.most_common())
+
+class MemoryTracker:
+    """
+        MemoryTracker wraps tracemalloc: start tracing then return top-N allocation
+        differences between consecutive snapshots. Tracing is stopped automatically
+        after a delay so that it can't be left running.
+    """
+    LOGGER = logging.getLogger('logtracker.profiler.MemoryTracker')
+    FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+               tracemalloc.Filter(False, '<unknown>')]
+
+    def __init__(self):
+        """ constructor """
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._timer = None
+
+    @property
+    def tracing(self):
+        """ return True if memory tracing started by tracker """
+        return self._snapshot is not None
+
+    def start(self, frames, max_seconds):
+        """
+            start tracing memory allocations
+            :param frames: number of frames stored per allocation traceback
+            :param max_seconds: tracing automatically stopped after this delay
+        """
+        with self._lock:
+            if self._snapshot is not None:
+                raise ProfilerBusy("memory tracing already started")
+            MemoryTracker.LOGGER.info('Start memory tracing for %ds', max_seconds)
+            tracemalloc.start(frames)
+            self._snapshot = tracemalloc.take_snapshot().filter_traces(MemoryTracker.FILTERS)
+            self._timer = threading.Timer(max_seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stop(self):
+        """ stop memory tracing """
+        with self._lock:
+            if self._snapshot is None:
+                return
+            MemoryTracker.LOGGER.info('Stop memory tracing')
+            self._timer.cancel()
+            self._timer = None
+            self._snapshot = None
+            tracemalloc.stop()
+
+    def diff(self, top):
+        """
+            compare current snapshot with previous one
+            :param top: number of entries returned
+            :return: list of formatted statistics, biggest size differences first
+        """
+        with self._lock:
+            if self._snapshot is None:
+                raise RuntimeError("memory tracing not started")
+            snapshot = tracemalloc.take_snapshot().filter_traces(MemoryTracker.FILTERS)
+            stats = snapshot.compare_to(self._snapshot, 'lineno')
+            self._snapshot = snapshot
+
+        return [str(stat) for stat in stats[:top]]
+
+PROFILER = SamplingProfiler()
+MEMORY = MemoryTracker()
@@ -8,14 +8,30 @@
 """
 # pylint: disable=import-error
 import asyncio
+import collections
+import http
+import io
 import json
 import logging
+import sys
+import time
+import urllib.parse
 import wsgiref.simple_server
 import websockets
 import bottle
 import logtracker
+import logtracker.alerts
+import logtracker.assets
+import logtracker.budget
+import logtracker.cluster
 import logtracker.config
 import logtracker.event
+import logtracker.history
+import logtracker.logs
+import logtracker.profiler
+import logtracker.store
+import logtracker.stream
+import logtracker.timeline
 
 class SAdapter(bottle.ServerAdapter):
     """ Adapter for bottle """
@@ -31,6 +47,17 @@ class HttpServer(logtracker.event.Service):
     """ Http server: encapsulate bottle server """
 
     LOGGER = logging.getLogger('logtracker.servers.HttpServer')
+    DEDICATED_THREAD = True
+    #serve_forever polls every 0.5s
+    HEARTBEAT_TIMEOUT = 10
+
+    class WSGIServer(wsgiref.simple_server.WSGIServer):
+        """ wsgi server signaling its service alive on each serve_forever poll """
+        service = None
+
+        def service_actions(self):
+            if self.service is not None:
+                self.service.heartbeat()
 
     def __init__(self, host, port):
         """ constructor """
@@ -38,7 +65,9 @@ class HttpServer(logtracker.event.Service):
         self._host = host
         self._port = port
         self._started = False
-        self._server = wsgiref.simple_server.make_server(host, port, bottle.app())
+        self._server = wsgiref.simple_server.make_server(host, port, bottle.app(),
+                                                         server_class=HttpServer.WSGIServer)
+        self._server.service = self
 
     @logtracker.event.ServiceHandler.onstart
     def start_http(self):
@@ -81,47 +110,639 @@ class HttpServer(logtracker.event.Service):
     started = property(fget=is_started)
 
 
+def wsgi_environ(method, target, headers, body, server, peer=None):
+    """
+        build WSGI environ for a request parsed by an asyncio server
+        :param method: http method
+        :param target: request target (path and query string)
+        :param headers: iterable of (name, value) header pairs
+        :param body: request body (bytes)
+        :param server: (host, port) of server
+        :param peer: (address, port) of client
+    """
+    path, _, query = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': urllib.parse.unquote(path, 'latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': peer[0] if peer else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers:
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+def call_wsgi(app, environ):
+    """
+        call WSGI application and collect its response
+        :return: tuple (status line, headers list, body bytes)
+    """
+    response = dict()
+    body = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and 'status' in response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response['status'] = status
+        response['headers'] = headers
+        return body.append
+
+    result = app(environ, start_response)
+    try:
+        for data in result:
+            body.append(data)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    return response['status'], response['headers'], b''.join(body)
+
+class EventStream:
+    """
+        Server-Sent Events clients of AsyncHttpServer: messages are encoded once
+        as frames written to every client, last frames are kept so that clients
+        reconnecting with Last-Event-ID get the frames they missed.
+        Event id is '<stream epoch>-<number>': clients resuming with an id of a
+        previous run get every kept frame.
+    """
+    LOGGER = logging.getLogger('logtracker.servers.EventStream')
+    PATH = '/events'
+    #frames kept for Last-Event-ID resume
+    HISTORY = 1000
+    HEARTBEAT = 15
+    RETRY_MS = 3000
+    #bytes not yet sent to a client above which it is disconnected
+    MAX_BUFFER = 4 << 20
+    #no Content-Length: stream ends with connection
+    HEAD = b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-store\r\n' \
+           b'X-Accel-Buffering: no\r\nConnection: keep-alive\r\n\r\n'
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._epoch = '%x' % int(time.time())
+        self._last_id = 0
+        self._frames = collections.deque(maxlen=EventStream.HISTORY)
+        self._clients = set()
+        self._heartbeat = None
+
+    @property
+    def clients(self) -> int:
+        """ number of connected clients """
+        return len(self._clients)
+
+    def publish(self, message: str):
+        """ encode message (without line feed, json) and write it to every client """
+        self._last_id += 1
+        frame = ('id: %s-%d\ndata: %s\n\n' % (self._epoch, self._last_id, message)) \
+            .encode('utf-8')
+        self._frames.append((self._last_id, frame))
+        for writer in list(self._clients):
+            self._write(writer, frame)
+
+    def on_records(self, records_event):
+        """ callback for RecordsEvent """
+        if records_event.records or records_event.repeats:
+            self.publish(records_event.to_json())
+
+    def _write(self, writer, frame: bytes):
+        """ write frame, disconnect client when it does not read fast enough """
+        if writer.transport.get_write_buffer_size() > EventStream.MAX_BUFFER:
+            EventStream.LOGGER.warning('Disconnect slow event stream client %s',
+                                       writer.get_extra_info('peername'))
+            self._clients.discard(writer)
+            writer.close()
+        else:
+            writer.write(frame)
+
+    def close(self):
+        """ disconnect clients """
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for writer in self._clients:
+            writer.close()
+        self._clients.clear()
+
+    def buffered(self) -> int:
+        """ bytes not yet sent to clients """
+        return sum(writer.transport.get_write_buffer_size() for writer in self._clients)
+
+    def drop_slow(self, size: int, min_buffer: int = 1 << 16) -> int:
+        """
+            disconnect clients with most unsent bytes (at least min_buffer) until
+            about size bytes are freed, return bytes freed
+        """
+        freed = 0
+        for buffered, writer in sorted(((writer.transport.get_write_buffer_size(), writer)
+                                        for writer in self._clients),
+                                       key=lambda item: -item[0]):
+            if freed >= size or buffered < min_buffer:
+                break
+            EventStream.LOGGER.warning('Memory pressure: disconnect event stream client %s',
+                                       writer.get_extra_info('peername'))
+            self._clients.discard(writer)
+            writer.transport.abort()
+            freed += buffered
+        return freed
+
+    def kept(self) -> int:
+        """ bytes of frames kept for Last-Event-ID resume """
+        return sum(len(frame) for _, frame in self._frames)
+
+    def shrink(self, size: int) -> int:
+        """ drop oldest kept frames (about size bytes), return bytes freed """
+        freed = 0
+        while self._frames and freed < size:
+            freed += len(self._frames.popleft()[1])
+        return freed
+
+    def missed(self, last_event_id: str) -> list:
+        """ frames published after last_event_id (all kept frames if it is unknown) """
+        epoch, _, number = last_event_id.partition('-')
+        if epoch != self._epoch or not number.isdigit():
+            return [frame for _, frame in self._frames]
+        number = int(number)
+        return [frame for frame_id, frame in self._frames if frame_id > number]
+
+    def _beat(self):
+        """ comment line keeping idle connections open through proxies """
+        self._heartbeat = None
+        if self._clients:
+            for writer in list(self._clients):
+                self._write(writer, b': ping\n\n')
+            self._heartbeat = (self._loop or asyncio.get_event_loop()).call_later(
+                EventStream.HEARTBEAT, self._beat)
+
+    async def serve(self, reader, writer, last_event_id: str):
+        """ stream frames to client until it disconnects """
+        writer.write(EventStream.HEAD + b'retry: %d\n\n' % EventStream.RETRY_MS)
+        if last_event_id:
+            writer.write(b''.join(self.missed(last_event_id)))
+        self._clients.add(writer)
+        if self._heartbeat is None:
+            self._heartbeat = (self._loop or asyncio.get_event_loop()).call_later(
+                EventStream.HEARTBEAT, self._beat)
+        try:
+            while await reader.read(1024):
+                pass
+        finally:
+            self._clients.discard(writer)
+
+class AsyncHttpServer:
+    """
+        Http server running on the asyncio event loop shared with WSServer.
+        Requests are parsed on the loop and bottle routes run in service thread pool,
+        so that a slow request does not block other clients. Server-Sent Events
+        (EventStream.PATH) are streamed from the loop.
+    """
+
+    LOGGER = logging.getLogger('logtracker.servers.AsyncHttpServer')
+    MAX_HEADER_SIZE = 65536
+    MAX_BODY_SIZE = 1 << 20
+    KEEP_ALIVE_TIMEOUT = 30
+    BACKLOG = 1024
+
+    def __init__(self, host, port, app=None):
+        """ constructor """
+        self._host = host
+        self._port = port
+        self._app = app or bottle.app()
+        self._server = None
+        self._start_server_task = None
+        self.events = EventStream()
+
+    def start(self, loop=None):
+        """ start listening on event loop """
+        if self._start_server_task is None:
+            AsyncHttpServer.LOGGER.info("Start async Http server: host='%s' port=%d",
+                                        self._host, self._port)
+            self._start_server_task = asyncio.Task(self.run_server(), loop=loop)
+        else:
+            raise RuntimeError("AsyncHttpServer already started")
+
+    def stop(self):
+        """ stop listening """
+        if self._start_server_task is None:
+            raise RuntimeError("AsyncHttpServer not started yet")
+
+        AsyncHttpServer.LOGGER.info("Stop async Http server")
+        self.events.close()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        else:
+            self._start_server_task.cancel()
+        self._start_server_task = None
+
+    async def run_server(self):
+        """ open listening socket """
+        self._server = await asyncio.start_server(self.on_client, self._host, self._port,
+                                                  limit=AsyncHttpServer.MAX_HEADER_SIZE,
+                                                  backlog=AsyncHttpServer.BACKLOG)
+
+    def is_started(self):
+        """ return bool indicating server started """
+        return self._start_server_task is not None
+
+    started = property(fget=is_started)
+
+    async def on_client(self, reader, writer):
+        """ serve requests of one client connection (keep-alive) """
+        peer = writer.get_extra_info('peername')
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                                  AsyncHttpServer.KEEP_ALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    writer.write(AsyncHttpServer.encode_response('431 Header Too Large',
+                                                                 [], b'', False))
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                    headers = [(name.strip(), value.strip()) for name, _, value in
+                               (line.partition(':') for line in lines[1:] if line)]
+                    length = int(dict((k.lower(), v) for k, v in headers)
+                                 .get('content-length', 0))
+                except ValueError:
+                    writer.write(AsyncHttpServer.encode_response('400 Bad Request',
+                                                                 [], b'', False))
+                    break
+                if length > AsyncHttpServer.MAX_BODY_SIZE:
+                    writer.write(AsyncHttpServer.encode_response('413 Payload Too Large',
+                                                                 [], b'', False))
+                    break
+
+                body = await reader.readexactly(length) if length else b''
+                connection = dict((k.lower(), v.lower()) for k, v in headers) \
+                    .get('connection', '')
+                keep_alive = 'close' not in connection and \
+                    (version == 'HTTP/1.1' or 'keep-alive' in connection)
+
+                if method == 'GET' and target.partition('?')[0] == EventStream.PATH:
+                    query = urllib.parse.parse_qs(target.partition('?')[2])
+                    last_event_id = dict((k.lower(), v) for k, v in headers).get(
+                        'last-event-id', query.get('lastEventId', [''])[0])
+                    await self.events.serve(reader, writer, last_event_id)
+                    break
+
+                environ = wsgi_environ(method, target, headers, body,
+                                       (self._host, self._port), peer)
+                status, resp_headers, resp_body = await asyncio.get_event_loop() \
+                    .run_in_executor(logtracker.event.Service.THREAD_POOL,
+                                     call_wsgi, self._app, environ)
+                if method == 'HEAD':
+                    resp_body = b''
+                writer.write(AsyncHttpServer.encode_response(status, resp_headers,
+                                                             resp_body, keep_alive))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as exc: # pylint: disable=broad-except
+            AsyncHttpServer.LOGGER.error('Error while serving %s: %s', peer, str(exc))
+        finally:
+            writer.close()
+
+    @staticmethod
+    def encode_response(status, headers, body, keep_alive):
+        """ format http response """
+        names = set(name.lower() for name, _ in headers)
+        lines = ['HTTP/1.1 ' + status]
+        lines.extend('%s: %s' % (name, value) for name, value in headers)
+        if 'content-length' not in names:
+            lines.append('Content-Length: %d' % len(body))
+        lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
 ### Http routes ###
 
+def static_response(filename):
+    """ serve static file from in-memory cache (bottle.static_file if not cacheable) """
+    http_config = logtracker.config.get().server.http
+    cache = logtracker.assets.get_cache(http_config.html, http_config.cache_max_age)
+    response = cache.lookup(filename, bottle.request.headers.get('Accept-Encoding', ''),
+                            bottle.request.headers.get('If-None-Match', ''))
+    if response is None:
+        return bottle.static_file(filename, root=http_config.html)
+    status, headers, body = response
+    return bottle.HTTPResponse(body, status, headers)
+
+def json_response(name, builder):
+    """ serve json document serialized once per config version, with ETag """
+    version = (logtracker.config.Config.VERSION, logtracker.cluster.version())
+    body, etag = logtracker.assets.JSON.get(name, version, builder)
+    headers = [('ETag', etag), ('Cache-Control', 'no-cache')]
+    if logtracker.assets.etag_match(bottle.request.headers.get('If-None-Match', ''), [etag]):
+        return bottle.HTTPResponse(b'', 304, headers)
+    headers.append(('Content-Type', 'application/json'))
+    return bottle.HTTPResponse(body, 200, headers)
+
 @bottle.route('/')
 def defaultget():
     """ return index.html page """
-    root_path = logtracker.config.get().server.http.html
-    return bottle.static_file("index.html", root=root_path, mimetype='text/html')
+    return static_response("index.html")
 
 @bottle.route('/<filename>')
 def server_static(filename):
     """ static files (img,js...) """
-    root_path = logtracker.config.get().server.http.html
-    return bottle.static_file(filename, root=root_path)
+    return static_response(filename)
+
+def files_list():
+    """ watched files description sent to clients (agents files included) """
+    return local_files_list() + logtracker.cluster.remote_files()
+
+def local_files_list():
+    """ description of files watched by this process """
+    return [{"path": f.path, "color": f.color, "pattern": f.pattern}
+            for f in logtracker.config.get().files]
 
 @bottle.route('/files')
 def get_filelist():
     """ returns log file list """
-    return json.dumps([{"path": f.path, "color": f.color, "pattern": f.pattern}
-                       for f in logtracker.config.get().files])
+    return json_response('files', files_list)
 
 @bottle.route('/ws')
 def get_wsconfig():
-    """ return websocket server config """
-    conf = dict()
-    conf['url'] = logtracker.config.get().server.websocket.url
-    return conf
+    """ return websocket server config (and event stream path, in async http mode) """
+    def builder():
+        conf = logtracker.config.get().server
+        if conf.http.mode == 'async':
+            return {'url': conf.websocket.url, 'events': EventStream.PATH}
+        return {'url': conf.websocket.url}
+    return json_response('ws', builder)
+
+@bottle.route(EventStream.PATH)
+def get_events():
+    """ Server-Sent Events are streamed by AsyncHttpServer only """
+    raise bottle.HTTPError(501, "Event stream requires http mode 'async'")
+
+def watched_file(path):
+    """ return path if it is a watched file, raise 404 otherwise """
+    if not any(f.path == path for f in logtracker.config.get().files):
+        raise bottle.HTTPError(404, "File not watched")
+    return path
+
+def history_rotation():
+    """ rotation of 'file' query parameter selected by 'rotation' (default 0) """
+    path = watched_file(bottle.request.query.get('file', ''))
+    try:
+        return logtracker.history.open_rotation(path, int(bottle.request.query.get('rotation', 0)))
+    except ValueError:
+        raise bottle.HTTPError(400, "Invalid rotation")
+    except IndexError as exc:
+        raise bottle.HTTPError(404, str(exc))
+
+@bottle.route('/rotations')
+def get_rotations():
+    """ rotated files of watched file (query parameter: file) """
+    path = watched_file(bottle.request.query.get('file', ''))
+    bottle.response.content_type = 'application/json'
+    return json.dumps([rotation.to_dict()
+                       for rotation in logtracker.history.rotations(path)])
+
+@bottle.route('/history')
+def get_history():
+    """
+        read lines of a rotated file, gzip archives included
+        query parameters: file, rotation (index in chain), offset (uncompressed),
+        size (bytes) or search (regular expression) and limit (matches)
+        source=store: read records store instead (see get_store_history)
+    """
+    if bottle.request.query.get('source') == 'store':
+        return get_store_history()
+    rotation = history_rotation()
+    history = logtracker.history.HISTORY
+    max_read = logtracker.config.get().history.max_read_kb * 1024
+    query = bottle.request.query
+    try:
+        offset = max(0, int(query.get('offset', 0)))
+        if 'search' in query:
+            matches, next_offset = history.search(rotation, query.get('search'), offset,
+                                                  min(int(query.get('limit', 100)), 1000))
+            result = {"matches": [{"offset": item[0], "line": item[1]} for item in matches]}
+        else:
+            records, next_offset = history.read(rotation, offset,
+                                                min(int(query.get('size', max_read)), max_read))
+            result = {"records": records}
+    except ValueError as exc:
+        raise bottle.HTTPError(400, "Invalid history parameters: %s" % str(exc))
+    except (OSError, logtracker.history.HistoryError) as exc:
+        raise bottle.HTTPError(500, "Unable to read %s: %s" % (rotation.path, str(exc)))
+
+    result.update({"file": rotation.path, "rotation": rotation.index, "offset": offset,
+                   "next": next_offset})
+    bottle.response.content_type = 'application/json'
+    return json.dumps(result)
+
+def get_store_history():
+    """
+        read records of a file kept in store, file may have been deleted since
+        query parameters: file, cursor (block id), since and until (timestamps),
+        size (bytes) or search (regular expression) and limit (matches)
+    """
+    store = logtracker.store.STORE
+    if store is None:
+        raise bottle.HTTPError(404, "Records store disabled")
+    path = bottle.request.query.get('file', '')
+    if path not in store.files():
+        raise bottle.HTTPError(404, "No records of file in store")
+    max_read = logtracker.config.get().history.max_read_kb * 1024
+    query = bottle.request.query
+    try:
+        cursor = max(0, int(query.get('cursor', 0)))
+        since, until = float(query.get('since', 0)), float(query.get('until', 0))
+        if 'search' in query:
+            matches, next_cursor = store.search(path, query.get('search'), cursor,
+                                                min(int(query.get('limit', 100)), 1000),
+                                                since, until)
+            result = {"matches": [{"seq": item[0], "line": item[1]} for item in matches]}
+        else:
+            records, next_cursor = store.read(path, cursor,
+                                              min(int(query.get('size', max_read)), max_read),
+                                              since, until)
+            result = {"records": [{"seq": item[0], "line": item[1]} for item in records]}
+    except ValueError as exc:
+        raise bottle.HTTPError(400, "Invalid history parameters: %s" % str(exc))
+    except logtracker.store.StoreError as exc:
+        raise bottle.HTTPError(500, "Unable to read store: %s" % str(exc))
+
+    result.update({"file": path, "cursor": cursor, "next": next_cursor})
+    bottle.response.content_type = 'application/json'
+    return json.dumps(result)
+
+@bottle.route('/timeline')
+def get_timeline():
+    """
+        records of several files merged by time, read lazily from their rotations
+        query parameters: file (repeated), since and until (timestamps), limit,
+        skip (records at time since already read, see next)
+    """
+    paths = [watched_file(path) for path in bottle.request.query.getall('file')]
+    if not paths:
+        raise bottle.HTTPError(400, "No file")
+    query = bottle.request.query
+    try:
+        since, until = float(query.get('since', 0)), float(query.get('until', 0))
+        records, cursor = logtracker.timeline.merge(
+            paths, since, until, min(int(query.get('limit', 1000)), 10000),
+            max(0, int(query.get('skip', 0))))
+    except ValueError as exc:
+        raise bottle.HTTPError(400, "Invalid timeline parameters: %s" % str(exc))
+    except (OSError, logtracker.history.HistoryError) as exc:
+        raise bottle.HTTPError(500, "Unable to read files: %s" % str(exc))
+    bottle.response.content_type = 'application/json'
+    return json.dumps({
+        "records": [{"time": stamp, "file": path, "line": record}
+                    for stamp, path, record in records],
+        "next": {"since": cursor[0], "skip": cursor[1]} if cursor else None})
+
+@bottle.route('/alerts')
+def get_alerts():
+    """ last alerts raised by alert rules """
+    bottle.response.content_type = 'application/json'
+    return json.dumps(logtracker.alerts.recent_alerts())
+
+@bottle.route('/handlers')
+def get_handlers():
+    """ event handlers statistics: calls, latency, backlog of async handlers """
+    bottle.response.content_type = 'application/json'
+    bottle.response.set_header('Cache-Control', 'no-store')
+    return json.dumps(logtracker.event.SUPERVISOR.handlers())
+
+@bottle.route('/budget')
+def get_budget():
+    """ memory budget: usage of buffers and queues, degradation level """
+    budget = logtracker.budget.BUDGET
+    if budget is None:
+        raise bottle.HTTPError(404, "Memory budget disabled")
+    bottle.response.content_type = 'application/json'
+    bottle.response.set_header('Cache-Control', 'no-store')
+    return json.dumps(budget.stats())
+
+@bottle.route('/health')
+def get_health():
+    """ supervised services health: 200 if all are running, 503 otherwise """
+    supervisor = logtracker.event.SUPERVISOR
+    body = json.dumps(supervisor.health())
+    status = 200 if supervisor.healthy() else 503
+    return bottle.HTTPResponse(body, status, [('Content-Type', 'application/json'),
+                                              ('Cache-Control', 'no-store')])
+
+@bottle.route('/admin/profile')
+def get_profile():
+    """
+        sample all threads and return collapsed stacks (flame graph input)
+        query parameters: seconds (duration), interval (ms between samples)
+        the request is answered after the profile: in 'thread' http mode, other
+        routes wait for it (at most profile_max_seconds)
+    """
+    admin = logtracker.config.get().admin
+    if not admin.profiler:
+        raise bottle.HTTPError(404, "Profiler disabled")
+
+    try:
+        seconds = min(float(bottle.request.query.get('seconds', 5)), admin.profile_max_seconds)
+        interval = float(bottle.request.query.get('interval', admin.profile_interval_ms)) / 1000
+    except ValueError:
+        raise bottle.HTTPError(400, "Invalid profile parameters")
+
+    try:
+        stacks = logtracker.profiler.PROFILER.profile(seconds, interval)
+    except ValueError:
+        raise bottle.HTTPError(400, "Invalid profile parameters")
+    except logtracker.profiler.ProfilerBusy as exc:
+        raise bottle.HTTPError(409, str(exc))
+
+    bottle.response.content_type = 'text/plain'
+    return logtracker.profiler.SamplingProfiler.collapse(stacks)
+
+@bottle.route('/admin/memory')
+def get_memory():
+    """
+        first call starts tracemalloc, next calls return top-N allocation
+        differences since previous call
+        query parameters: top (number of entries)
+    """
+    admin = logtracker.config.get().admin
+    if not admin.memory:
+        raise bottle.HTTPError(404, "Memory snapshots disabled")
+
+    memory = logtracker.profiler.MEMORY
+    bottle.response.content_type = 'text/plain'
+    if not memory.tracing:
+        try:
+            memory.start(admin.memory_frames, admin.memory_max_seconds)
+        except logtracker.profiler.ProfilerBusy as exc:
+            raise bottle.HTTPError(409, str(exc))
+        return "memory tracing started for %ds\n" % admin.memory_max_seconds
+
+    try:
+        top = min(int(bottle.request.query.get('top', admin.memory_top)), admin.memory_top)
+        return ''.join(line + '\n' for line in memory.diff(top))
+    except ValueError:
+        raise bottle.HTTPError(400, "Invalid top parameter")
+    except RuntimeError as exc:
+        raise bottle.HTTPError(409, str(exc))
+
+@bottle.route('/admin/memory/stop')
+def stop_memory():
+    """ stop memory tracing """
+    if not logtracker.config.get().admin.memory:
+        raise bottle.HTTPError(404, "Memory snapshots disabled")
+    logtracker.profiler.MEMORY.stop()
+    bottle.response.content_type = 'text/plain'
+    return "memory tracing stopped\n"
 
 
 class WSServer:
-    """ Websocket server """
+    """
+        Websocket server: messages are pushed to every client, except clients
+        connected on TIMELINE_PATH (?file=...&file=...) which get records of
+        their files merged by time (see logtracker.timeline.LiveTimeline)
+    """
 
     LOGGER = logging.getLogger('logtracker.servers.WSServer')
     LOOP = asyncio.new_event_loop()
-
-    def __init__(self, host='localhost', port=8080):
-        """ constructor """
+    TIMELINE_PATH = '/timeline'
+
+    def __init__(self, host='localhost', port=8080, serve_http=False, reuse_port=False,
+                 timeline_window=0.5):
+        """
+            constructor
+            :param serve_http: serve bottle http routes on websocket port for
+                               requests which are not websocket upgrades
+            :param reuse_port: bind with SO_REUSEPORT (several processes on same port)
+            :param timeline_window: reorder window (s) of timeline clients
+        """
         self._host = host
         self._port = port
         self._connections = set()
         self._start_server_task = None
         self._connections = set()
+        self._http_app = bottle.app() if serve_http else None
+        self._reuse_port = reuse_port
+        self._timeline_window = timeline_window
+        self._timelines = dict()
+        self._timeline_handle = None
 
     def start(self, loop=None):
         """ called when start called """
@@ -129,7 +750,10 @@ class WSServer:
             WSServer.LOGGER.info("Start Websocket server: host='%s' port=%d", self._host,
                                  self._port)
             self._start_server_task = asyncio.Task(self.run_server(), loop=loop)
-            self._start_server_task.coroutine = websockets.serve(self.on_connection, self._host, self._port)
+            self._start_server_task.coroutine = websockets.serve(
+                self.on_connection, self._host, self._port,
+                process_request=self.process_request if self._http_app else None,
+                reuse_port=self._reuse_port or None)
         else:
             WSServer.LOGGER.error("WSServer already started")
             raise RuntimeError("WSServer already started")
@@ -140,6 +764,9 @@ class WSServer:
             WSServer.LOGGER.info("Stop Websocket server")
 
             self._start_server_task.coroutine.ws_server.close()
+            if self._timeline_handle is not None:
+                self._timeline_handle.cancel()
+                self._timeline_handle = None
 
             if self._start_server_task.exception():
                 WSServer.LOGGER.error('WSServer task exception: %s',
@@ -161,6 +788,17 @@ class WSServer:
         finally:
             WSServer.LOGGER.info("Websocket server stop running")
 
+    async def process_request(self, path, request_headers):
+        """ serve plain http request (not a websocket upgrade) with bottle application """
+        if 'upgrade' in request_headers.get('Connection', '').lower():
+            return None
+
+        environ = wsgi_environ('GET', path, request_headers.raw_items(), b'',
+                               (self._host, self._port))
+        status, headers, body = await asyncio.get_event_loop().run_in_executor(
+            logtracker.event.Service.THREAD_POOL, call_wsgi, self._http_app, environ)
+        return http.HTTPStatus(int(status.split(' ', 1)[0])), headers, body
+
     async def on_connection(self, websocket, path):
         """ called on incoming connection """
 
@@ -169,24 +807,102 @@ class WSServer:
         await self.register(websocket, path)
         try:
             async for message in websocket:
-                WSServer.LOGGER.info(str(message))
+                WSServer.LOGGER.log(logtracker.logs.HOTPATH_LEVEL, 'Incoming message: %s', message)
         finally:
             await self.unregister(websocket)
 
     async def register(self, websocket, path):
         """ called to add incoming connection to clients list """
         WSServer.LOGGER.info('Register websocket=%s path=%s', str(websocket), str(path))
-        self._connections.add(websocket)
+        path, _, query = path.partition('?')
+        if path == WSServer.TIMELINE_PATH:
+            files = urllib.parse.parse_qs(query).get('file', [])
+            self._timelines[websocket] = logtracker.timeline.LiveTimeline(
+                files, self._timeline_window)
+            if self._timeline_handle is None:
+                self._release_timelines()
+        else:
+            self._connections.add(websocket)
         await asyncio.sleep(0.5)
 
 
     async def unregister(self, websocket):
         """ called when ws connection is done """
         WSServer.LOGGER.info('Unregister websocket=%s', str(websocket))
-        self._connections.remove(websocket)
+        if self._timelines.pop(websocket, None) is None:
+            self._connections.remove(websocket)
         await asyncio.sleep(0.5)
 
+    def _websockets(self):
+        return list(self._connections) + list(self._timelines)
+
+    def buffered(self) -> int:
+        """ bytes not yet sent to clients """
+        return sum(websocket.transport.get_write_buffer_size()
+                   for websocket in self._websockets() if websocket.transport is not None)
+
+    def drop_slow(self, size: int, min_buffer: int = 1 << 16) -> int:
+        """
+            disconnect clients with most unsent bytes (at least min_buffer) until
+            about size bytes are freed, return bytes freed
+        """
+        freed = 0
+        for buffered, websocket in sorted(((websocket.transport.get_write_buffer_size(),
+                                            websocket) for websocket in self._websockets()
+                                           if websocket.transport is not None),
+                                          key=lambda item: -item[0]):
+            if freed >= size or buffered < min_buffer:
+                break
+            WSServer.LOGGER.warning('Memory pressure: disconnect websocket client %s',
+                                    websocket.remote_address)
+            websocket.transport.abort()
+            freed += buffered
+        return freed
+
+    def timelines_buffered(self) -> int:
+        """ bytes of records waiting in reorder window of timelines """
+        return sum(timeline.buffered() for timeline in self._timelines.values())
+
+    def on_records(self, records_event):
+        """ callback for RecordsEvent: add records to timelines of their file """
+        for timeline in self._timelines.values():
+            if records_event.path in timeline.paths:
+                timeline.add(records_event)
+
+    def feed_timelines(self, message: str):
+        """
+            add records of a json RecordsEvent message to timelines (websocket
+            workers get messages, not events). Records time defaults to reception.
+        """
+        if not self._timelines or not message.startswith('{'):
+            return
+        try:
+            doc = json.loads(message)
+        except ValueError:
+            return
+        if 'file' in doc and doc.get('records'):
+            self.on_records(logtracker.stream.RecordsEvent(doc['file'], doc['seq'],
+                                                           doc['records']))
+
+    def _release_timelines(self):
+        """ send records of timelines out of their reorder window """
+        self._timeline_handle = None
+        if not self._timelines:
+            return
+        now = time.time()
+        sends = []
+        for websocket, timeline in self._timelines.items():
+            records = timeline.release(now)
+            if records:
+                sends.append(websocket.send(json.dumps({"type": "timeline",
+                                                        "records": records})))
+        if sends:
+            asyncio.gather(*sends, return_exceptions=True)
+        self._timeline_handle = asyncio.get_event_loop().call_later(
+            max(self._timeline_window / 4, 0.05), self._release_timelines)
+
     async def push_message(self, message):
         """ callback for file events notification """
         if message and len(self._connections) > 0:
-            await asyncio.wait([connection.send(message) for connection in self._connections])
+            await asyncio.gather(*[connection.send(message) for connection in self._connections],
+                                 return_exceptions=True)
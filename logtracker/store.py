@@ -0,0 +1,354 @@
+#!/usr/bin/env python3.6
+
+"""
+    store module: keep records read from watched files in local segment files, so
+    that their history survives truncation, deletion or rotation of the files.
+
+    segment: file 'segment-<first block id>.lts' of appended blocks
+    block:   header BLOCK (magic, path length, first seq, records count, time of
+             first and last records, payload length), file path (utf-8) and zlib
+             compressed payload: each record length (4 bytes) and record (utf-8)
+    Block index (file, seq range, time range) is kept in memory and rebuilt from
+    headers at startup. Oldest segments are deleted above max size or age.
+"""
+
+import bisect
+import concurrent.futures
+import logging
+import os
+import os.path
+import re
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'LTB1'
+BLOCK = struct.Struct('!4sHQIddI')
+RECORD = struct.Struct('!I')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.lts'
+
+class StoreError(Exception):
+    """ segment can't be read (corrupted block...) """
+
+def encode_block(path: str, seq: int, records: list, first: float, last: float) -> bytes:
+    """ return block of records (str) """
+    payload = []
+    for record in records:
+        record = record.encode('utf-8', 'replace')
+        payload.append(RECORD.pack(len(record)))
+        payload.append(record)
+    payload = zlib.compress(b''.join(payload))
+    path = path.encode('utf-8')
+    return BLOCK.pack(MAGIC, len(path), seq, len(records), first, last, len(payload)) + \
+        path + payload
+
+def decode_payload(payload: bytes) -> list:
+    """ return records (str) of compressed block payload """
+    data = zlib.decompress(payload)
+    records = []
+    offset = 0
+    while offset < len(data):
+        (length,) = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        records.append(data[offset:offset + length].decode('utf-8', 'replace'))
+        offset += length
+    return records
+
+class Block:
+    """ index entry of a block """
+    __slots__ = ['id', 'path', 'seq', 'count', 'first', 'last', 'segment', 'offset', 'size']
+
+    def __init__(self, block_id, path, seq, count, first, last, segment, offset, size):
+        self.id = block_id
+        self.path = path
+        self.seq = seq
+        self.count = count
+        self.first = first
+        self.last = last
+        self.segment = segment
+        self.offset = offset
+        self.size = size
+
+class Segment:
+    """ segment file and index of its blocks """
+
+    def __init__(self, path: str, first_id: int):
+        self.path = path
+        self.first_id = first_id
+        self.blocks = []
+        self.size = 0
+
+    @property
+    def last(self):
+        """ time of last record in segment """
+        return self.blocks[-1].last if self.blocks else 0
+
+    def scan(self):
+        """ rebuild blocks index from headers, truncated last block is dropped """
+        with open(self.path, 'rb') as fdesc:
+            while True:
+                offset = fdesc.tell()
+                header = fdesc.read(BLOCK.size)
+                if len(header) < BLOCK.size:
+                    break
+                magic, path_len, seq, count, first, last, length = BLOCK.unpack(header)
+                path = fdesc.read(path_len)
+                if magic != MAGIC or len(path) < path_len:
+                    break
+                fdesc.seek(length, os.SEEK_CUR)
+                size = BLOCK.size + path_len + length
+                if offset + size > os.fstat(fdesc.fileno()).st_size:
+                    break
+                self.blocks.append(Block(self.first_id + len(self.blocks),
+                                         path.decode('utf-8'), seq, count, first, last,
+                                         self, offset, size))
+                self.size = offset + size
+
+    def read(self, block: Block) -> list:
+        """ return records of block """
+        with open(self.path, 'rb') as fdesc:
+            fdesc.seek(block.offset)
+            data = fdesc.read(block.size)
+        if len(data) < block.size:
+            raise StoreError("%s: truncated block %d" % (self.path, block.id))
+        _, path_len, _, _, _, _, _ = BLOCK.unpack_from(data)
+        try:
+            return decode_payload(data[BLOCK.size + path_len:])
+        except (zlib.error, struct.error) as exc:
+            raise StoreError("%s: block %d: %s" % (self.path, block.id, str(exc)))
+
+class Store:
+    """
+        Store appends SplitRecordsEvent records (every record of files, before
+        sampling and collapsing) to segments. Records are batched in
+        memory and written every flush_delay (or block_size) by a single writer
+        thread: event loop only queues them.
+    """
+    LOGGER = logging.getLogger('logtracker.store.Store')
+    #number of segments max_size is split in
+    SEGMENTS = 8
+    #segment size when size is not limited
+    SEGMENT_SIZE = 32 << 20
+
+    def __init__(self, folder: str, max_size: int = 256 << 20, max_age: float = 0,
+                 block_size: int = 64 << 10, flush_delay: float = 1.0):
+        """
+            constructor
+            :param folder: segments folder
+            :param max_size: max bytes of all segments (oldest ones deleted above,
+                             0: no limit)
+            :param max_age: max age (s) of records (0: no limit)
+            :param block_size: uncompressed records bytes of a block
+            :param flush_delay: max delay (s) records wait before being written
+        """
+        self._folder = folder
+        self._max_size = max_size
+        self._max_age = max_age
+        self._block_size = block_size
+        self._flush_delay = flush_delay
+        self._segment_size = max(max_size // Store.SEGMENTS if max_size else Store.SEGMENT_SIZE,
+                                 block_size)
+        self._segments = []
+        self._lock = threading.Lock()
+        self._writer = None
+        self._loop = None
+        self._flush_handle = None
+        #queued (path, seq, records, time) tuples
+        self._queue = []
+        self._queue_bytes = 0
+        self.written = 0
+
+    @property
+    def folder(self):
+        """ segments folder """
+        return self._folder
+
+    @property
+    def queued(self) -> int:
+        """ bytes of records waiting for next flush """
+        return self._queue_bytes
+
+    def open(self, loop=None):
+        """ load index of existing segments and start writer thread """
+        self._loop = loop
+        os.makedirs(self._folder, exist_ok=True)
+        segments = []
+        for name in os.listdir(self._folder):
+            first_id = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX) \
+               and first_id.isdigit():
+                segment = Segment(os.path.join(self._folder, name), int(first_id))
+                segment.scan()
+                segments.append(segment)
+        segments.sort(key=lambda segment: segment.first_id)
+        if segments and os.path.getsize(segments[-1].path) > segments[-1].size:
+            os.truncate(segments[-1].path, segments[-1].size) # incomplete last write
+        self._segments = segments
+        self._writer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='store')
+        Store.LOGGER.info("Store %s opened: %d segment(s), %d block(s)", self._folder,
+                          len(segments), sum(len(segment.blocks) for segment in segments))
+
+    def close(self):
+        """ write queued records and stop writer thread """
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.shutdown(wait=True)
+        self._writer = None
+
+    def on_records(self, records_event):
+        """ callback for SplitRecordsEvent: queue records """
+        if not records_event.records:
+            return
+        self._queue.append((records_event.path, records_event.seq, records_event.records,
+                            records_event.time))
+        self._queue_bytes += sum(len(record) for record in records_event.records)
+        if self._queue_bytes >= self._block_size:
+            self.flush()
+        elif self._flush_handle is None and self._loop is not None:
+            self._flush_handle = self._loop.call_later(self._flush_delay, self.flush)
+
+    def flush(self):
+        """ hand queued records over to writer thread """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._queue or self._writer is None:
+            return
+        queue, self._queue, self._queue_bytes = self._queue, [], 0
+        self._writer.submit(self._write, queue)
+
+    def _blocks(self, queue):
+        """ split queued records in blocks: (path, seq, records, first, last) """
+        current = dict()
+        for path, seq, records, when in queue:
+            block = current.get(path)
+            if block is not None and block[1] + len(block[2]) != seq:
+                yield tuple(current.pop(path)[:5]) # not contiguous: application restarted
+            for record in records:
+                block = current.get(path)
+                if block is None:
+                    block = current[path] = [path, seq, [], when, when, 0]
+                block[2].append(record)
+                block[4] = when
+                block[5] += len(record)
+                seq += 1
+                if block[5] >= self._block_size:
+                    yield tuple(current.pop(path)[:5])
+        for block in current.values():
+            yield tuple(block[:5])
+
+    def _write(self, queue):
+        """ writer thread: append blocks to current segment """
+        try:
+            for path, seq, records, first, last in self._blocks(queue):
+                data = encode_block(path, seq, records, first, last)
+                segment = self._current_segment(len(data))
+                with open(segment.path, 'ab') as fdesc:
+                    fdesc.write(data)
+                with self._lock:
+                    segment.blocks.append(Block(segment.first_id + len(segment.blocks),
+                                                path, seq, len(records), first, last,
+                                                segment, segment.size, len(data)))
+                    segment.size += len(data)
+                self.written += len(records)
+            self._retention()
+        except OSError as exc:
+            Store.LOGGER.error("Unable to write store %s: %s", self._folder, str(exc))
+
+    def _current_segment(self, size: int) -> Segment:
+        """ segment block of size is appended to, new one if current is full """
+        with self._lock:
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or (segment.blocks and segment.size + size > self._segment_size):
+                first_id = segment.first_id + len(segment.blocks) if segment else 0
+                segment = Segment(os.path.join(self._folder, '%s%016d%s' % (
+                    SEGMENT_PREFIX, first_id, SEGMENT_SUFFIX)), first_id)
+                self._segments.append(segment)
+            return segment
+
+    def _retention(self):
+        """ delete oldest segments above max size or age (current one is kept) """
+        limit = time.time() - self._max_age if self._max_age else 0
+        while True:
+            with self._lock:
+                if len(self._segments) < 2:
+                    return
+                oldest = self._segments[0]
+                total = sum(segment.size for segment in self._segments)
+                if (not self._max_size or total <= self._max_size) and oldest.last >= limit:
+                    return
+                del self._segments[0]
+            Store.LOGGER.info("Delete store segment %s", oldest.path)
+            try:
+                os.unlink(oldest.path)
+            except OSError:
+                pass
+
+    def files(self) -> list:
+        """ paths of files with records in store """
+        with self._lock:
+            return sorted({block.path for segment in self._segments for block in segment.blocks})
+
+    def _find(self, path: str, cursor: int, since: float, until: float):
+        """ yield blocks of file from block id cursor matching time range """
+        with self._lock:
+            segments = list(self._segments)
+        index = max(0, bisect.bisect_right([segment.first_id for segment in segments],
+                                           cursor) - 1)
+        for segment in segments[index:]:
+            with self._lock:
+                blocks = list(segment.blocks)
+            for block in blocks:
+                if block.id < cursor or block.path != path or block.last < since or \
+                   (until and block.first > until):
+                    continue
+                yield block
+
+    def read(self, path: str, cursor: int = 0, size: int = 256 << 10, since: float = 0,
+             until: float = 0):
+        """
+            return (records, next cursor) of file from block id cursor, whole
+            blocks until size bytes are read. records: list of (seq, record),
+            next cursor is None when there are no more records
+        """
+        records = []
+        read = 0
+        for block in self._find(path, cursor, since, until):
+            if records and read >= size:
+                return records, block.id
+            try:
+                block_records = block.segment.read(block)
+            except OSError:
+                continue # segment deleted by retention meanwhile
+            records.extend(enumerate(block_records, block.seq))
+            read += sum(len(record) for record in block_records)
+        return records, None
+
+    def search(self, path: str, pattern: str, cursor: int = 0, limit: int = 100,
+               since: float = 0, until: float = 0):
+        """
+            return (matches, next cursor): list of (seq, record) matching regular
+            expression pattern, whole blocks are searched so that limit may be
+            exceeded. next cursor is None when there are no more blocks
+        """
+        try:
+            regex = re.compile(pattern)
+        except re.error as exc:
+            raise ValueError("invalid pattern: %s" % str(exc))
+        matches = []
+        for block in self._find(path, cursor, since, until):
+            if len(matches) >= limit:
+                return matches, block.id
+            try:
+                block_records = block.segment.read(block)
+            except OSError:
+                continue
+            matches.extend((seq, record) for seq, record in enumerate(block_records, block.seq)
+                           if regex.search(record))
+        return matches, None
+
+#store of application (None when store is disabled)
+STORE = None
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3.6
+
+"""
+    stream module: turn file notifications into batches of records
+    posted in event.Manager for consumers (websocket server...)
+"""
+
+import json
+import logging
+import math
+import re
+import time
+
+class RecordsEvent:
+    """
+        batch of records read from one file.
+        RecordsEvent should be registered with EventManager.register_event
+    """
+
+    def __init__(self, path: str, seq: int, records: list, sampled: bool = False,
+                 repeats: list = None):
+        """
+            constructor
+            :param path: path of the file records come from
+            :param seq: sequence number of first record in file stream
+            :param records: list of records (str)
+            :param sampled: True if file is rate limited (records are sampled)
+            :param repeats: list of (seq, count) of records repeated count times
+                            (collapsed repeated records), record may be in a previous event
+        """
+        self._path = path
+        self._seq = seq
+        self._records = records
+        self._sampled = sampled
+        self._repeats = repeats or []
+        self._time = time.time()
+        self._json = None
+        self._size = None
+
+    @property
+    def path(self):
+        """ file path """
+        return self._path
+
+    @property
+    def seq(self):
+        """ sequence number of first record """
+        return self._seq
+
+    @property
+    def records(self):
+        """ list of records """
+        return self._records
+
+    @property
+    def sampled(self):
+        """ True if records are a sample of file records """
+        return self._sampled
+
+    @property
+    def repeats(self):
+        """ list of (seq, count) of repeated records """
+        return self._repeats
+
+    @property
+    def time(self):
+        """ time when records were read """
+        return self._time
+
+    @property
+    def size(self):
+        """ approximate memory size (bytes) of records """
+        if self._size is None:
+            self._size = sum(len(record) for record in self._records) + 64 * len(self._records)
+        return self._size
+
+    def to_json(self) -> str:
+        """ return batch encoded as json message (encoded once) """
+        if self._json is None:
+            message = {"file": self._path, "seq": self._seq, "records": self._records,
+                       "sampled": self._sampled}
+            if self._repeats:
+                # last seen time of repeated records is event time
+                message["repeats"] = [[seq, count, self._time] for seq, count in self._repeats]
+            self._json = json.dumps(message)
+        return self._json
+
+    def __str__(self):
+        return 'RecordsEvent(file="%s", seq=%d, count=%d)' % (self._path, self._seq,
+                                                              len(self._records))
+
+class SplitRecordsEvent(RecordsEvent):
+    """
+        batch of every record split from one file, before rate limiting and
+        collapsing (alert rules, store). seq numbers split records of file, it
+        differs from RecordsEvent seq once records are sampled or collapsed.
+        Posted only if SplitRecordsEvent is registered with EventManager.
+    """
+
+    def __str__(self):
+        return 'SplitRecordsEvent(file="%s", seq=%d, count=%d)' % (self.path, self.seq,
+                                                                   len(self.records))
+
+class TokenBucket:
+    """ token bucket: rate tokens per second, at most burst tokens """
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._time = time.monotonic()
+
+    def consume(self, count: float, now: float) -> bool:
+        """ take count tokens, return False if there are not enough """
+        self._tokens = min(self._burst, self._tokens + (now - self._time) * self._rate)
+        self._time = now
+        if count > self._tokens:
+            return False
+        self._tokens -= count
+        return True
+
+class RateLimiter:
+    """
+        per file rate limit in lines/s and bytes/s. Above limit file switches to
+        sampling mode: 1 record in N is forwarded (N from incoming rate) and
+        '... lines suppressed' markers are inserted every MARKER_INTERVAL. File
+        switches back when incoming rate stays below RESUME_RATIO of limit for
+        a whole WINDOW, or gets no record for a WINDOW (see idle).
+    """
+    LOGGER = logging.getLogger('logtracker.stream.RateLimiter')
+    WINDOW = 1.0
+    MARKER_INTERVAL = 1.0
+    RESUME_RATIO = 0.8
+    MARKER = '[logtracker] %d lines suppressed (sampling 1/%d)'
+
+    def __init__(self, path: str, max_lines: int, max_bytes: int):
+        """
+            constructor
+            :param path: file path (logs)
+            :param max_lines: max lines per second (0: no limit)
+            :param max_bytes: max bytes per second (0: no limit)
+        """
+        self._path = path
+        self._max_lines = max_lines
+        self._max_bytes = max_bytes
+        #one second of burst
+        self._lines = TokenBucket(max_lines, max_lines) if max_lines else None
+        self._bytes = TokenBucket(max_bytes, max_bytes) if max_bytes else None
+        self._sampling = 0 # N of 1/N sampling, 0: not sampled
+        self._counter = 0
+        self._suppressed = 0
+        self._marker_time = 0
+        self._window_start = time.monotonic()
+        self._window_lines = 0
+        self._window_bytes = 0
+        self._last = self._window_start # time of last records
+
+    @property
+    def sampled(self):
+        """ True if file is in sampling mode """
+        return self._sampling > 0
+
+    def _ratio(self, elapsed: float) -> float:
+        """ incoming rate in current window divided by limit """
+        elapsed = max(elapsed, 0.1)
+        ratio = 0
+        if self._max_lines:
+            ratio = self._window_lines / elapsed / self._max_lines
+        if self._max_bytes:
+            ratio = max(ratio, self._window_bytes / elapsed / self._max_bytes)
+        return ratio
+
+    def _marker(self) -> str:
+        marker = RateLimiter.MARKER % (self._suppressed, self._sampling)
+        self._suppressed = 0
+        return marker
+
+    def apply(self, records: list, size: int, now: float = None) -> list:
+        """
+            return records to forward
+            :param records: new records of file
+            :param size: records size in bytes
+        """
+        if now is None:
+            now = time.monotonic()
+        self._last = now
+        self._window_lines += len(records)
+        self._window_bytes += size
+        elapsed = now - self._window_start
+        if elapsed >= RateLimiter.WINDOW:
+            ratio = self._ratio(elapsed)
+            self._window_start = now
+            self._window_lines = 0
+            self._window_bytes = 0
+            if self._sampling:
+                if ratio < RateLimiter.RESUME_RATIO:
+                    RateLimiter.LOGGER.info('File %s back under its rate limit', self._path)
+                    result = [self._marker()] if self._suppressed else []
+                    self._sampling = 0
+                    return result + records
+                self._sampling = max(2, math.ceil(ratio))
+
+        if not self._sampling:
+            lines_ok = self._lines is None or self._lines.consume(len(records), now)
+            bytes_ok = self._bytes is None or self._bytes.consume(size, now)
+            if lines_ok and bytes_ok:
+                return records
+            self._sampling = max(2, math.ceil(self._ratio(elapsed)))
+            self._marker_time = now
+            RateLimiter.LOGGER.warning('File %s over its rate limit, sampling 1/%d',
+                                       self._path, self._sampling)
+
+        result = []
+        for record in records:
+            if self._counter % self._sampling == 0:
+                result.append(record)
+            else:
+                self._suppressed += 1
+            self._counter += 1
+        if self._suppressed and now - self._marker_time >= RateLimiter.MARKER_INTERVAL:
+            self._marker_time = now
+            result.append(self._marker())
+        return result
+
+    def idle(self, now: float = None):
+        """
+            return records to forward when sampled file got no record for a
+            WINDOW (last marker, sampling stops), None if file is not idle
+        """
+        if now is None:
+            now = time.monotonic()
+        if not self._sampling or now - self._last < RateLimiter.WINDOW:
+            return None
+        RateLimiter.LOGGER.info('File %s back under its rate limit (idle)', self._path)
+        return self.stop(now)
+
+    def stop(self, now: float = None):
+        """
+            return records to forward before limiter is dropped or sampling stops
+            (last marker), None if file is not sampled
+        """
+        if not self._sampling:
+            return None
+        result = [self._marker()] if self._suppressed else []
+        self._sampling = 0
+        self._window_start = time.monotonic() if now is None else now
+        self._window_lines = 0
+        self._window_bytes = 0
+        return result
+
+class Collapser:
+    """
+        collapse consecutive identical records of a file: repeated records are not
+        sent again, their count is. In 'masked' mode records are identical if they
+        only differ by numbers (decimal or hex), first record is kept.
+    """
+    MASK = re.compile(r'0x[0-9a-f]+|[0-9a-f]*[0-9][0-9a-f]*', re.IGNORECASE)
+
+    def __init__(self, masked: bool = False):
+        self._masked = masked
+        self._last = None # key of last record sent
+        self._count = 0
+        self._reported = 0 # count of last record already reported
+
+    def _key(self, record: str) -> str:
+        return Collapser.MASK.sub('#', record) if self._masked else record
+
+    def apply(self, records: list):
+        """
+            return (records to send, repeats): repeats is a list of (index, count),
+            index of record in records to send, -1 for last record sent before
+        """
+        result = []
+        repeats = []
+        for record in records:
+            key = self._key(record)
+            if key == self._last:
+                self._count += 1
+                continue
+            if self._count > self._reported:
+                repeats.append((len(result) - 1, self._count))
+            self._last = key
+            self._count = self._reported = 1
+            result.append(record)
+        if self._count > self._reported:
+            repeats.append((len(result) - 1, self._count))
+            self._reported = self._count
+        return result, repeats
+
+class RecordStream:
+    """
+        RecordStream reads modifications of files notified by FileNotifierService,
+        split them in records and posts RecordsEvent in event manager
+    """
+    LOGGER = logging.getLogger('logtracker.stream.RecordStream')
+    #max lines/s of every file under memory pressure (see set_pressure)
+    PRESSURE_MAX_LINES = 200
+    #delay (s) between two checks of sampled files without new records
+    IDLE_CHECK = 1.0
+
+    def __init__(self, manager, limits=None, collapse=None, sizes=None):
+        """
+            constructor
+            :param manager: event.Manager records are posted to
+            :param limits: function returning (max lines/s, max bytes/s) of a file path
+                           (default: no limit)
+            :param collapse: function returning collapse mode of a file path
+                             (none, exact or masked, default: none)
+            :param sizes: function returning (max record size, max bytes extracted
+                          per event) in bytes (default: no limit)
+        """
+        self._manager = manager
+        self._limits = limits
+        self._collapse = collapse
+        self._sizes = sizes
+        self._max_sizes = None
+        self._seqs = dict()
+        self._split_seqs = dict()
+        self._limiters = dict()
+        self._collapsers = dict()
+        self._pressure = False
+        self._loop = None
+        self._idle_handle = None
+
+    def start(self, loop):
+        """ check sampled files without new records periodically """
+        self._loop = loop
+        self._idle_handle = loop.call_later(RecordStream.IDLE_CHECK, self._periodic)
+
+    def stop(self):
+        """ stop idle files checks """
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+
+    def _periodic(self):
+        self.flush_idle()
+        self._idle_handle = self._loop.call_later(RecordStream.IDLE_CHECK, self._periodic)
+
+    def _post_last(self, path, records):
+        """ post last records of a file whose sampling stops """
+        if records is None:
+            return
+        seq = self._seqs.get(path, 0)
+        self._seqs[path] = seq + len(records)
+        # posted without records too: clients clear sampled state of file
+        self._manager.post_event(RecordsEvent(path, seq, records))
+
+    def flush_idle(self, now: float = None):
+        """ post last suppressed lines marker of idle sampled files, sampling stops """
+        for path, limiter in self._limiters.items():
+            if limiter is not None:
+                self._post_last(path, limiter.idle(now))
+
+    def _drop_limiters(self, paths):
+        """ post last marker of sampled files and forget their limiters """
+        for path in paths:
+            limiter = self._limiters.pop(path, None)
+            if limiter is not None:
+                self._post_last(path, limiter.stop())
+
+    def set_pressure(self, pressure: bool):
+        """ sample every file above PRESSURE_MAX_LINES while memory is short """
+        if pressure != self._pressure:
+            RecordStream.LOGGER.warning('Memory pressure: records sampling %s',
+                                        'on' if pressure else 'off')
+            self._pressure = pressure
+            self._drop_limiters(list(self._limiters))
+
+    def reset_files(self, paths: list):
+        """ forget rate limiters and collapsers of files whose settings changed """
+        self._drop_limiters(paths)
+        for path in paths:
+            self._collapsers.pop(path, None)
+        self._max_sizes = None
+
+    def _collapser(self, path):
+        """ collapser of file, None if records are not collapsed """
+        if path not in self._collapsers:
+            mode = self._collapse(path) if self._collapse else 'none'
+            self._collapsers[path] = Collapser(mode == 'masked') if mode != 'none' else None
+        return self._collapsers[path]
+
+    def _limiter(self, path):
+        """ rate limiter of file, None if not limited """
+        if path not in self._limiters:
+            max_lines, max_bytes = self._limits(path) if self._limits else (0, 0)
+            if self._pressure:
+                max_lines = min(max_lines or RecordStream.PRESSURE_MAX_LINES,
+                                RecordStream.PRESSURE_MAX_LINES)
+            self._limiters[path] = RateLimiter(path, max_lines, max_bytes) \
+                if max_lines or max_bytes else None
+        return self._limiters[path]
+
+    def on_file_event(self, file_event):
+        """ callback for FileNotifierEvent: extract new records of file """
+        state = file_event.state
+        if state is None:
+            return
+        if state.requeued is file_event:
+            state.requeued = None
+
+        if self._max_sizes is None:
+            self._max_sizes = self._sizes() if self._sizes else (0, 0)
+        max_record, max_read = self._max_sizes
+        content = bytearray()
+        if state.extract(content, max_read) == 0:
+            return
+        state.move_next(len(content))
+        if state.pending and state.requeued is None:
+            # large append: next chunk extracted after events of other files,
+            # by a single event whatever the number of notifications
+            state.requeued = file_event
+            self._manager.post_event(file_event)
+
+        records = state.split(content, max_record)
+        path = state.file_path
+        if records and self._manager.registered(SplitRecordsEvent):
+            records = [rec.decode('utf-8', 'replace') for rec in records]
+            seq = self._split_seqs.get(path, 0)
+            self._split_seqs[path] = seq + len(records)
+            self._manager.post_event(SplitRecordsEvent(path, seq, records))
+        limiter = self._limiter(path)
+        if limiter is not None:
+            # bytes limit counts extracted bytes, incomplete trailing line included
+            records = limiter.apply(records, len(content))
+        records = [rec if isinstance(rec, str) else rec.decode('utf-8', 'replace')
+                   for rec in records]
+        repeats = []
+        seq = self._seqs.get(path, 0)
+        collapser = self._collapser(path)
+        if collapser is not None:
+            records, repeats = collapser.apply(records)
+            repeats = [(seq + index, count) for index, count in repeats]
+        if records or repeats:
+            self._seqs[path] = seq + len(records)
+            self._manager.post_event(
+                RecordsEvent(path, seq, records, limiter is not None and limiter.sampled,
+                             repeats))
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3.6
+
+"""
+    tail module: stream records to local terminal clients over a Unix domain socket
+    ('logtracker tail'), with length-prefixed binary frames instead of websocket
+    handshake and json.
+
+    frame: header (type: 1 byte, payload length: 4 bytes, network order) + payload
+        client -> server  REQUEST: lines 'file<TAB>path' (default all files) and
+                          'match<TAB>regex' (records filter)
+        server -> client  FILES:   lines 'path<TAB>color' of watched files
+                          RECORDS: path length (2 bytes), path, seq (4 bytes),
+                                   count (4 bytes), then each record length (4 bytes)
+                                   and record (utf-8), then optionally repeats count
+                                   (4 bytes) and each repeat index (4 bytes signed,
+                                   index of record in frame, -1 for last record of
+                                   file sent before) and count (4 bytes) of
+                                   collapsed repeated records
+                          DROPPED: number of records dropped (4 bytes), client too slow
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import re
+import struct
+import sys
+
+REQUEST = 1
+FILES = 2
+RECORDS = 3
+DROPPED = 4
+
+HEADER = struct.Struct('!BI')
+DEFAULT_SOCKET = '/tmp/logtracker.sock'
+MAX_FRAME = 64 << 20
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    """ return frame bytes """
+    return HEADER.pack(frame_type, len(payload)) + payload
+
+def encode_records(path: str, seq: int, records: list, repeats: list = None) -> bytes:
+    """ return RECORDS frame of records (str) and repeats: (index, count) list """
+    path = path.encode('utf-8')
+    parts = [struct.pack('!H', len(path)), path, struct.pack('!II', seq, len(records))]
+    for record in records:
+        record = record.encode('utf-8', 'replace')
+        parts.append(struct.pack('!I', len(record)))
+        parts.append(record)
+    if repeats:
+        parts.append(struct.pack('!I', len(repeats)))
+        parts.extend(struct.pack('!iI', index, count) for index, count in repeats)
+    return encode_frame(RECORDS, b''.join(parts))
+
+def decode_records(payload: bytes):
+    """ return (path, seq, list of records bytes, repeats) of RECORDS frame payload """
+    (length,) = struct.unpack_from('!H', payload)
+    path = payload[2:2 + length].decode('utf-8')
+    offset = 2 + length
+    seq, count = struct.unpack_from('!II', payload, offset)
+    offset += 8
+    records = []
+    for _ in range(count):
+        (length,) = struct.unpack_from('!I', payload, offset)
+        offset += 4
+        records.append(payload[offset:offset + length])
+        offset += length
+    repeats = []
+    if offset < len(payload):
+        (count,) = struct.unpack_from('!I', payload, offset)
+        repeats = [struct.unpack_from('!iI', payload, offset + 4 + 8 * index)
+                   for index in range(count)]
+    return path, seq, records, repeats
+
+async def read_frame(reader):
+    """ return (frame type, payload) read from stream, raise EOFError at end """
+    try:
+        header = await reader.readexactly(HEADER.size)
+        frame_type, length = HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise EOFError("frame too large (%d bytes)" % length)
+        return frame_type, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise EOFError("connection closed")
+
+class TailClient:
+    """ connected tail client: subscribed files and records filter """
+
+    def __init__(self, writer, files, regex):
+        self.writer = writer
+        self.files = set(files)
+        self.regex = regex
+        self.dropped = 0
+
+    def wants(self, path):
+        """ True if client subscribed to file """
+        return not self.files or path in self.files
+
+class TailServer:
+    """
+        TailServer listens on a Unix socket and sends RecordsEvent of subscribed
+        files to connected clients. Frames are encoded once per event for clients
+        without filter. Records are dropped for clients which do not read fast enough.
+    """
+    LOGGER = logging.getLogger('logtracker.tail.TailServer')
+    #write buffer size above which records are dropped
+    MAX_BUFFER = 4 << 20
+
+    def __init__(self, path: str, files_list):
+        """
+            constructor
+            :param path: Unix socket path
+            :param files_list: function returning watched files description
+        """
+        self._path = path
+        self._files_list = files_list
+        self._server = None
+        self._inode = None # inode of socket created by server
+        self._clients = set()
+        #last record of each file (repeats of records sent before)
+        self._last = dict()
+
+    @property
+    def clients(self):
+        """ number of connected clients """
+        return len(self._clients)
+
+    @staticmethod
+    async def listening(path: str) -> bool:
+        """ True if a process accepts connections on Unix socket path """
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+        except OSError:
+            return False
+        writer.close()
+        return True
+
+    async def start(self):
+        """
+            listen on Unix socket (only accessible by current user), unless another
+            process listens on it
+        """
+        if os.path.exists(self._path):
+            if await TailServer.listening(self._path):
+                TailServer.LOGGER.error("Tail socket %s used by another process, tail server "
+                                        "not started", self._path)
+                return
+            os.unlink(self._path) # left by a previous run
+        # socket created with 0600 permissions (no chmod after creation)
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self.on_client, self._path)
+        finally:
+            os.umask(umask)
+        self._inode = os.stat(self._path).st_ino
+        TailServer.LOGGER.info("Tail server listening on %s", self._path)
+
+    def stop(self):
+        """ stop listening and disconnect clients """
+        if self._server is None:
+            return
+        TailServer.LOGGER.info("Stop tail server")
+        self._server.close()
+        self._server = None
+        for client in list(self._clients):
+            client.writer.close()
+        self._clients.clear()
+        try:
+            # socket path may have been taken over since: only ours is deleted
+            if os.stat(self._path).st_ino == self._inode:
+                os.unlink(self._path)
+        except OSError:
+            pass
+        self._inode = None
+
+    def files_frame(self) -> bytes:
+        """ FILES frame of watched files """
+        return encode_frame(FILES, '\n'.join('%s\t%s' % (file["path"], file["color"])
+                                             for file in self._files_list()).encode('utf-8'))
+
+    def push_files(self):
+        """ send watched files to clients (config changed) """
+        frame = self.files_frame()
+        for client in self._clients:
+            client.writer.write(frame)
+
+    async def on_client(self, reader, writer):
+        """ client connection handler """
+        try:
+            frame_type, payload = await read_frame(reader)
+            if frame_type != REQUEST:
+                raise EOFError("request expected")
+            files, regex = [], None
+            for line in payload.decode('utf-8').splitlines():
+                key, _, value = line.partition('\t')
+                if key == 'file':
+                    files.append(value)
+                elif key == 'match':
+                    regex = re.compile(value)
+        except (EOFError, re.error, UnicodeDecodeError) as exc:
+            TailServer.LOGGER.warning('Invalid tail request: %s', str(exc))
+            writer.close()
+            return
+
+        client = TailClient(writer, files, regex)
+        TailServer.LOGGER.info('Tail client connected, files=%s', files or 'all')
+        writer.write(self.files_frame())
+        self._clients.add(client)
+        try:
+            while await reader.read(4096):
+                pass # client sends nothing after request
+        except ConnectionError:
+            pass
+        finally:
+            TailServer.LOGGER.info('Tail client disconnected')
+            self._clients.discard(client)
+            writer.close()
+
+    def on_records(self, records_event):
+        """ callback for RecordsEvent: send records to subscribed clients """
+        path, seq, records = records_event.path, records_event.seq, records_event.records
+        # repeats: (index of record in event, -1 for record of a previous event, count)
+        repeats = [(max(-1, repeat_seq - seq), count)
+                   for repeat_seq, count in records_event.repeats]
+        last = self._last.get(path)
+        if records:
+            self._last[path] = records[-1]
+        if not records and not repeats:
+            return
+        frame = None
+        for client in self._clients:
+            if not client.wants(path):
+                continue
+            if client.regex is None:
+                if frame is None:
+                    frame = encode_records(path, seq, records, repeats)
+                data, count = frame, len(records)
+            else:
+                indexes = dict()
+                matched = []
+                for index, record in enumerate(records):
+                    if client.regex.search(record):
+                        indexes[index] = len(matched)
+                        matched.append(record)
+                if last is not None and client.regex.search(last):
+                    indexes[-1] = -1
+                client_repeats = [(indexes[index], count) for index, count in repeats
+                                  if index in indexes]
+                if not matched and not client_repeats:
+                    continue
+                data = encode_records(path, seq, matched, client_repeats)
+                count = len(matched)
+            self._send(client, data, count)
+
+    def buffered(self) -> int:
+        """ bytes not yet sent to clients """
+        return sum(client.writer.transport.get_write_buffer_size() for client in self._clients)
+
+    def drop_slow(self, size: int, min_buffer: int = 1 << 16) -> int:
+        """
+            disconnect clients with most unsent bytes (at least min_buffer) until
+            about size bytes are freed, return bytes freed
+        """
+        freed = 0
+        for buffered, client in sorted(((client.writer.transport.get_write_buffer_size(),
+                                         client) for client in self._clients),
+                                       key=lambda item: -item[0]):
+            if freed >= size or buffered < min_buffer:
+                break
+            TailServer.LOGGER.warning('Memory pressure: disconnect tail client')
+            self._clients.discard(client)
+            client.writer.transport.abort()
+            freed += buffered
+        return freed
+
+    @staticmethod
+    def _send(client, data, count):
+        """ write frame or drop it if client does not read fast enough """
+        transport = client.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > TailServer.MAX_BUFFER:
+            client.dropped += count
+            return
+        if client.dropped:
+            client.writer.write(encode_frame(DROPPED, struct.pack('!I', client.dropped)))
+            client.dropped = 0
+        client.writer.write(data)
+
+#ANSI colors of config color names
+COLORS = {"black": 30, "red": 31, "green": 32, "yellow": 33, "blue": 34, "purple": 35,
+          "pink": 95, "orange": 91, "grey": 90}
+AUTO_COLORS = ["blue", "green", "purple", "orange", "red", "yellow", "pink", "grey"]
+
+class Printer:
+    """ print records on terminal with file colors """
+
+    def __init__(self, output, color=True):
+        self._output = output
+        self._color = color
+        self._files = dict()
+        #last record printed of each file (repeated records)
+        self._last = dict()
+
+    def set_files(self, payload: bytes):
+        """ FILES frame: files colors """
+        self._files.clear()
+        for index, line in enumerate(payload.decode('utf-8').splitlines()):
+            path, _, color = line.rpartition('\t')
+            if color not in COLORS:
+                color = AUTO_COLORS[index % len(AUTO_COLORS)]
+            self._files[path] = COLORS[color]
+
+    def print_records(self, payload: bytes, prefix: bool):
+        """
+            RECORDS frame: write records, prefixed with file name if prefix.
+            Repeated records get a ' [xN]' suffix, a record printed before is
+            printed again with its new count.
+        """
+        path, _, records, repeats = decode_records(payload)
+        head = ('%s: ' % os.path.basename(path)).encode('utf-8') if prefix else b''
+        color = self._files.get(path) if self._color else None
+        records = list(records)
+        last = self._last.get(path)
+        if records:
+            self._last[path] = records[-1]
+        before = []
+        for index, count in repeats:
+            if index >= 0:
+                records[index] += b' [x%d]' % count
+            elif last is not None:
+                before = [last + b' [x%d]' % count]
+        records = before + records
+        lines = []
+        for record in records:
+            if color is None:
+                lines.append(head + record + b'\n')
+            else:
+                lines.append(b'\x1b[%dm' % color + head + record + b'\x1b[0m\n')
+        self._output.write(b''.join(lines))
+        self._output.flush()
+
+async def tail(path: str, files: list, match: str, printer: Printer):
+    """ connect to tail server and print records until connection is closed """
+    reader, writer = await asyncio.open_unix_connection(path)
+    request = ['file\t%s' % file for file in files]
+    if match:
+        request.append('match\t%s' % match)
+    writer.write(encode_frame(REQUEST, '\n'.join(request).encode('utf-8')))
+    try:
+        while True:
+            frame_type, payload = await read_frame(reader)
+            if frame_type == FILES:
+                printer.set_files(payload)
+            elif frame_type == RECORDS:
+                printer.print_records(payload, len(files) != 1)
+            elif frame_type == DROPPED:
+                sys.stderr.write('logtracker: %d records dropped\n' %
+                                 struct.unpack('!I', payload)[0])
+    except EOFError:
+        pass
+    finally:
+        writer.close()
+
+def main(argv=None):
+    """ 'logtracker tail' entry point """
+    parser = argparse.ArgumentParser(prog='logtracker tail',
+                                     description='print records of running logtracker')
+    parser.add_argument('files', nargs='*', help='watched files (default: all)')
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET,
+                        help='logtracker tail socket (config tail.socket)')
+    parser.add_argument('-m', '--match', help='print only records matching regex')
+    parser.add_argument('--no-color', action='store_true', help='disable colors')
+    args = parser.parse_args(argv)
+
+    printer = Printer(sys.stdout.buffer, not args.no_color and sys.stdout.isatty())
+    files = [os.path.abspath(file) if os.path.exists(file) else file for file in args.files]
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            tail(args.socket, files, args.match, printer))
+    except OSError as exc:
+        sys.stderr.write('logtracker: unable to connect to %s: %s\n' % (args.socket, str(exc)))
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3.6
+
+"""
+    timeline module: records of several files merged in a single time ordered view
+    (nginx.log, app.log and worker.log of a request interleaved by time).
+
+    Record time is parsed from its first characters (ISO 8601, common log format,
+    syslog), records without time (continuation lines...) take the time of the
+    previous record of their file. Files are read lazily in chunks, oldest
+    rotation first, from the offset of since found by binary search on record
+    times, and merged with a heap (one pending record per file).
+    Live records are kept a reorder window before being released, so that
+    records of files notified late are still sent in order.
+"""
+
+import calendar
+import heapq
+import operator
+import re
+import time
+import logtracker.history
+
+MONTHS = {name: index for index, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+
+def _offset(zone: str) -> int:
+    """ seconds of utc offset '+0200', '-05:00' or 'Z' """
+    if not zone or zone == 'Z':
+        return 0
+    zone = zone.replace(':', '')
+    seconds = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+    return -seconds if zone[0] == '-' else seconds
+
+def _timestamp(fields: tuple, zone) -> float:
+    """ timestamp of (year, month, day, hour, minute, second), local time if zone is None """
+    if zone is None:
+        return time.mktime(fields + (0, 0, -1))
+    return calendar.timegm(fields + (0, 0, 0)) - _offset(zone)
+
+def _iso(match) -> float:
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    stamp = _timestamp((int(year), int(month), int(day), int(hour), int(minute), int(second)),
+                       zone)
+    return stamp + (float('0.' + fraction) if fraction else 0)
+
+def _clf(match) -> float:
+    day, month, year, hour, minute, second, zone = match.groups()
+    return _timestamp((int(year), MONTHS.get(month, 1), int(day), int(hour), int(minute),
+                       int(second)), zone)
+
+def _syslog(match) -> float:
+    month, day, hour, minute, second = match.groups()
+    now = time.time()
+    year = time.localtime(now).tm_year
+    stamp = _timestamp((year, MONTHS.get(month, 1), int(day), int(hour), int(minute),
+                        int(second)), None)
+    # no year: record of december read in january
+    return _timestamp((year - 1, MONTHS.get(month, 1), int(day), int(hour), int(minute),
+                       int(second)), None) if stamp > now + 86400 else stamp
+
+# (regex, converter) of supported time formats
+FORMATS = [
+    (re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:[.,](\d{1,9}))?'
+                r' ?(Z|[+-]\d\d:?\d\d)?'), _iso),
+    (re.compile(r'\[(\d\d)/(\w{3})/(\d{4}):(\d\d):(\d\d):(\d\d) ([+-]\d{4})\]'), _clf),
+    (re.compile(r'^(\w{3})  ?(\d{1,2}) (\d\d):(\d\d):(\d\d)'), _syslog),
+]
+
+class TimeParser:
+    """ parse record times of a file: format found last is tried first """
+    #characters of record searched for a time
+    PREFIX = 100
+
+    def __init__(self):
+        self._formats = list(FORMATS)
+
+    def parse(self, record: str):
+        """ return time of record, None if it has no time """
+        head = record[:TimeParser.PREFIX]
+        for index, (regex, converter) in enumerate(self._formats):
+            match = regex.search(head)
+            if match is not None:
+                try:
+                    stamp = converter(match)
+                except (ValueError, OverflowError):
+                    continue
+                if index:
+                    self._formats.insert(0, self._formats.pop(index))
+                return stamp
+        return None
+
+#binary search stops when offsets range is smaller
+SEEK_BLOCK = 64 * 1024
+#lines read at a probed offset to find a record time
+SEEK_LINES = 16
+
+def _probe(reader, offset: int, parser: TimeParser):
+    """ time of first record with time at or after offset, None if not found """
+    for count, (_, line) in enumerate(logtracker.history.lines(reader, offset)):
+        stamp = parser.parse(line[:TimeParser.PREFIX].decode('utf-8', 'replace'))
+        if stamp is not None or count >= SEEK_LINES:
+            return stamp
+    return None
+
+def seek(reader, size: int, since: float, parser: TimeParser) -> int:
+    """
+        return offset of file (PlainReader or GzipIndex) before its records of
+        since: binary search on records times, assumed ordered
+    """
+    low, high = 0, size
+    while high - low > SEEK_BLOCK:
+        middle = (low + high) // 2
+        stamp = _probe(reader, middle, parser)
+        if stamp is not None and stamp < since:
+            low = middle
+        else:
+            high = middle
+    return low
+
+def file_records(path: str, since: float = 0, until: float = 0):
+    """
+        generator of (time, path, record) of file rotations, oldest first, from
+        since to until (0: no limit). Rotations modified before since are skipped,
+        reading starts at offset of since in first rotation.
+    """
+    parser = TimeParser()
+    last = 0
+    for rotation in reversed(logtracker.history.rotations(path)):
+        if rotation.mtime < since:
+            continue
+        reader = logtracker.history.HISTORY.reader(rotation)
+        offset = 0
+        if since and last < since:
+            size = reader.size if rotation.compressed else rotation.size
+            offset = seek(reader, size, since, parser)
+        for _, line in logtracker.history.lines(reader, offset):
+            record = line.decode('utf-8', 'replace')
+            stamp = parser.parse(record)
+            if stamp is not None:
+                last = stamp
+            if last < since:
+                continue
+            if until and last > until:
+                return
+            yield last, path, record
+
+def merge(paths: list, since: float = 0, until: float = 0, limit: int = 1000, skip: int = 0):
+    """
+        return (records, next cursor) of files merged by time: records is a list of
+        (time, path, record), at most limit. skip: records at time since already read.
+        next cursor is (since, skip) of next call, None when records are all read
+    """
+    readers = [file_records(path, since, until) for path in paths]
+    records = []
+    skipped = 0
+    try:
+        for item in heapq.merge(*readers, key=operator.itemgetter(0)):
+            if skipped < skip and item[0] == since:
+                skipped += 1
+                continue
+            if len(records) >= limit:
+                last = records[-1][0]
+                count = sum(1 for record in records if record[0] == last)
+                return records, (last, count + (skip if last == since else 0))
+            records.append(item)
+    finally:
+        for reader in readers:
+            reader.close()
+    return records, None
+
+class LiveTimeline:
+    """
+        records of files subscribed by a client, ordered by time and released
+        after window seconds (late records of the window are sent in order)
+    """
+
+    def __init__(self, paths: list, window: float):
+        self.paths = set(paths)
+        self.window = window
+        self._heap = []
+        self._count = 0 # insertion order of records of same time
+        self._parsers = {path: TimeParser() for path in paths}
+        self._last = dict()
+        #time of last released record: late records are released with it
+        self._released = 0
+
+    def add(self, records_event):
+        """ add records of RecordsEvent (event time for records without time) """
+        path = records_event.path
+        parser = self._parsers.get(path)
+        if parser is None:
+            return
+        last = self._last.get(path, records_event.time)
+        for record in records_event.records:
+            stamp = parser.parse(record)
+            if stamp is not None:
+                last = stamp
+            self._count += 1
+            # a record is not later than when it was read (clock skew, time zone)
+            heapq.heappush(self._heap, (max(min(last, records_event.time), self._released),
+                                        self._count, path, record))
+        self._last[path] = last
+
+    def buffered(self) -> int:
+        """ bytes of records not released """
+        return sum(len(item[3]) for item in self._heap)
+
+    def release(self, now: float) -> list:
+        """ return (time, path, record) of records older than window, in time order """
+        records = []
+        limit = now - self.window
+        while self._heap and self._heap[0][0] <= limit:
+            stamp, _, path, record = heapq.heappop(self._heap)
+            records.append((stamp, path, record))
+        if records:
+            self._released = records[-1][0]
+        return records
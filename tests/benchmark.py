@@ -0,0 +1,273 @@
+#!/usr/bin/env python3.6
+
+"""
+    End-to-end benchmark: start the real Application in a child process against
+    temporary files, drive synthetic writers and read records back with a local
+    websocket client. Results (throughput, write-to-receive latency, server CPU
+    and RSS) are printed as JSON so that releases can be compared.
+
+    usage: python -m tests.benchmark --rate 2000 --files 4 --style close --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import os.path
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import websockets
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def free_port():
+    """ return a free tcp port on localhost """
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+def write_config(folder, files, http_port, ws_port, backend='thread'):
+    """ write application config file for benchmark, return its path """
+    config_file = os.path.join(folder, 'config.yaml')
+    with open(config_file, 'w') as fdesc:
+        fdesc.write('server:\n')
+        fdesc.write('  http:\n    host: localhost\n    port: %d\n' % http_port)
+        fdesc.write('  websocket:\n    host: localhost\n    port: %d\n' % ws_port)
+        fdesc.write('    url: ws://localhost:%d\n' % ws_port)
+        fdesc.write('logs:\n  folder: %s\n  prefix: bench\n' % folder)
+        fdesc.write('notifier:\n  backend: %s\n' % backend)
+        fdesc.write('files:\n')
+        for file in files:
+            fdesc.write('  - path: %s\n' % file)
+    return config_file
+
+def run_application(config_file):
+    """ child process entry point: run the application until SIGINT """
+    # pylint: disable=import-outside-toplevel
+    import logtracker.main
+    logtracker.main.Application(config_file).start()
+
+def process_stats(pid):
+    """ return (cpu seconds, rss bytes, peak rss bytes) of process from /proc """
+    with open('/proc/%d/stat' % pid) as fdesc:
+        fields = fdesc.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    rss = int(fields[21]) * PAGE_SIZE
+    peak = rss
+    with open('/proc/%d/status' % pid) as fdesc:
+        for line in fdesc:
+            if line.startswith('VmHWM:'):
+                peak = int(line.split()[1]) * 1024
+    return cpu, rss, peak
+
+def percentile(values, pct):
+    """ return percentile of sorted values """
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+class Writer(threading.Thread):
+    """
+        synthetic writer: append lines at given rate. each line starts with
+        its write time so that client can compute latency.
+        style 'close': open/append/close for each batch (IN_CLOSE_WRITE)
+        style 'open': file descriptor held open and flushed (IN_MODIFY only)
+    """
+    TICK = 0.01
+
+    def __init__(self, path, rate, line_size, style, stop_event):
+        super().__init__(name='writer-%s' % os.path.basename(path), daemon=True)
+        self._path = path
+        self._rate = rate
+        self._line_size = line_size
+        self._style = style
+        self._stop_event = stop_event
+        self.written = 0
+
+    def _lines(self, count):
+        lines = []
+        for _ in range(count):
+            head = '%.6f %d ' % (time.time(), self.written)
+            lines.append(head + 'x' * max(0, self._line_size - len(head) - 1) + '\n')
+            self.written += 1
+        return ''.join(lines)
+
+    def run(self):
+        fdesc = open(self._path, 'a') if self._style == 'open' else None
+        start = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                due = int((time.monotonic() - start) * self._rate) - self.written
+                if due > 0:
+                    if fdesc is None:
+                        with open(self._path, 'a') as tmp:
+                            tmp.write(self._lines(due))
+                    else:
+                        fdesc.write(self._lines(due))
+                        fdesc.flush()
+                time.sleep(Writer.TICK)
+        finally:
+            if fdesc is not None:
+                fdesc.close()
+
+class Client(threading.Thread):
+    """ websocket client running its own event loop, collects latencies """
+
+    def __init__(self, url):
+        super().__init__(name='ws-client', daemon=True)
+        self._url = url
+        self._loop = asyncio.new_event_loop()
+        self._stop_future = None
+        self.connected = threading.Event()
+        self.latencies = []
+        self.received = 0
+        self.bytes = 0
+
+    async def _receive(self):
+        for _ in range(100):
+            try:
+                wsock = await websockets.connect(self._url)
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("unable to connect to %s" % self._url)
+
+        self._stop_future = self._loop.create_future()
+        self.connected.set()
+        try:
+            while True:
+                recv = asyncio.ensure_future(wsock.recv())
+                done, _ = await asyncio.wait([recv, self._stop_future],
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if recv not in done:
+                    recv.cancel()
+                    break
+                now = time.time()
+                message = recv.result()
+                self.bytes += len(message)
+                for record in json.loads(message)['records']:
+                    self.latencies.append(now - float(record.split(' ', 1)[0]))
+                    self.received += 1
+        finally:
+            await wsock.close()
+
+    def run(self):
+        self._loop.run_until_complete(self._receive())
+
+    def stop(self):
+        """ stop client from other thread """
+        self._loop.call_soon_threadsafe(self._stop_future.set_result, None)
+        self.join()
+
+def run_benchmark(args):
+    """ run one benchmark and return results dictionary """
+    folder = tempfile.mkdtemp(prefix='logtracker-bench-')
+    try:
+        return measure(args, folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def measure(args, folder):
+    """ run application with its config and watched files in folder, measure it """
+    files = [os.path.join(folder, 'bench%d.log' % i) for i in range(args.files)]
+    for file in files:
+        open(file, 'w').close()
+    ws_port = free_port()
+    config_file = write_config(folder, files, free_port(), ws_port, args.backend)
+
+    server = multiprocessing.Process(target=run_application, args=(config_file,))
+    server.start()
+    client = Client('ws://localhost:%d' % ws_port)
+    client.start()
+    if not client.connected.wait(15):
+        server.terminate()
+        raise RuntimeError("application did not start")
+    time.sleep(args.warmup)
+
+    stop_event = threading.Event()
+    writers = [Writer(file, args.rate / args.files, args.line_size, args.style, stop_event)
+               for file in files]
+    cpu_start, _, _ = process_stats(server.pid)
+    start = time.monotonic()
+    for writer in writers:
+        writer.start()
+    time.sleep(args.duration)
+    stop_event.set()
+    for writer in writers:
+        writer.join()
+    written = sum(writer.written for writer in writers)
+
+    drain_deadline = time.monotonic() + args.drain
+    while client.received < written and time.monotonic() < drain_deadline:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - start
+    cpu_end, rss, peak_rss = process_stats(server.pid)
+
+    client.stop()
+    os.kill(server.pid, signal.SIGINT)
+    server.join(10)
+    if server.is_alive():
+        server.terminate()
+
+    latencies = sorted(client.latencies)
+    return {
+        "params": vars(args),
+        "written": written,
+        "received": client.received,
+        "lost": written - client.received,
+        "elapsed_s": elapsed,
+        "throughput_lps": client.received / elapsed,
+        "throughput_bps": client.bytes / elapsed,
+        "latency_s": {
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+            "p999": percentile(latencies, 99.9),
+            "max": latencies[-1] if latencies else None,
+        },
+        "server": {
+            "cpu_s": cpu_end - cpu_start,
+            "cpu_pct": 100 * (cpu_end - cpu_start) / elapsed,
+            "rss_bytes": rss,
+            "peak_rss_bytes": peak_rss,
+        },
+        "python": sys.version.split()[0],
+    }
+
+def parse_args(argv=None):
+    """ command line arguments """
+    parser = argparse.ArgumentParser(description='logtracker end-to-end benchmark')
+    parser.add_argument('--rate', type=float, default=1000, help='total lines/s written')
+    parser.add_argument('--line-size', type=int, default=120, help='line size in bytes')
+    parser.add_argument('--files', type=int, default=2, help='number of written files')
+    parser.add_argument('--style', choices=['close', 'open'], default='close',
+                        help="'close': append and close, 'open': held-open fd")
+    parser.add_argument('--backend', choices=['thread', 'async'], default='thread',
+                        help='file notifier backend')
+    parser.add_argument('--duration', type=float, default=10, help='write duration (s)')
+    parser.add_argument('--warmup', type=float, default=1, help='delay before writing (s)')
+    parser.add_argument('--drain', type=float, default=5,
+                        help='max delay waiting for remaining records (s)')
+    parser.add_argument('--output', help='json result file (default stdout)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """ benchmark entry point """
+    args = parse_args(argv)
+    result = json.dumps(run_benchmark(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as fdesc:
+            fdesc.write(result)
+    else:
+        print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3.6
+
+"""
+    Websocket fan-out load test: open many local websocket clients against
+    logtracker (started in a child process like tests.benchmark, or already
+    running with --url) while synthetic writers append timestamped lines.
+
+    Clients behave as fast readers, slow readers (pause between two messages,
+    server send buffers grow) or churners (connect, read a while, disconnect),
+    subscribed to every record or to a timeline of some files. Results (delivery
+    latency distribution, lost records, unexpected disconnections, server CPU
+    and RSS, event handlers statistics) are printed as JSON.
+
+    usage: python -m tests.loadtest --clients 2000 --mix fast=0.8,slow=0.1,churn=0.1
+                                    --timeline 0.2 --rate 200 --duration 20
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import os.path
+import random
+import resource
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import websockets
+
+# pylint: disable=import-error, wrong-import-position
+from tests.benchmark import Writer, free_port, percentile, process_stats, run_application, \
+    write_config
+
+BEHAVIOURS = ['fast', 'slow', 'churn']
+#latencies kept by each client process (reservoir sampling above)
+MAX_LATENCIES = 200000
+
+def parse_mix(value):
+    """ 'fast=0.8,slow=0.2' -> {'fast': 0.8, 'slow': 0.2}, ratios normalized """
+    mix = dict()
+    for item in value.split(','):
+        name, _, ratio = item.partition('=')
+        if name not in BEHAVIOURS:
+            raise argparse.ArgumentTypeError('behaviour should be one of %s' % BEHAVIOURS)
+        mix[name] = float(ratio or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError('mix ratios should not all be 0')
+    return {name: ratio / total for name, ratio in mix.items()}
+
+def behaviours(count, mix):
+    """ list of count behaviours in mix proportions """
+    result = []
+    for name, ratio in mix.items():
+        result.extend([name] * int(round(count * ratio)))
+    return (result + [max(mix, key=mix.get)] * count)[:count]
+
+def raise_fd_limit():
+    """ raise open files soft limit to hard limit (one socket per client) """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+class Stats:
+    """ counters of clients of a process """
+
+    def __init__(self, seed):
+        self._random = random.Random(seed)
+        self.connects = 0
+        self.failures = 0
+        self.disconnects = 0
+        self.messages = 0
+        self.bytes = 0
+        self.records = 0
+        self.gaps = 0
+        self.latencies = []
+        #last line counter of each file of clients connected at end
+        self.last = []
+
+    def latency(self, value):
+        """ add latency, reservoir sampling above MAX_LATENCIES """
+        self.records += 1
+        if len(self.latencies) < MAX_LATENCIES:
+            self.latencies.append(value)
+        else:
+            index = self._random.randrange(self.records)
+            if index < MAX_LATENCIES:
+                self.latencies[index] = value
+
+    def result(self):
+        """ picklable counters """
+        result = dict(vars(self))
+        del result['_random']
+        return result
+
+class LoadClient:
+    """
+        websocket client: 'fast' reads continuously, 'slow' pauses slow_s after
+        each message, 'churn' disconnects after about churn_s and reconnects
+    """
+
+    def __init__(self, url, behaviour, args, stats, rng):
+        self._url = url
+        self._behaviour = behaviour
+        self._args = args
+        self._stats = stats
+        self._random = rng
+        #last line counter received of each file (current connection)
+        self._last = dict()
+
+    def _records(self, message):
+        """ (path, record) of broadcast or timeline message """
+        try:
+            message = json.loads(message)
+        except ValueError:
+            return []
+        if not isinstance(message, dict) or not isinstance(message.get('records'), list):
+            return []
+        if message.get('type') == 'timeline':
+            return [(path, record) for _, path, record in message['records']]
+        return [(message.get('file'), record) for record in message['records']]
+
+    def _receive(self, message, now):
+        self._stats.messages += 1
+        self._stats.bytes += len(message)
+        for path, record in self._records(message):
+            try:
+                written, counter = record.split(' ', 2)[:2]
+                written, counter = float(written), int(counter)
+            except (AttributeError, ValueError):
+                continue # marker of sampled or collapsed records, foreign line
+            self._stats.latency(now - written)
+            last = self._last.get(path)
+            if last is not None and counter > last + 1:
+                self._stats.gaps += counter - last - 1
+            self._last[path] = max(counter, last if last is not None else counter)
+
+    async def _connect(self):
+        try:
+            wsock = await websockets.connect(self._url, max_queue=self._args.max_queue,
+                                             open_timeout=self._args.connect_timeout)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+            self._stats.failures += 1
+            return None
+        self._stats.connects += 1
+        self._last = dict()
+        return wsock
+
+    async def run(self, stop):
+        """ run until stop future is done """
+        loop = asyncio.get_event_loop()
+        wsock = None
+        while not stop.done():
+            if wsock is None:
+                wsock = await self._connect()
+                if wsock is None:
+                    await asyncio.sleep(self._args.retry)
+                    continue
+                lifetime = loop.time() + self._random.uniform(0.5, 1.5) * self._args.churn_s
+            recv = asyncio.ensure_future(wsock.recv())
+            timeout = lifetime - loop.time() if self._behaviour == 'churn' else None
+            done, _ = await asyncio.wait([recv, stop], timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if recv not in done:
+                recv.cancel()
+                if not stop.done():
+                    # end of churn client lifetime
+                    await wsock.close()
+                    wsock = None
+                continue
+            try:
+                message = recv.result()
+            except websockets.exceptions.ConnectionClosed:
+                self._stats.disconnects += 1
+                wsock = None
+                continue
+            self._receive(message, time.time())
+            if self._behaviour == 'slow':
+                await asyncio.sleep(self._args.slow_s)
+        if wsock is not None:
+            self._stats.last.append(self._last)
+            await wsock.close()
+
+def client_urls(args, files, count, rng):
+    """ urls of count clients: timeline ratio of them subscribe to some files """
+    urls = []
+    base = args.url.rstrip('/')
+    for index in range(count):
+        if files and index < int(round(count * args.timeline)):
+            paths = rng.sample(files, max(1, min(len(files), args.timeline_files)))
+            urls.append(base + '/timeline?' + urllib.parse.urlencode(
+                [('file', path) for path in paths]))
+        else:
+            urls.append(base + '/')
+    return urls
+
+def run_clients(args, files, count, seed, start_time, stop_event, results):
+    """ client process entry point: run count clients until stop_event is set """
+    raise_fd_limit()
+    rng = random.Random(seed)
+    stats = Stats(seed)
+    urls = client_urls(args, files, count, rng)
+    kinds = behaviours(count, args.mix)
+    rng.shuffle(kinds)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def ramp(client, delay, stop):
+        await asyncio.sleep(delay)
+        await client.run(stop)
+
+    async def run():
+        stop = loop.create_future()
+        tasks = [asyncio.Task(ramp(LoadClient(url, kind, args, stats, random.Random(rng.random())),
+                                   max(0, start_time - time.time())
+                                   + args.ramp * index / max(1, count), stop), loop=loop)
+                 for index, (url, kind) in enumerate(zip(urls, kinds))]
+        while not stop_event.is_set():
+            await asyncio.sleep(0.1)
+        stop.set_result(None)
+        await asyncio.wait(tasks, timeout=10)
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+    results.put(stats.result())
+
+def http_json(url):
+    """ json document of url, None if unavailable """
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read().decode())
+    except (OSError, ValueError):
+        return None
+
+def run_load(args):
+    """ run one load test and return results dictionary """
+    raise_fd_limit()
+    # application started with watched files in a temporary folder unless url is given
+    folder = tempfile.mkdtemp(prefix='logtracker-load-') if args.url is None else None
+    try:
+        return load(args, folder)
+    finally:
+        if folder is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+def load(args, folder):
+    """ run clients (and application if folder is given), measure delivery """
+    server = None
+    files = list(args.file)
+    if folder is not None:
+        files = [os.path.join(folder, 'load%d.log' % i) for i in range(args.files)]
+        for file in files:
+            open(file, 'w').close()
+        ws_port, http_port = free_port(), free_port()
+        args.url = 'ws://localhost:%d' % ws_port
+        args.http = 'http://localhost:%d' % http_port
+        server = multiprocessing.Process(target=run_application,
+                                         args=(write_config(folder, files, http_port, ws_port,
+                                                            args.backend),))
+        server.start()
+        args.pid = server.pid
+        time.sleep(args.startup)
+
+    processes = max(1, min(args.processes, args.clients))
+    stop_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    start_time = time.time() + 0.5
+    clients = [multiprocessing.Process(
+        target=run_clients, args=(args, files, args.clients // processes
+                                  + (index < args.clients % processes), args.seed + index,
+                                  start_time, stop_event, results))
+               for index in range(processes)]
+    for process in clients:
+        process.start()
+    time.sleep(0.5 + args.ramp + args.warmup)
+
+    cpu_start = process_stats(args.pid)[0] if args.pid else 0
+    start = time.monotonic()
+    writer_stop = threading.Event()
+    writers = [Writer(file, args.rate / len(files), args.line_size, 'close', writer_stop)
+               for file in files] if files and args.rate > 0 else []
+    for writer in writers:
+        writer.start()
+    time.sleep(args.duration)
+    writer_stop.set()
+    for writer in writers:
+        writer.join()
+    time.sleep(args.drain)
+    elapsed = time.monotonic() - start
+    server_stats = process_stats(args.pid) if args.pid else None
+    handlers = http_json(args.http + '/handlers') if args.http else None
+    budget = http_json(args.http + '/budget') if args.http else None
+
+    stop_event.set()
+    stats = [results.get(timeout=30) for _ in clients]
+    for process in clients:
+        process.join(10)
+    if server is not None:
+        os.kill(server.pid, signal.SIGINT)
+        server.join(10)
+        if server.is_alive():
+            server.terminate()
+
+    written = {file: writer.written for file, writer in zip(files, writers)}
+    latencies = sorted(value for stat in stats for value in stat['latencies'])
+    # records written after last one received by clients connected at end (slow
+    # clients behind, or records lost at end)
+    behind = sum(written[path] - 1 - counter for stat in stats for last in stat['last']
+               for path, counter in last.items() if path in written)
+    records = sum(stat['records'] for stat in stats)
+    return {
+        "params": vars(args),
+        "written": sum(written.values()),
+        "clients": {
+            "connects": sum(stat['connects'] for stat in stats),
+            "failures": sum(stat['failures'] for stat in stats),
+            "disconnects": sum(stat['disconnects'] for stat in stats),
+            "connected_at_end": sum(len(stat['last']) for stat in stats),
+        },
+        "messages": sum(stat['messages'] for stat in stats),
+        "records": records,
+        "lost": sum(stat['gaps'] for stat in stats),
+        "behind_at_end": behind,
+        "elapsed_s": elapsed,
+        "delivery_rps": records / elapsed,
+        "delivery_bps": sum(stat['bytes'] for stat in stats) / elapsed,
+        "latency_s": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "p999": percentile(latencies, 99.9),
+            "max": latencies[-1] if latencies else None,
+        },
+        "server": {
+            "cpu_s": server_stats[0] - cpu_start,
+            "cpu_pct": 100 * (server_stats[0] - cpu_start) / elapsed,
+            "rss_bytes": server_stats[1],
+            "peak_rss_bytes": server_stats[2],
+            "handlers": handlers,
+            "budget": budget,
+        } if server_stats else None,
+        "python": sys.version.split()[0],
+    }
+
+def parse_args(argv=None):
+    """ command line arguments """
+    parser = argparse.ArgumentParser(description='logtracker websocket fan-out load test')
+    parser.add_argument('--clients', type=int, default=1000, help='number of clients')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='client processes (one event loop each)')
+    parser.add_argument('--mix', type=parse_mix, default='fast=1',
+                        help='client behaviours ratios, e.g. fast=0.8,slow=0.1,churn=0.1')
+    parser.add_argument('--slow-s', type=float, default=0.5,
+                        help='pause of slow clients after each message (s)')
+    parser.add_argument('--churn-s', type=float, default=2,
+                        help='mean connection duration of churn clients (s)')
+    parser.add_argument('--max-queue', type=int, default=32,
+                        help='messages queued by a client before it stops reading socket')
+    parser.add_argument('--timeline', type=float, default=0,
+                        help='ratio of clients subscribed to a timeline of some files')
+    parser.add_argument('--timeline-files', type=int, default=1,
+                        help='files of each timeline client')
+    parser.add_argument('--ramp', type=float, default=5, help='delay connecting clients (s)')
+    parser.add_argument('--connect-timeout', type=float, default=10,
+                        help='websocket opening handshake timeout (s)')
+    parser.add_argument('--retry', type=float, default=1,
+                        help='delay before connecting again after a failure (s)')
+    parser.add_argument('--rate', type=float, default=100, help='total lines/s written')
+    parser.add_argument('--line-size', type=int, default=120, help='line size in bytes')
+    parser.add_argument('--files', type=int, default=2, help='number of written files')
+    parser.add_argument('--backend', choices=['thread', 'async'], default='thread',
+                        help='file notifier backend')
+    parser.add_argument('--duration', type=float, default=10, help='write duration (s)')
+    parser.add_argument('--warmup', type=float, default=1, help='delay before writing (s)')
+    parser.add_argument('--startup', type=float, default=2,
+                        help='delay for started application to listen (s)')
+    parser.add_argument('--drain', type=float, default=3,
+                        help='delay waiting for remaining records (s)')
+    parser.add_argument('--url', help='websocket url of running logtracker '
+                                      '(default: application started for the test)')
+    parser.add_argument('--http', help='http url of running logtracker (handlers stats)')
+    parser.add_argument('--pid', type=int, help='pid of running logtracker (cpu, rss)')
+    parser.add_argument('--file', action='append', default=[],
+                        help='watched file of running logtracker written by the test')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', help='json result file (default stdout)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """ load test entry point """
+    args = parse_args(argv)
+    result = json.dumps(run_load(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as fdesc:
+            fdesc.write(result)
+    else:
+        print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.alerts unit tests
+"""
+
+import asyncio
+import json
+import os
+
+# pylint: disable=import-error, wrong-import-position
+from logtracker.alerts import AlertEngine, RingCounter, Rule
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_alerts')
+
+def test_ring_counter():
+    counter = RingCounter(60, 6)
+    counter.add(5, 1000)
+    counter.add(3, 1025)
+    assert counter.total(1030) == 8
+    # first bucket (1000-1010) leaves window
+    assert counter.total(1065) == 3
+    counter.add(1, 1070)
+    assert counter.total(1070) == 4
+    assert counter.total(2000) == 0
+
+def test_engine():
+    rules = [Rule("errors", r"ERROR", "*/app.log", threshold=3, window=60, cooldown=300),
+             Rule("oom", r"OOMKilled"),
+             Rule("groups", r"(?P<code>5\d\d) error", threshold=2)]
+    engine = AlertEngine(rules)
+    engine.on_records(RecordsEvent("/var/log/app.log", 0, ["ERROR 1", "ok", "ERROR 2"]))
+    assert not engine.alerts
+    engine.on_records(RecordsEvent("/var/log/other.log", 0, ["ERROR x", "ERROR y", "ERROR z"]))
+    assert not engine.alerts
+    engine.on_records(RecordsEvent("/var/log/app.log", 3, ["ERROR 3", "pod OOMKilled"]))
+    assert [(alert["rule"], alert["count"]) for alert in engine.alerts] == [("errors", 3),
+                                                                            ("oom", 1)]
+    assert engine.alerts[0]["line"] == "ERROR 3"
+
+    # cooldown: no new alert, suppressed ones reported later
+    engine.on_records(RecordsEvent("/var/log/app.log", 5, ["ERROR 4"]))
+    assert len(engine.alerts) == 2
+    assert engine.matcher("/var/log/app.log").states[0].suppressed == 1
+    assert len(engine.matcher("/var/log/other.log").states) == 2
+
+    # patterns which can't be combined (same group name) are tested one by one
+    engine = AlertEngine(rules + [Rule("dup", r"(?P<code>4\d\d) error")])
+    engine.on_records(RecordsEvent("/x.log", 0, ["503 error", "404 error", "500 error"]))
+    assert sorted(alert["rule"] for alert in engine.alerts) == ["dup", "groups"]
+
+    # numbered backreferences are not renumbered by the combined pattern
+    engine = AlertEngine([Rule("xx", r"(x)\1"), Rule("yy", r"(y)\1")])
+    engine.on_records(RecordsEvent("/x.log", 0, ["yy"]))
+    assert [alert["rule"] for alert in engine.alerts] == ["yy"]
+
+def test_command_sink():
+    output = "test_alerts.json"
+    tests.utils.delete_files([output])
+    loop = asyncio.new_event_loop()
+    engine = AlertEngine([Rule("oom", r"OOMKilled")], command="cat > %s" % output, loop=loop)
+    try:
+        engine.on_records(RecordsEvent("/var/log/app.log", 0, ["pod OOMKilled"]))
+        loop.run_until_complete(asyncio.sleep(0.5))
+        with open(output) as fdesc:
+            alert = json.load(fdesc)
+        assert alert["rule"] == "oom" and alert["file"] == "/var/log/app.log"
+    finally:
+        loop.close()
+        tests.utils.delete_files([output])
+        assert not os.path.exists(output)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.6
+
+"""
+    Test for logtracker.assets
+"""
+
+import gzip
+import os.path
+import tempfile
+import logtracker.filenotifier
+from logtracker.assets import AssetCache, JsonCache, etag_match
+import tests.utils
+
+LOGGER = tests.utils.setup_logger('test_assets')
+
+# pylint: disable=missing-function-docstring
+
+def test_asset_cache():
+    root = tempfile.mkdtemp()
+    script = os.path.join(root, 'app.js')
+    tests.utils.write_file(script, 'console.log("logtracker");\n' * 100, 'w')
+    tests.utils.write_file(os.path.join(root, 'index.html'), '<html></html>', 'w')
+
+    cache = AssetCache(root, max_age=60)
+    assert sorted(cache.preload()) == [script, os.path.join(root, 'index.html')]
+    assert cache.lookup('missing.js') is None
+    assert cache.lookup('../' + os.path.basename(root) + '/../etc/passwd') is None
+
+    status, headers, body = cache.lookup('app.js')
+    headers = dict(headers)
+    assert status == 200 and body == b'console.log("logtracker");\n' * 100
+    assert headers['Cache-Control'] == 'public, max-age=60'
+    assert 'Content-Encoding' not in headers
+    etag = headers['ETag']
+
+    status, headers, zbody = cache.lookup('app.js', 'deflate, gzip;q=0.8')
+    headers = dict(headers)
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zbody) == body and headers['ETag'] != etag
+    assert cache.lookup('app.js', 'gzip;q=0')[2] == body
+
+    status, headers, body = cache.lookup('app.js', '', etag)
+    assert status == 304 and body == b''
+    assert dict(cache.lookup('index.html')[1])['Cache-Control'] == 'no-cache'
+
+    tests.utils.write_file(script, 'changed', 'w')
+    assert cache.lookup('app.js')[2] != b'changed'
+    file_event = logtracker.filenotifier.FileNotifierEvent(
+        (None, ['IN_CLOSE_WRITE'], None, script))
+    assert not cache.on_file_event(file_event)
+    status, headers, body = cache.lookup('app.js', '', etag)
+    assert status == 200 and body == b'changed'
+
+    # file replaced by rename: invalidated and watched again
+    tests.utils.write_file(script + '.tmp', 'renamed', 'w')
+    os.rename(script + '.tmp', script)
+    file_event = logtracker.filenotifier.FileNotifierEvent(
+        (None, ['IN_ATTRIB', 'IN_DELETE_SELF'], None, script))
+    assert cache.on_file_event(file_event)
+    watched = []
+    cache.watch = watched.append
+    assert cache.lookup('app.js')[2] == b'renamed'
+    assert watched == [script]
+
+    # file added after preload is watched when it is cached
+    style = os.path.join(root, 'app.css')
+    tests.utils.write_file(style, 'body {}', 'w')
+    assert cache.lookup('app.css')[2] == b'body {}'
+    cache.lookup('index.html')
+    assert watched == [script, style]
+
+def test_json_cache():
+    cache = JsonCache()
+    calls = []
+
+    def builder():
+        calls.append(1)
+        return {'url': 'ws://localhost'}
+
+    body, etag = cache.get('ws', 1, builder)
+    assert cache.get('ws', 1, builder) == (body, etag)
+    assert len(calls) == 1
+    cache.get('ws', 2, builder)
+    assert len(calls) == 2
+    assert etag_match('"other", %s' % etag, [etag])
+    assert not etag_match('', [etag])
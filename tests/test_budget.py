@@ -0,0 +1,91 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.budget unit tests
+"""
+
+import asyncio
+
+# pylint: disable=import-error, wrong-import-position
+import logtracker.budget
+from logtracker.budget import Budget
+from logtracker.event import Manager
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_budget')
+
+def test_degradation_levels():
+    usage = {"backlog": 0, "clients": 0}
+    calls = []
+
+    def shrink(size):
+        freed = min(size, 50) # backlog can only be shrunk by 50 at a time
+        usage["backlog"] -= freed
+        calls.append(("shrink", size))
+        return freed
+
+    def drop(size):
+        calls.append(("drop", size))
+        usage["clients"] = 0
+        return size
+
+    budget = Budget(1000)
+    budget.register('backlog', lambda: usage["backlog"], degrade=shrink)
+    budget.register('stream', lambda: 0, logtracker.budget.SAMPLE,
+                    lambda size: calls.append(("sample", size)),
+                    lambda: calls.append(("restore", 0)))
+    budget.register('clients', lambda: usage["clients"], logtracker.budget.DROP, drop)
+
+    budget.check()
+    assert budget.level is None and not calls
+
+    # each check under pressure goes one level further
+    usage.update(backlog=800, clients=300)
+    budget.check()
+    assert budget.level == logtracker.budget.SHRINK and calls == [("shrink", 350)]
+    budget.check()
+    assert budget.level == logtracker.budget.SAMPLE
+    assert calls[1:] == [("shrink", 300), ("sample", 250)]
+    budget.check()
+    assert budget.level == logtracker.budget.DROP
+    assert calls[3:] == [("shrink", 250), ("sample", 200), ("drop", 200)]
+    # degradations kept until usage is below low ratio
+    del calls[:]
+    usage["backlog"] = 800
+    budget.check()
+    assert budget.level == logtracker.budget.DROP and not calls
+    usage["backlog"] = 100
+    budget.check()
+    assert budget.level is None and calls == [("restore", 0)]
+    assert budget.stats()["usages"] == {"backlog": 100, "stream": 0, "clients": 0}
+
+def test_manager_shrink():
+    loop = asyncio.new_event_loop()
+    manager = Manager()
+
+    async def slow(_):
+        await asyncio.sleep(10)
+
+    manager.register_event(RecordsEvent, slow)
+    for seq in range(10):
+        manager.post_event(RecordsEvent('/a.log', seq, ['x' * 936]))
+
+    async def dispatch():
+        task = asyncio.Task(manager.run(), loop=loop)
+        await asyncio.sleep(0.1)
+        used = manager.buffered()
+        freed = manager.shrink(2500)
+        manager.stop()
+        await task
+        return used, freed
+
+    try:
+        used, freed = loop.run_until_complete(dispatch())
+    finally:
+        loop.close()
+    # first event is being handled, 3 oldest queued ones dropped
+    assert used == 9000 and freed == 3000
+    assert manager.stats()["RecordsEvent"][0]["dropped"] == 3
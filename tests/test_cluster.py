@@ -0,0 +1,121 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.cluster unit tests: several agents and one aggregator on localhost
+"""
+
+import asyncio
+import socket
+
+# pylint: disable=import-error, wrong-import-position
+import logtracker.cluster
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring, missing-class-docstring, too-few-public-methods
+
+tests.utils.setup_logger('test_cluster')
+
+class Collector:
+    """ event manager collecting posted events """
+    def __init__(self):
+        self.events = []
+
+    def post_event(self, event):
+        self.events.append(event)
+
+    def records(self, path):
+        return [record for event in self.events if event.path == path
+                for record in event.records]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+def test_frame():
+    frame = logtracker.cluster.encode_frame(3, [("/a", 0, ["x", "y"], []),
+                                                ("/b", 5, ["z"], [(4, 3), (5, 2)])])
+    assert logtracker.cluster.decode_frame(frame) == (3, [("/a", 0, ["x", "y"], []),
+                                                          ("/b", 5, ["z"], [(4, 3), (5, 2)])])
+
+def test_dedup():
+    collector = Collector()
+    aggregator = logtracker.cluster.Aggregator('localhost', 0, collector)
+    aggregator.post_records("h:/a", 0, ["0", "1", "2"])
+    aggregator.post_records("h:/a", 0, ["0", "1", "2"])
+    aggregator.post_records("h:/a", 2, ["2", "3"])
+    assert collector.records("h:/a") == ["0", "1", "2", "3"]
+    assert [event.seq for event in collector.events] == [0, 3]
+    # repeat counts of collapsed records are posted even if records were received
+    aggregator.post_records("h:/a", 2, ["2", "3"], [(3, 4)])
+    assert collector.events[-1].seq == 4 and collector.events[-1].repeats == [(3, 4)]
+
+def test_forwarder_shrink():
+    forwarder = logtracker.cluster.Forwarder('ws://localhost:1', 'h', [], batch_size=1)
+    for seq in range(3):
+        forwarder.on_records(RecordsEvent('/a', seq, ['x' * 1000]))
+    used = forwarder.buffered()
+    assert forwarder.pending == 3 and used > 0
+    # oldest frames dropped first
+    freed = forwarder.shrink(1)
+    assert freed > 0 and forwarder.pending == 2 and forwarder.dropped == 1
+    assert forwarder.shrink(1 << 20) + freed == used and forwarder.buffered() == 0
+
+def test_agents():
+    loop = asyncio.new_event_loop()
+    port = free_port()
+    collector = Collector()
+    changes = []
+    aggregator = logtracker.cluster.Aggregator('localhost', port, collector,
+                                               lambda: changes.append(len(aggregator.agents)))
+    forwarders = [logtracker.cluster.Forwarder(
+        'ws://localhost:%d' % port, 'agent%d' % i,
+        [{"path": "/var/log/app.log", "color": "auto", "pattern": "\n"}], 0.01)
+                  for i in range(3)]
+
+    async def scenario():
+        await aggregator.start()
+        for forwarder in forwarders:
+            forwarder.start(loop)
+        assert await wait_for(lambda: all(forwarder.connected for forwarder in forwarders))
+        assert sorted(file["path"] for file in aggregator.files()) == \
+            ["agent%d:/var/log/app.log" % i for i in range(3)]
+
+        for i, forwarder in enumerate(forwarders):
+            forwarder.on_records(RecordsEvent("/var/log/app.log", 0, ["a%d" % i, "b%d" % i]))
+            forwarder.on_records(RecordsEvent("/var/log/app.log", 2, ["c%d" % i]))
+        assert await wait_for(lambda: len(collector.events) == 3)
+        assert collector.records("agent1:/var/log/app.log") == ["a1", "b1", "c1"]
+        forwarders[1].on_records(RecordsEvent("/var/log/app.log", 3, [], repeats=[(2, 6)]))
+        assert await wait_for(lambda: len(collector.events) == 4)
+        assert collector.events[-1].repeats == [(2, 6)]
+        assert await wait_for(lambda: not any(forwarder.pending for forwarder in forwarders))
+
+        # aggregator restarts: records forwarded meanwhile are sent after reconnection
+        aggregator.stop()
+        assert await wait_for(lambda: not any(forwarder.connected for forwarder in forwarders))
+        forwarders[0].on_records(RecordsEvent("/var/log/app.log", 3, ["d0"]))
+        forwarders[0].on_records(RecordsEvent("/var/log/app.log", 4, ["e0"]))
+        await asyncio.sleep(0.1)
+        assert forwarders[0].pending == 1
+        await aggregator.start()
+        assert await wait_for(lambda: forwarders[0].pending == 0)
+        assert collector.records("agent0:/var/log/app.log") == ["a0", "b0", "c0", "d0", "e0"]
+
+    try:
+        loop.run_until_complete(scenario())
+        assert changes[:3] == [1, 2, 3]
+    finally:
+        for forwarder in forwarders:
+            forwarder.stop()
+        aggregator.stop()
+        loop.run_until_complete(asyncio.sleep(0.1))
+        loop.close()
@@ -5,9 +5,10 @@
 """
 
 import os.path
+import tempfile
 
 # pylint: disable=no-name-in-module, wrong-import-position
-from logtracker.config import Config
+from logtracker.config import Config, alerts_changed, diff_files
 
 # pylint: disable=no-member
 
@@ -98,6 +99,36 @@ def test_config2():
     assert file.pattern == r"\(Entry .+\)"
     assert file.color is not None
     assert file.color == "blue"
+    assert conf.admin.profiler == 0
+    assert conf.admin.memory == 0
+    assert conf.admin.profile_max_seconds == Config.DEFAULT_PROFILE_MAX_SECONDS
+    assert conf.notifier.backend == Config.DEFAULT_NOTIFIER_BACKEND
+    assert conf.notifier.poll_max_ms == Config.DEFAULT_POLL_MAX_MS
+    assert all(f.watch == 'inotify' for f in conf.files)
+    assert conf.limits.max_lines_per_s == 1000 and conf.limits.max_bytes_per_s == 0
+    assert (file.max_lines_per_s, file.max_bytes_per_s) == (50, 4096)
+    assert (conf.files[0].max_lines_per_s, conf.files[0].max_bytes_per_s) == (1000, 0)
+    assert file.collapse == 'masked' and conf.files[0].collapse == 'none'
+    assert conf.alerts.command == "logger -t logtracker" and conf.alerts.webhook == ""
+    assert [(rule.name, rule.file, rule.threshold) for rule in conf.alerts.rules] == \
+        [("errors", "/var/log/Xorg.0.log", 10), ("rule1", "", 1)]
+    assert conf.alerts.rules[1].window_s == Config.DEFAULT_RULE_WINDOW_S
+
+def test_zero_values():
+    """ test 0 values are kept (no limit), not replaced by defaults """
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as fdesc:
+        fdesc.write('server:\nlogs:\n  rate_limit: 0\n'
+                    'limits:\n  max_lines_per_s: 1000\n  max_record_kb: 0\n  tick_read_kb: 0\n'
+                    'store:\n  max_size_mb: 0\n'
+                    'files:\n  - path: /var/log/syslog\n    max_lines_per_s: 0\n')
+    try:
+        conf = Config(fdesc.name)
+    finally:
+        os.remove(fdesc.name)
+    assert conf.limits.max_record_kb == 0 and conf.limits.tick_read_kb == 0
+    assert conf.logs.rate_limit == 0
+    assert conf.store.max_size_mb == 0
+    assert conf.limits.max_lines_per_s == 1000 and conf.files[0].max_lines_per_s == 0
 
 def test_prop_str():
     """ Test property to str conversion """
@@ -107,5 +138,30 @@ def test_prop_str():
     assert str(conf.server.http) == "http"
     assert str(conf.server.http.port) == str(Config.DEFAULT_HTTP_PORT)
 
+def test_diff_files():
+    """ Test watched files diff between two configs """
+    conf1 = Config(os.path.join(CURDIR, "cfg1.yaml"))
+    conf2 = Config(os.path.join(CURDIR, "cfg2.yaml"))
+
+    added, removed, changed = diff_files(conf1.files, conf2.files)
+    assert [f.path for f in added] == ["/var/log/Xorg.0.log"]
+    assert removed == []
+    assert [f.path for f in changed] == ["/var/log/syslog"]
+    assert changed[0].pattern == "\n"
+
+    added, removed, changed = diff_files(conf2.files, conf1.files)
+    assert added == [] and [f.path for f in removed] == ["/var/log/Xorg.0.log"]
+    assert diff_files(conf1.files, conf1.files) == ([], [], [])
+
+def test_alerts_changed():
+    """ Test alert settings diff between two configs """
+    conf1 = Config(os.path.join(CURDIR, "cfg1.yaml"))
+    conf2 = Config(os.path.join(CURDIR, "cfg2.yaml"))
+
+    assert alerts_changed(conf1.alerts, conf2.alerts)
+    assert not alerts_changed(conf2.alerts, Config(os.path.join(CURDIR, "cfg2.yaml")).alerts)
+    conf2.alerts.rules[0].threshold = 11
+    assert alerts_changed(conf2.alerts, Config(os.path.join(CURDIR, "cfg2.yaml")).alerts)
+
 if __name__ == "__main__":
     test_config1()
\ No newline at end of file
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.fanout unit tests
+"""
+
+import asyncio
+import json
+import websockets
+
+# pylint: disable=import-error, wrong-import-position
+from logtracker.fanout import WSWorkerPool
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_fanout')
+
+PORT = 8095
+
+def test_worker_pool():
+    loop = asyncio.new_event_loop()
+    pool = WSWorkerPool('localhost', PORT, workers=2)
+
+    async def client(count, path=''):
+        for _ in range(50): # wait for workers to listen
+            try:
+                wsock = await websockets.connect('ws://localhost:%d%s' % (PORT, path))
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        messages = []
+        try:
+            while len(messages) < count:
+                messages.append(await wsock.recv())
+        finally:
+            await wsock.close()
+        return messages
+
+    async def scenario():
+        clients = [asyncio.Task(client(3), loop=loop) for _ in range(8)]
+        timeline = asyncio.Task(client(1, '/timeline?file=/a.log'), loop=loop)
+        await asyncio.sleep(3) # clients connected and registered
+        await pool.push_message('first')
+        await pool.push_message('é' * 100000) # several pipe writes
+        await pool.push_message('last')
+        # records messages feed timelines of workers
+        await pool.push_message(RecordsEvent('/a.log', 0, ['a1', 'a2']).to_json())
+        results = await asyncio.wait_for(asyncio.gather(*clients), 10)
+        return results, await asyncio.wait_for(timeline, 10)
+
+    pool.start(loop)
+    try:
+        results, timeline = loop.run_until_complete(scenario())
+    finally:
+        pool.stop()
+        loop.close()
+    assert all(messages == ['first', 'é' * 100000, 'last'] for messages in results)
+    message = json.loads(timeline[0])
+    assert message["type"] == "timeline"
+    assert [record[1:] for record in message["records"]] == [['/a.log', 'a1'], ['/a.log', 'a2']]
+    assert not any(worker.process.is_alive() for worker in pool.workers)
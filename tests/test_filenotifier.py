@@ -4,7 +4,9 @@
     FileNotifierService unit tests
 """
 
+import asyncio
 import queue
+import time
 
 # pylint: disable=import-error, wrong-import-position
 import logtracker.filenotifier
@@ -180,3 +182,180 @@ class TestFileNotifier:
         state.move_next()
 
         tests.utils.delete_files([file_name])
+
+    @staticmethod
+    def test_split():
+        file_name = "f1.txt"
+        tests.utils.delete_files([file_name])
+        tests.utils.create_files([file_name])
+
+        state = logtracker.filenotifier.FileState(file_name)
+        assert state.split(bytearray(b"line1\nline2\nli")) == [b"line1", b"line2"]
+        assert state.split(bytearray(b"ne3")) == []
+        assert state.split(bytearray(b"\n\nline4\n")) == [b"line3", b"", b"line4"]
+
+        state = logtracker.filenotifier.FileState(file_name, r"\[.+\]")
+        records = state.split(bytearray(b"[1] first\n  detail\n[2] second\n[3] th"))
+        assert records == [b"[1] first\n  detail", b"[2] second"]
+        assert state.split(bytearray(b"ird\n")) == [b"[3] third"]
+
+        tests.utils.delete_files([file_name])
+
+    @staticmethod
+    def test_split_truncated():
+        file_name = "f1.txt"
+        tests.utils.delete_files([file_name])
+        tests.utils.create_files([file_name])
+
+        marker = logtracker.filenotifier.FileState.TRUNCATED % 8
+        state = logtracker.filenotifier.FileState(file_name)
+        assert state.split(bytearray(b"short\n0123456789\n"), 8) == \
+            [b"short", b"01234567" + marker]
+        # incomplete line already too large: sent truncated, its end skipped
+        assert state.split(bytearray(b"abcdefghij"), 8) == [b"abcdefgh" + marker]
+        assert state.split(bytearray(b"klmnop"), 8) == []
+        assert state.split(bytearray(b"qr\nnext\n"), 8) == [b"next"]
+
+        state = logtracker.filenotifier.FileState(file_name, r"\[.+\]")
+        records = state.split(bytearray(b"[1] a\n  b\n  c\n  d\n[2] second\n"), 8)
+        assert records == [b"[1] a\n  " + marker, b"[2] seco" + marker]
+
+        tests.utils.delete_files([file_name])
+
+    @staticmethod
+    def test_event_mask():
+        constants = logtracker.filenotifier.inotify.constants
+        event = logtracker.filenotifier.FileNotifierEvent(
+            (None, ["IN_MODIFY", "IN_CLOSE_WRITE"], "/var/log", "app.log"))
+        assert event.filename == "/var/log/app.log"
+        assert event.mask == constants.IN_MODIFY | constants.IN_CLOSE_WRITE
+        assert event.has(constants.IN_CLOSE_WRITE | constants.IN_DELETE_SELF)
+        assert not event.has(constants.IN_DELETE_SELF)
+        assert event.events == ["IN_MODIFY", "IN_CLOSE_WRITE"]
+
+        event = logtracker.filenotifier.FileNotifierEvent.from_mask(constants.IN_DELETE_SELF,
+                                                                    "/var/log/app.log")
+        assert event.events == ["IN_DELETE_SELF"] and event.state is None
+        assert not hasattr(event, '__dict__')
+
+    @staticmethod
+    def test_watchlist_changes():
+        lst_files = ["f1.txt", "f2.txt"]
+        tests.utils.delete_files(lst_files)
+        tests.utils.create_files(lst_files)
+
+        events = queue.Queue()
+        fnotifier = logtracker.filenotifier.FileNotifierService(
+            [logtracker.filenotifier.WatchedFile(lst_files[0])], events.put)
+        fnotifier.start()
+        state = fnotifier.states[lst_files[0]]
+
+        fnotifier.add_file(logtracker.filenotifier.WatchedFile(lst_files[1]))
+        fnotifier.add_file(logtracker.filenotifier.WatchedFile(lst_files[0], r"\[.+\]"))
+        fnotifier.remove_file("missing.txt")
+        try:
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and state.pattern == "\n":
+                time.sleep(0.1)
+            assert fnotifier.states[lst_files[0]] is state
+            assert state.pattern == r"\[.+\]"
+            assert lst_files[1] in fnotifier.states
+
+            fnotifier.remove_file(lst_files[0])
+            while time.monotonic() < deadline and lst_files[0] in fnotifier.states:
+                time.sleep(0.1)
+            assert list(fnotifier.states) == [lst_files[1]]
+
+            tests.utils.write_file(lst_files[0], "line1\n")
+            tests.utils.write_file(lst_files[1], "line1\n")
+            time.sleep(0.5)
+        finally:
+            fnotifier.stop()
+
+        filenames = set()
+        names = set()
+        while not events.empty():
+            event = events.get()
+            filenames.add(event.filename)
+            names.update(event.events)
+        assert filenames == {lst_files[1]}
+        assert not names & {"IN_OPEN", "IN_ACCESS", "IN_CLOSE_NOWRITE"}
+
+        tests.utils.delete_files(lst_files)
+
+    @staticmethod
+    def test_async_notifier():
+        lst_files = ["f1.txt", "f2.txt"]
+        tests.utils.delete_files(lst_files)
+        tests.utils.create_files(lst_files)
+
+        loop = asyncio.new_event_loop()
+        events = []
+        fnotifier = logtracker.filenotifier.AsyncFileNotifier(
+            [logtracker.filenotifier.WatchedFile(lst_files[0])], events.append)
+        fnotifier.start(loop)
+        try:
+            fnotifier.add_file(logtracker.filenotifier.WatchedFile(lst_files[1]))
+            loop.run_until_complete(asyncio.sleep(0.1))
+            tests.utils.write_file(lst_files[0], "line1\n")
+            tests.utils.write_file(lst_files[1], "line1\nline2\n")
+            loop.run_until_complete(asyncio.sleep(0.2))
+
+            names = {(event.filename, name) for event in events for name in event.events}
+            assert (lst_files[0], "IN_MODIFY") in names
+            assert (lst_files[1], "IN_CLOSE_WRITE") in names
+            assert all(name not in ("IN_OPEN", "IN_ACCESS") for _, name in names)
+            content = bytearray()
+            fnotifier.states[lst_files[1]].extract(content)
+            assert content == b"line1\nline2\n"
+
+            fnotifier.remove_file(lst_files[0])
+            tests.utils.delete_files([lst_files[1]])
+            loop.run_until_complete(asyncio.sleep(0.2))
+            assert not fnotifier.states
+            assert "IN_DELETE_SELF" in events[-1].events
+        finally:
+            fnotifier.stop()
+            loop.close()
+        assert not fnotifier.running
+
+        tests.utils.delete_files(lst_files)
+
+    @staticmethod
+    def test_polling_notifier():
+        lst_files = ["f1.txt", "f2.txt"]
+        tests.utils.delete_files(lst_files)
+        tests.utils.create_files(lst_files)
+
+        loop = asyncio.new_event_loop()
+        events = []
+        fnotifier = logtracker.filenotifier.PollingFileNotifier(
+            [logtracker.filenotifier.WatchedFile(path, watch='poll') for path in lst_files],
+            events.append, 0.05, 0.4)
+        fnotifier.start(loop)
+        try:
+            tests.utils.write_file(lst_files[0], "line1\n")
+            loop.run_until_complete(asyncio.sleep(0.3))
+            assert [(event.filename, event.events) for event in events] == \
+                [(lst_files[0], ["IN_MODIFY"])]
+            content = bytearray()
+            fnotifier.states[lst_files[0]].extract(content)
+            assert content == b"line1\n"
+
+            # idle file backs off, modified one polls fast again
+            loop.run_until_complete(asyncio.sleep(0.8))
+            # pylint: disable=protected-access
+            assert fnotifier._polled[lst_files[1]].interval == 0.4
+            tests.utils.write_file(lst_files[1], "line1\n")
+            loop.run_until_complete(asyncio.sleep(0.5))
+            assert [event.filename for event in events] == lst_files
+
+            tests.utils.delete_files([lst_files[0]])
+            loop.run_until_complete(asyncio.sleep(0.6))
+            assert "IN_DELETE_SELF" in events[-1].events
+            assert list(fnotifier.states) == [lst_files[1]]
+        finally:
+            fnotifier.stop()
+            loop.close()
+
+        tests.utils.delete_files(lst_files)
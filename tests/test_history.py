@@ -0,0 +1,118 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.history unit tests
+"""
+
+import gzip
+import os
+import pytest
+
+# pylint: disable=import-error, wrong-import-position
+import logtracker.history
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_history')
+
+FILES = ["hist.log", "hist.log.1", "hist.log.2.gz", "hist.log.10.gz", "hist.logger"]
+
+def content(name, count):
+    return b''.join(b'%s line %d\n' % (name.encode('utf-8'), i) for i in range(count))
+
+def setup_files():
+    tests.utils.delete_files(FILES)
+    with open(FILES[0], 'wb') as fdesc:
+        fdesc.write(content("live", 10))
+    with open(FILES[1], 'wb') as fdesc:
+        fdesc.write(content("one", 10))
+    # multi-member archive: rotated twice then concatenated
+    with open(FILES[2], 'wb') as fdesc:
+        fdesc.write(gzip.compress(content("two", 20000)))
+        fdesc.write(gzip.compress(content("two-bis", 20000)))
+    with open(FILES[3], 'wb') as fdesc:
+        fdesc.write(gzip.compress(content("ten", 10)))
+    with open(FILES[4], 'wb') as fdesc:
+        fdesc.write(b"not a rotation\n")
+
+def test_rotations():
+    setup_files()
+    try:
+        chain = logtracker.history.rotations(FILES[0])
+        assert [rotation.path for rotation in chain] == FILES[:4]
+        assert [rotation.index for rotation in chain] == [0, 1, 2, 3]
+        assert [rotation.compressed for rotation in chain] == [False, False, True, True]
+        assert logtracker.history.open_rotation(FILES[0], 2).path == FILES[2]
+        with pytest.raises(IndexError):
+            logtracker.history.open_rotation(FILES[0], 4)
+    finally:
+        tests.utils.delete_files(FILES)
+
+def test_dateext_rotations():
+    files = ["date.log", "date.log-20200101.gz", "date.log-20200201", "date.log-20200301.gz"]
+    tests.utils.delete_files(files)
+    for file in files:
+        tests.utils.write_file(file, "line\n")
+    try:
+        chain = logtracker.history.rotations(files[0])
+        assert [rotation.path for rotation in chain] == \
+            ["date.log", "date.log-20200301.gz", "date.log-20200201", "date.log-20200101.gz"]
+    finally:
+        tests.utils.delete_files(files)
+
+def test_gzip_index():
+    setup_files()
+    try:
+        expected = content("two", 20000) + content("two-bis", 20000)
+        index = logtracker.history.GzipIndex(FILES[2], span=50000)
+        assert index.size == len(expected)
+        assert index.points > 10
+        for offset in (0, 1, 49999, 50000, 123457, len(expected) // 2, len(expected) - 5):
+            assert index.read(offset, 1000) == expected[offset:offset + 1000]
+        assert index.read(len(expected), 10) == b''
+    finally:
+        tests.utils.delete_files(FILES)
+
+def test_history_read_search():
+    setup_files()
+    try:
+        history = logtracker.history.History(span=50000)
+        rotation = logtracker.history.open_rotation(FILES[0], 2)
+        records, next_offset = history.read(rotation, 0, 40)
+        assert records == ["two line 0", "two line 1", "two line 2"]
+        assert next_offset == len(content("two", 3))
+        records, _ = history.read(rotation, next_offset, 10)
+        assert records == ["two line 3"]
+        # offset in the middle of a line: read from next line
+        records, _ = history.read(rotation, next_offset + 1, 10)
+        assert records == ["two line 4"]
+        assert history.reader(rotation) is history.reader(rotation)
+
+        offset = len(content("two", 20000))
+        matches, next_offset = history.search(rotation, r"two-bis line 1\d\d$", 0, 5)
+        assert [match[1] for match in matches] == ["two-bis line %d" % i
+                                                   for i in range(100, 105)]
+        assert matches[0][0] == offset + len(content("two-bis", 100))
+        matches, _ = history.search(rotation, r"two-bis line 1\d\d$", next_offset, 200)
+        assert len(matches) == 95
+
+        records, _ = history.read(logtracker.history.open_rotation(FILES[0], 0), 0, 1000)
+        assert len(records) == 10
+        with pytest.raises(ValueError):
+            history.search(rotation, "(")
+    finally:
+        tests.utils.delete_files(FILES)
+
+def test_corrupted_archive():
+    tests.utils.delete_files(FILES)
+    with open(FILES[2], 'wb') as fdesc:
+        fdesc.write(b"not gzip data" * 10)
+    try:
+        history = logtracker.history.History()
+        rotation = logtracker.history.Rotation(FILES[2], 2)
+        with pytest.raises(logtracker.history.HistoryError):
+            history.read(rotation, 0, 100)
+    finally:
+        tests.utils.delete_files(FILES)
+        assert not os.path.exists(FILES[2])
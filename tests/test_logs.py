@@ -0,0 +1,69 @@
+#!/usr/bin/env python3.6
+
+"""
+    Test for logtracker.logs
+"""
+
+import logging
+import os.path
+import tempfile
+import logtracker.logs
+from logtracker.logs import RateLimitFilter
+
+# pylint: disable=missing-function-docstring
+
+def make_record(lineno, created, msg='message %d', args=(1,)):
+    record = logging.LogRecord('logtracker.test', logging.INFO, 'test_logs.py', lineno,
+                               msg, args, None)
+    record.created = created
+    return record
+
+def test_rate_limit():
+    rate_filter = RateLimitFilter(rate=3, period=1.0)
+
+    passed = [rate_filter.filter(make_record(10, 100.0 + i * 0.01)) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    # other call site is not limited
+    assert rate_filter.filter(make_record(11, 100.5))
+    assert rate_filter.pending() == [('test_logs.py', 10, 7)]
+
+    record = make_record(10, 101.5)
+    assert rate_filter.filter(record)
+    assert record.getMessage() == 'message 1 (suppressed 7 messages)'
+    assert rate_filter.pending() == []
+
+    unlimited = RateLimitFilter(rate=0)
+    assert all(unlimited.filter(make_record(10, 100.0)) for _ in range(100))
+
+def test_queued_logs():
+    log_file = os.path.join(tempfile.mkdtemp(), 'queued.log')
+    logtracker.logs.setup(log_file, logging.INFO, logging.DEBUG, rate=5)
+    try:
+        assert logtracker.logs.HOTPATH_LEVEL == logging.DEBUG
+        logger = logging.getLogger('logtracker.test_logs')
+        for i in range(20):
+            logger.info('line %d', i)
+        logger.debug('not logged')
+    finally:
+        logtracker.logs.shutdown()
+
+    with open(log_file) as fdesc:
+        lines = fdesc.read().splitlines()
+    assert [line.rsplit(' - ', 1)[1] for line in lines[:5]] == ['line %d' % i for i in range(5)]
+    assert len(lines) == 6
+    assert 'messages suppressed' in lines[5] and '(15)' in lines[5]
+
+def test_unlimited_logs():
+    log_file = os.path.join(tempfile.mkdtemp(), 'unlimited.log')
+    # logs.rate_limit: 0 in config.yaml
+    logtracker.logs.setup(log_file, logging.INFO, logging.DEBUG, rate=0)
+    try:
+        logger = logging.getLogger('logtracker.test_logs')
+        for i in range(50):
+            logger.info('line %d', i)
+    finally:
+        logtracker.logs.shutdown()
+
+    with open(log_file) as fdesc:
+        lines = fdesc.read().splitlines()
+    assert [line.rsplit(' - ', 1)[1] for line in lines] == ['line %d' % i for i in range(50)]
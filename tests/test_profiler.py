@@ -0,0 +1,75 @@
+#!/usr/bin/env python3.6
+
+"""
+    Test for logtracker.profiler
+"""
+
+import threading
+import time
+import pytest
+from logtracker.profiler import SamplingProfiler, MemoryTracker, ProfilerBusy
+import tests.utils
+
+LOGGER = tests.utils.setup_logger('test_profiler')
+
+# pylint: disable=missing-function-docstring, protected-access
+
+def spin_for_profiler(stop_event):
+    while not stop_event.is_set():
+        sum(range(1000))
+
+def test_sampling_profiler():
+    stop_event = threading.Event()
+    thread = threading.Thread(target=spin_for_profiler, args=(stop_event,), name='spinner')
+    thread.start()
+    try:
+        stacks = SamplingProfiler().profile(0.3, 0.005)
+    finally:
+        stop_event.set()
+        thread.join()
+
+    assert sum(stacks.values()) > 0
+    spinning = [stack for stack in stacks if 'spin_for_profiler' in stack]
+    assert spinning and all(stack.startswith('spinner;') for stack in spinning)
+
+    text = SamplingProfiler.collapse(stacks)
+    for line in text.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert stack and int(count) > 0
+
+def test_profiler_limits():
+    profiler = SamplingProfiler()
+    start = time.monotonic()
+    # interval is capped by duration
+    profiler.profile(0.05, 3600)
+    assert time.monotonic() - start < 1
+    for seconds, interval in ((float('inf'), 0.01), (0.1, float('nan'))):
+        with pytest.raises(ValueError):
+            profiler.profile(seconds, interval)
+
+def test_profiler_busy():
+    profiler = SamplingProfiler()
+    profiler._lock.acquire()
+    try:
+        with pytest.raises(ProfilerBusy):
+            profiler.profile(0.1, 0.01)
+    finally:
+        profiler._lock.release()
+
+def test_memory_tracker():
+    memory = MemoryTracker()
+    with pytest.raises(RuntimeError):
+        memory.diff(10)
+
+    memory.start(1, 60)
+    try:
+        with pytest.raises(ProfilerBusy):
+            memory.start(1, 60)
+        data = [bytearray(1024) for _ in range(1000)]
+        stats = memory.diff(5)
+        assert 0 < len(stats) <= 5
+        assert any('test_profiler.py' in stat for stat in stats)
+        del data
+    finally:
+        memory.stop()
+    assert not memory.tracing
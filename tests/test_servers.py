@@ -5,15 +5,21 @@
 """
 #pylint: disabled=import-error
 
+import json
+import os.path
 import time
 import threading
 import asyncio
+import bottle
 import websockets
+import logtracker.config
 import logtracker.servers
 import logtracker.event
+from logtracker.stream import RecordsEvent
 import tests.utils
 
 tests.utils.setup_logger('test_servers')
+CURDIR = os.path.dirname(os.path.realpath(__file__))
 
 def test_ws_server():
     """ test web socket server """
@@ -138,3 +144,123 @@ def test_start_stop_http():
         http.stop()
     assert not http.started
     log.info('http server stopped')
+
+async def http_get(port, path, headers=''):
+    """ minimal http client: return (status code, headers, body) """
+    reader, writer = await asyncio.open_connection('localhost', port)
+    writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n%s\r\n'
+                  % (path, headers)).encode('latin-1'))
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    resp_headers = dict((name.lower(), value.strip()) for name, _, value in
+                        (line.partition(':') for line in lines[1:]))
+    return int(lines[0].split(' ')[1]), resp_headers, body
+
+@bottle.route('/test_slow')
+def slow_route():
+    """ route simulating a slow request """
+    time.sleep(1)
+    return 'slow'
+
+def test_async_http():
+    """ test concurrent requests on asyncio http server """
+    logtracker.config.load(os.path.join(CURDIR, 'cfg1.yaml'))
+    port = 7878
+    loop = asyncio.get_event_loop()
+    http = logtracker.servers.AsyncHttpServer('localhost', port)
+    http.start(loop)
+    done_times = {}
+
+    async def request(name, path):
+        status, _, body = await http_get(port, path)
+        done_times[name] = time.monotonic()
+        return status, body
+
+    async def run_requests():
+        await asyncio.sleep(0.2)
+        slow = [request('slow%d' % i, '/test_slow') for i in range(2)]
+        fast = [request('fast%d' % i, '/ws') for i in range(200)]
+        return await asyncio.gather(*(slow + fast))
+
+    start = time.monotonic()
+    results = loop.run_until_complete(run_requests())
+    http.stop()
+
+    assert all(status == 200 for status, _ in results)
+    assert results[0][1] == b'slow'
+    assert json.loads(results[-1][1].decode()) == {'url': 'ws://awesome.server.com:8888'}
+    fast_end = max(t for name, t in done_times.items() if name.startswith('fast'))
+    assert fast_end - start < 1
+    assert min(done_times['slow0'], done_times['slow1']) - start >= 1
+
+def test_event_stream():
+    """ test Server-Sent Events streamed by asyncio http server """
+    logtracker.config.load(os.path.join(CURDIR, 'cfg1.yaml'))
+    port = 7879
+    loop = asyncio.get_event_loop()
+    http = logtracker.servers.AsyncHttpServer('localhost', port)
+    http.start(loop)
+
+    async def subscribe(last_event_id, count):
+        """ return response head and (event id, data) of count events """
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(('GET /events HTTP/1.1\r\nHost: localhost\r\nLast-Event-ID: %s\r\n\r\n'
+                      % last_event_id).encode('latin-1'))
+        head = await reader.readuntil(b'\r\n\r\n')
+        events = []
+        while len(events) < count:
+            fields = dict(line.split(': ', 1) for line in
+                          (await reader.readuntil(b'\n\n')).decode().split('\n') if line)
+            if 'data' in fields:
+                events.append((fields['id'], fields['data']))
+        writer.close()
+        return head, events
+
+    async def run_clients():
+        await asyncio.sleep(0.2)
+        clients = [asyncio.Task(subscribe('', 2), loop=loop) for _ in range(200)]
+        await asyncio.sleep(0.5)
+        assert http.events.clients == 200
+        http.events.on_records(RecordsEvent('/var/log/a.log', 0, ['one']))
+        http.events.on_records(RecordsEvent('/var/log/a.log', 1, []))
+        http.events.on_records(RecordsEvent('/var/log/a.log', 1, ['two']))
+        results = await asyncio.gather(*clients)
+        # resume after first event
+        resumed = await subscribe(results[0][1][0][0], 1)
+        return results, resumed
+
+    results, resumed = loop.run_until_complete(run_clients())
+    http.stop()
+
+    head = results[0][0].decode('latin-1')
+    assert head.startswith('HTTP/1.1 200') and 'text/event-stream' in head
+    assert all(events == results[0][1] for _, events in results)
+    assert [json.loads(data)['records'] for _, data in results[0][1]] == [['one'], ['two']]
+    assert resumed[1] == results[0][1][1:]
+    kept = http.events.kept()
+    assert kept > 0 and http.events.shrink(1) > 0 and http.events.kept() < kept
+
+def test_shared_port():
+    """ test http routes served on websocket port """
+    logtracker.config.load(os.path.join(CURDIR, 'cfg1.yaml'))
+    port = 8089
+    loop = asyncio.get_event_loop()
+    ws_server = logtracker.servers.WSServer(port=port, serve_http=True)
+    ws_server.start()
+
+    async def check():
+        await asyncio.sleep(0.2)
+        status, _, body = await http_get(port, '/ws')
+        async with websockets.connect('ws://localhost:%d' % port) as wsock:
+            await asyncio.sleep(0.6)
+            await ws_server.push_message('hello')
+            message = await wsock.recv()
+        return status, body, message
+
+    status, body, message = loop.run_until_complete(check())
+    ws_server.stop()
+    assert status == 200
+    assert json.loads(body.decode()) == {'url': 'ws://awesome.server.com:8888'}
+    assert message == 'hello'
@@ -8,7 +8,7 @@ import time
 import asyncio
 import threading
 import pytest
-from logtracker.event import Service, ServiceHandler, Manager as EventManager
+from logtracker.event import Service, ServiceHandler, Supervisor, Manager as EventManager
 import tests.utils
 
 # pylint: disable=missing-function-docstring, missing-class-docstring, too-few-public-methods, abstract-method
@@ -243,6 +243,114 @@ def test_manager():
     assert lst_events2[1].msg == "Second msg" and lst_events2[1].number == 20
     assert lst_events2[2].msg == "Third msg"  and lst_events2[2].number == 30
 
+def test_manager_async_handlers():
+    """ slow coroutine handlers build their own backlog without delaying other handlers """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    received = []
+    handled = []
+    running = [0, 0] # current, max
+
+    async def slow(event):
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.1)
+        running[0] -= 1
+        handled.append(event.msg)
+
+    event_manager = EventManager()
+    event_manager.register_event(Event1, lambda event: received.append(time.monotonic()))
+    event_manager.register_event(Event1, slow, concurrency=2, max_backlog=5)
+
+    async def scenario():
+        task = asyncio.Task(event_manager.run(), loop=loop)
+        start = time.monotonic()
+        for i in range(8):
+            event_manager.post_event(Event1(str(i)))
+        await asyncio.sleep(0.05)
+        # inline handler got every event at once, slow one has a backlog
+        assert len(received) == 8 and received[-1] - start < 0.05
+        stats = event_manager.stats()["Event1"]
+        assert stats[1]["backlog"] == 3 and stats[1]["dropped"] == 3
+        await asyncio.sleep(0.4)
+        event_manager.stop()
+        await task
+
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    # oldest queued events dropped, at most 2 handled at the same time
+    assert handled == ["3", "4", "5", "6", "7"]
+    assert running[1] == 2
+    stats = event_manager.stats()["Event1"][1]
+    assert stats["calls"] == 5 and stats["backlog"] == 0 and stats["avg_ms"] >= 100
+
+class CrashingService(Service):
+    DEDICATED_THREAD = True
+
+    def __init__(self):
+        super().__init__()
+        self.runs = 0
+        self.thread_name = None
+        self._stop_event = threading.Event()
+
+    @ServiceHandler.onstop
+    def docall_onstop(self):
+        self._stop_event.set()
+
+    @ServiceHandler.onstart
+    def docall_onstart(self, *args):
+        self._stop_event.clear()
+
+    @ServiceHandler.run
+    def docall_run(self, *args):
+        self.runs += 1
+        self.thread_name = threading.current_thread().name
+        if self.runs == 1:
+            raise RuntimeError("crash")
+        self._stop_event.wait()
+        return self.runs
+
+def test_dedicated_thread():
+    svc = CrashingService()
+    svc.runs = 1
+    svc.start()
+    time.sleep(0.1)
+    assert svc.running
+    assert svc.thread_name == 'logtracker.CrashingService'
+    svc.stop()
+    assert svc.future.result(timeout=1) == 2
+    assert not svc.running
+
+def test_supervisor(monkeypatch):
+    monkeypatch.setattr(Supervisor, 'CHECK_INTERVAL', 0.05)
+    monkeypatch.setattr(Supervisor, 'MIN_BACKOFF', 0.1)
+    supervisor = Supervisor()
+    svc = CrashingService()
+    supervisor.supervise(svc, name='crashing')
+    try:
+        deadline = time.monotonic() + 5
+        while svc.runs < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        health = supervisor.health()['crashing']
+        assert svc.runs == 2
+        assert health['state'] == 'running'
+        assert health['restarts'] == 1
+        assert health['error'] == 'crash'
+        assert supervisor.healthy()
+
+        supervisor.release(svc)
+        svc.stop()
+        time.sleep(0.3)
+        assert svc.runs == 2
+        assert 'crashing' not in supervisor.health()
+    finally:
+        supervisor.stop()
+        svc.stop()
+
 if __name__ == "__main__":
     sc = ServiceChild()
     sc.docall_onrun()
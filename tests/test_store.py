@@ -0,0 +1,116 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.store unit tests
+"""
+
+import os
+import shutil
+import pytest
+
+# pylint: disable=import-error, wrong-import-position
+import logtracker.store
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_store')
+
+FOLDER = 'test_store.d'
+
+def open_store(**kwargs):
+    store = logtracker.store.Store(FOLDER, **kwargs)
+    store.open()
+    return store
+
+def segments():
+    return sorted(name for name in os.listdir(FOLDER)
+                  if name.startswith(logtracker.store.SEGMENT_PREFIX))
+
+def test_block():
+    block = logtracker.store.encode_block("/var/log/a.log", 5, ["one", "", "multi\nline é"],
+                                          1.0, 2.0)
+    header = logtracker.store.BLOCK.unpack_from(block)
+    assert header[:6] == (logtracker.store.MAGIC, len("/var/log/a.log"), 5, 3, 1.0, 2.0)
+    payload = block[logtracker.store.BLOCK.size + header[1]:]
+    assert logtracker.store.decode_payload(payload) == ["one", "", "multi\nline é"]
+
+def test_store():
+    shutil.rmtree(FOLDER, ignore_errors=True)
+    try:
+        store = open_store(block_size=1000)
+        for seq in range(0, 1000, 100):
+            store.on_records(RecordsEvent("/var/log/a.log", seq,
+                                          ["a line %d" % i for i in range(seq, seq + 100)]))
+            store.on_records(RecordsEvent("/var/log/b.log", seq // 100, ["b line %d" % seq]))
+        store.close()
+        assert store.written == 1010
+        assert store.files() == ["/var/log/a.log", "/var/log/b.log"]
+
+        # index rebuilt from segments
+        store = open_store(block_size=1000)
+        records, cursor = store.read("/var/log/a.log", 0, 500)
+        assert records[0] == (0, "a line 0")
+        assert [seq for seq, _ in records] == list(range(len(records)))
+        assert cursor is not None
+        more, _ = store.read("/var/log/a.log", cursor, 1 << 20)
+        assert [line for _, line in records + more] == ["a line %d" % i for i in range(1000)]
+        assert store.read("/var/log/b.log")[0] == [(i, "b line %d" % (i * 100))
+                                                   for i in range(10)]
+
+        matches, cursor = store.search("/var/log/a.log", r"line 9\d$")
+        assert matches == [(i, "a line %d" % i) for i in range(90, 100)] and cursor is None
+        matches, cursor = store.search("/var/log/a.log", r"line \d+5$", limit=5)
+        assert len(matches) >= 5 and cursor is not None
+        with pytest.raises(ValueError):
+            store.search("/var/log/a.log", "(")
+        assert store.read("/var/log/a.log", since=2 ** 40) == ([], None)
+        store.close()
+    finally:
+        shutil.rmtree(FOLDER, ignore_errors=True)
+
+def test_retention_and_recovery():
+    shutil.rmtree(FOLDER, ignore_errors=True)
+    try:
+        store = open_store(max_size=40000, block_size=1000)
+        for seq in range(0, 5000, 50):
+            store.on_records(RecordsEvent("/var/log/a.log", seq,
+                                          ["%s line %d" % (os.urandom(16).hex(), i)
+                                           for i in range(seq, seq + 50)]))
+        store.close()
+        total = sum(os.path.getsize(os.path.join(FOLDER, name)) for name in segments())
+        assert total <= 40000 + 40000 // logtracker.store.Store.SEGMENTS
+        records, _ = store.read("/var/log/a.log", 0, 1 << 30)
+        assert records[0][0] > 0 and records[-1][0] == 4999
+
+        # interrupted write: partial block at end of last segment is dropped
+        last = os.path.join(FOLDER, segments()[-1])
+        with open(last, 'ab') as fdesc:
+            fdesc.write(logtracker.store.encode_block("/var/log/a.log", 5000, ["lost"],
+                                                      0, 0)[:-3])
+        store = open_store(max_size=40000, block_size=1000)
+        store.on_records(RecordsEvent("/var/log/a.log", 5000, ["after restart"]))
+        store.close()
+        records, _ = store.read("/var/log/a.log", 0, 1 << 30)
+        assert [seq for seq, _ in records[-2:]] == [4999, 5000]
+        assert records[-1][1] == "after restart"
+    finally:
+        shutil.rmtree(FOLDER, ignore_errors=True)
+
+def test_unlimited_size(monkeypatch):
+    shutil.rmtree(FOLDER, ignore_errors=True)
+    monkeypatch.setattr(logtracker.store.Store, 'SEGMENT_SIZE', 4000)
+    try:
+        store = open_store(max_size=0, block_size=1000)
+        for seq in range(0, 2000, 50):
+            store.on_records(RecordsEvent("/var/log/a.log", seq,
+                                          ["%s line %d" % (os.urandom(16).hex(), i)
+                                           for i in range(seq, seq + 50)]))
+        store.close()
+        # max_size 0: no segment deleted
+        assert len(segments()) > 2
+        records, _ = store.read("/var/log/a.log", 0, 1 << 30)
+        assert [seq for seq, _ in records] == list(range(2000))
+    finally:
+        shutil.rmtree(FOLDER, ignore_errors=True)
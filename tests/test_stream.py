@@ -0,0 +1,241 @@
+#!/usr/bin/env python3.6
+
+"""
+    Test for logtracker.stream
+"""
+
+import json
+import time
+import logtracker.filenotifier
+from logtracker.alerts import AlertEngine, Rule
+from logtracker.stream import Collapser, RateLimiter, RecordStream, RecordsEvent, \
+    SplitRecordsEvent
+import tests.utils
+
+LOGGER = tests.utils.setup_logger('test_stream')
+
+# pylint: disable=missing-function-docstring, missing-class-docstring, too-few-public-methods
+
+class FakeManager:
+    def __init__(self, registered=()):
+        self.events = []
+        self._registered = set(registered)
+
+    def post_event(self, event_obj):
+        self.events.append(event_obj)
+
+    def registered(self, event_type):
+        return event_type in self._registered
+
+def notify(state, event_name=logtracker.filenotifier.FileState.CLOSE_WR_EV):
+    file_event = logtracker.filenotifier.FileNotifierEvent((None, event_name, None,
+                                                            state.file_path))
+    file_event.state = state
+    state.on_event(file_event)
+    return file_event
+
+def test_record_stream():
+    file_name = "stream.txt"
+    tests.utils.delete_files([file_name])
+    tests.utils.create_files([file_name])
+
+    manager = FakeManager()
+    stream = RecordStream(manager)
+    state = logtracker.filenotifier.FileState(file_name)
+
+    tests.utils.write_file(file_name, "line1\nline2\npartial")
+    stream.on_file_event(notify(state))
+    tests.utils.write_file(file_name, " line3\n")
+    stream.on_file_event(notify(state, logtracker.filenotifier.FileState.MODIFY_EV))
+    stream.on_file_event(notify(state))
+
+    assert len(manager.events) == 2
+    first, second = manager.events
+    assert isinstance(first, RecordsEvent)
+    assert first.path == file_name and first.seq == 0
+    assert first.records == ["line1", "line2"]
+    assert second.seq == 2 and second.records == ["partial line3"]
+    assert json.loads(second.to_json()) == {"file": file_name, "seq": 2,
+                                            "records": ["partial line3"], "sampled": False}
+
+    tests.utils.delete_files([file_name])
+
+def test_large_append():
+    file_name = "large.txt"
+    tests.utils.delete_files([file_name])
+    tests.utils.create_files([file_name])
+
+    manager = FakeManager()
+    stream = RecordStream(manager, sizes=lambda: (100, 256))
+    state = logtracker.filenotifier.FileState(file_name)
+    tests.utils.write_file(file_name, "first\n" + "b" * 1000 + "\nend\n")
+    stream.on_file_event(notify(state))
+    # new notifications read next chunks but do not queue another event
+    stream.on_file_event(notify(state, logtracker.filenotifier.FileState.MODIFY_EV))
+    assert sum(not isinstance(event, RecordsEvent) for event in manager.events) == 1
+
+    # chunks of 256 bytes: file event posted again until append is read
+    chunks = 2
+    events = []
+    while manager.events:
+        event = manager.events.pop(0)
+        if isinstance(event, RecordsEvent):
+            events.append(event)
+        else:
+            stream.on_file_event(event)
+            chunks += 1
+    assert chunks == 4 and state.pending == 0
+    records = [record for event in events for record in event.records]
+    assert records == ["first", "b" * 100 + " [logtracker: record truncated to 100 bytes]",
+                       "end"]
+    assert [event.seq for event in events] == [0, 2]
+    tests.utils.delete_files([file_name])
+
+def test_rate_limiter():
+    limiter = RateLimiter("a.log", 100, 0)
+    start = limiter._window_start # pylint: disable=protected-access
+    assert limiter.apply(["x"] * 50, 100, start + 0.1) == ["x"] * 50
+    assert not limiter.sampled
+
+    # burst of 1000 lines/s for 2s: about 1 line in 10 forwarded
+    result = []
+    for i in range(20):
+        result.extend(limiter.apply(["r%d" % i] * 100, 1000, start + 0.2 + i * 0.1))
+        assert limiter.sampled
+    # rate back under limit for a window: sampling stops, last marker sent
+    result.extend(limiter.apply(["y"], 2, start + 3.5))
+    assert not limiter.sampled
+    assert result[-1] == "y"
+
+    lines = [rec for rec in result if not rec.startswith('[logtracker]')]
+    markers = [rec for rec in result if rec.startswith('[logtracker]')]
+    assert 100 <= len(lines) <= 400
+    assert len(markers) >= 2 and markers[-1].endswith('(sampling 1/10)')
+    assert len(lines) + sum(int(marker.split()[1]) for marker in markers) == 2001
+
+def test_idle_limiter():
+    limiter = RateLimiter("a.log", 100, 0)
+    start = limiter._window_start # pylint: disable=protected-access
+    result = []
+    for i in range(10):
+        result.extend(limiter.apply(["r%d" % i] * 100, 300, start + i * 0.01))
+    assert limiter.sampled
+    # burst stops: suppressed lines reported once file is idle for a window
+    assert limiter.idle(start + 0.5) is None
+    last = limiter.idle(start + 1.2)
+    assert not limiter.sampled and len(last) == 1
+    lines = [rec for rec in result if not rec.startswith('[logtracker]')]
+    markers = [rec for rec in result + last if rec.startswith('[logtracker]')]
+    assert len(lines) + sum(int(marker.split()[1]) for marker in markers) == 1000
+    assert limiter.idle(start + 5) is None
+
+def test_sampled_stream():
+    file_name = "sampled.txt"
+    tests.utils.delete_files([file_name])
+    tests.utils.create_files([file_name])
+
+    manager = FakeManager()
+    stream = RecordStream(manager, lambda path: (10, 0))
+    state = logtracker.filenotifier.FileState(file_name)
+    tests.utils.write_file(file_name, "".join("line%d\n" % i for i in range(1000)))
+    stream.on_file_event(notify(state))
+
+    assert len(manager.events) == 1
+    event = manager.events[0]
+    assert event.sampled and json.loads(event.to_json())["sampled"]
+    assert len(event.records) < 1000
+    assert event.records[0] == "line0"
+
+    stream.flush_idle(time.monotonic() + 2)
+    assert len(manager.events) == 2
+    last = manager.events[1]
+    assert not last.sampled and last.seq == len(event.records)
+    assert last.records[0].startswith('[logtracker]')
+    tests.utils.delete_files([file_name])
+
+def test_pressure_marker():
+    file_name = "pressure.txt"
+    tests.utils.delete_files([file_name])
+    tests.utils.create_files([file_name])
+
+    manager = FakeManager()
+    stream = RecordStream(manager)
+    state = logtracker.filenotifier.FileState(file_name)
+    stream.set_pressure(True)
+    tests.utils.write_file(file_name, "".join("line%d\n" % i for i in range(1000)))
+    stream.on_file_event(notify(state))
+    assert len(manager.events) == 1 and manager.events[0].sampled
+
+    # unchanged files keep their limiter
+    stream.reset_files(["other.txt"])
+    assert len(manager.events) == 1
+    # limiters dropped when pressure ends: suppressed lines are reported
+    stream.set_pressure(False)
+    assert len(manager.events) == 2
+    last = manager.events[1]
+    assert not last.sampled and last.records[0].startswith('[logtracker]')
+    tests.utils.delete_files([file_name])
+
+def test_collapser():
+    collapser = Collapser()
+    assert collapser.apply(["a", "a", "a", "b", "c", "c"]) == (["a", "b", "c"], [(0, 3), (2, 2)])
+    # repeats of last record of previous batch
+    assert collapser.apply(["c", "c", "d"]) == (["d"], [(-1, 4)])
+    assert collapser.apply(["d"]) == ([], [(-1, 2)])
+
+    masked = Collapser(masked=True)
+    records = ["retry 1 at 0x7f3a", "retry 2 at 0x7f3b", "retry 10 at 0xdead"]
+    assert masked.apply(records) == (["retry 1 at 0x7f3a"], [(0, 3)])
+    assert masked.apply(["retry failed"]) == (["retry failed"], [])
+
+def test_collapsed_stream():
+    file_name = "collapsed.txt"
+    tests.utils.delete_files([file_name])
+    tests.utils.create_files([file_name])
+
+    manager = FakeManager()
+    stream = RecordStream(manager, collapse=lambda path: 'exact')
+    state = logtracker.filenotifier.FileState(file_name)
+    tests.utils.write_file(file_name, "start\n" + "health check\n" * 1000)
+    stream.on_file_event(notify(state))
+    tests.utils.write_file(file_name, "health check\n" * 10)
+    stream.on_file_event(notify(state))
+    tests.utils.write_file(file_name, "end\n")
+    stream.on_file_event(notify(state))
+
+    first, second, third = manager.events
+    assert first.records == ["start", "health check"] and first.repeats == [(1, 1000)]
+    assert second.records == [] and second.repeats == [(1, 1010)]
+    message = json.loads(second.to_json())
+    assert message["repeats"] == [[1, 1010, second.time]]
+    assert third.seq == 2 and third.records == ["end"] and third.repeats == []
+    assert "repeats" not in json.loads(third.to_json())
+    tests.utils.delete_files([file_name])
+
+def test_split_records():
+    file_name = "split.txt"
+    tests.utils.delete_files([file_name])
+    tests.utils.create_files([file_name])
+
+    manager = FakeManager([SplitRecordsEvent])
+    stream = RecordStream(manager, lambda path: (100, 0), lambda path: 'exact')
+    state = logtracker.filenotifier.FileState(file_name)
+    tests.utils.write_file(file_name, "ERROR connection refused\n" * 1000)
+    stream.on_file_event(notify(state))
+
+    split, sent = manager.events
+    assert type(split) is SplitRecordsEvent and type(sent) is RecordsEvent
+    assert split.seq == 0 and len(split.records) == 1000
+    assert sent.records == ["ERROR connection refused"]
+    # alert rules count every record, not the collapsed one
+    engine = AlertEngine([Rule("errors", r"ERROR", threshold=50)])
+    engine.on_records(split)
+    assert [alert["count"] for alert in engine.alerts] == [1000]
+
+    # no SplitRecordsEvent handler: not posted
+    manager = FakeManager()
+    stream = RecordStream(manager)
+    tests.utils.write_file(file_name, "line\n")
+    stream.on_file_event(notify(state))
+    assert [type(event) for event in manager.events] == [RecordsEvent]
+    tests.utils.delete_files([file_name])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.tail unit tests
+"""
+
+import asyncio
+import io
+import os
+import socket
+
+# pylint: disable=import-error, wrong-import-position
+import logtracker.tail
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_tail')
+
+SOCKET = 'test_tail.sock'
+FILES = [{"path": "/var/log/a.log", "color": "red"}, {"path": "/var/log/b.log", "color": "auto"}]
+
+def test_records_frame():
+    frame = logtracker.tail.encode_records("/var/log/a.log", 7, ["first", "multi\nline", "é"])
+    frame_type, length = logtracker.tail.HEADER.unpack_from(frame)
+    assert frame_type == logtracker.tail.RECORDS
+    assert length == len(frame) - logtracker.tail.HEADER.size
+    assert logtracker.tail.decode_records(frame[logtracker.tail.HEADER.size:]) == \
+        ("/var/log/a.log", 7, [b"first", b"multi\nline", "é".encode('utf-8')], [])
+    frame = logtracker.tail.encode_records("/var/log/a.log", 7, ["x"], [(-1, 3), (0, 2)])
+    assert logtracker.tail.decode_records(frame[logtracker.tail.HEADER.size:])[3] == \
+        [(-1, 3), (0, 2)]
+
+def test_tail():
+    loop = asyncio.new_event_loop()
+    server = logtracker.tail.TailServer(SOCKET, lambda: FILES)
+    outputs = [io.BytesIO() for _ in range(3)]
+    printers = [logtracker.tail.Printer(output, color) for output, color in
+                zip(outputs, (False, True, False))]
+
+    async def scenario():
+        await server.start()
+        assert oct(os.stat(SOCKET).st_mode & 0o777) == oct(0o600)
+        clients = [
+            asyncio.ensure_future(logtracker.tail.tail(SOCKET, [], None, printers[0])),
+            asyncio.ensure_future(logtracker.tail.tail(SOCKET, ["/var/log/a.log"], None,
+                                                       printers[1])),
+            asyncio.ensure_future(logtracker.tail.tail(SOCKET, [], "err", printers[2]))]
+        while server.clients < 3:
+            await asyncio.sleep(0.01)
+        server.on_records(RecordsEvent("/var/log/a.log", 0, ["line 1", "error 2"]))
+        server.on_records(RecordsEvent("/var/log/b.log", 0, ["line 3"]))
+        # collapsed records: repeats of records sent before and of this event
+        server.on_records(RecordsEvent("/var/log/b.log", 1, ["error 4"], repeats=[(0, 5),
+                                                                                  (1, 2)]))
+        server.on_records(RecordsEvent("/var/log/b.log", 2, [], repeats=[(1, 7)]))
+        await asyncio.sleep(0.1)
+        server.stop()
+        await asyncio.wait(clients, timeout=1)
+        assert all(client.done() for client in clients)
+
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        server.stop()
+        loop.close()
+
+    assert not os.path.exists(SOCKET)
+    assert outputs[0].getvalue() == b"a.log: line 1\na.log: error 2\nb.log: line 3\n" \
+        b"b.log: line 3 [x5]\nb.log: error 4 [x2]\nb.log: error 4 [x7]\n"
+    assert outputs[1].getvalue() == b"\x1b[31mline 1\x1b[0m\n\x1b[31merror 2\x1b[0m\n"
+    assert outputs[2].getvalue() == b"a.log: error 2\nb.log: error 4 [x2]\n" \
+        b"b.log: error 4 [x7]\n"
+
+def test_socket_in_use():
+    loop = asyncio.new_event_loop()
+    first = logtracker.tail.TailServer(SOCKET, lambda: FILES)
+    second = logtracker.tail.TailServer(SOCKET, lambda: FILES)
+
+    async def scenario():
+        # socket left by a previous run is replaced
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(SOCKET)
+        await first.start()
+        assert first.clients == 0 and os.path.exists(SOCKET)
+        inode = os.stat(SOCKET).st_ino
+        # socket of a running server is not taken over, nor deleted
+        await second.start()
+        second.stop()
+        assert os.stat(SOCKET).st_ino == inode
+        assert await logtracker.tail.TailServer.listening(SOCKET)
+        first.stop()
+        assert not os.path.exists(SOCKET)
+
+    try:
+        loop.run_until_complete(scenario())
+    finally:
+        first.stop()
+        loop.close()
+        tests.utils.delete_files([SOCKET])
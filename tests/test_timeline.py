@@ -0,0 +1,126 @@
+#!/usr/bin/env python3.6
+
+"""
+    logtracker.timeline unit tests
+"""
+
+import calendar
+import gzip
+import os
+
+# pylint: disable=import-error, wrong-import-position
+import logtracker.history
+from logtracker.timeline import LiveTimeline, TimeParser, file_records, merge, seek
+from logtracker.stream import RecordsEvent
+import tests.utils
+
+# pylint: disable=missing-function-docstring
+
+tests.utils.setup_logger('test_timeline')
+
+BASE = calendar.timegm((2020, 5, 17, 10, 0, 0, 0, 0, 0))
+
+def test_parser():
+    parser = TimeParser()
+    assert parser.parse('2020-05-17T10:00:01.250Z INFO start') == BASE + 1.25
+    assert parser.parse('2020-05-17 12:00:02+02:00 INFO start') == BASE + 2
+    assert parser.parse('127.0.0.1 - - [17/May/2020:10:00:03 +0000] "GET / HTTP/1.1" 200') \
+        == BASE + 3
+    assert parser.parse('May 17 10:00:04 host sshd[12]: accepted') is not None
+    assert parser.parse('    at com.example.Main(Main.java:12)') is None
+
+def iso(second: float) -> str:
+    return '2020-05-17T10:%02d:%06.3fZ' % (second // 60, second % 60)
+
+def test_merge():
+    app, nginx = 'test_timeline_app.log', 'test_timeline_nginx.log'
+    # app.log.1.gz: oldest records, app.log: newest ones and a continuation line
+    with gzip.open(app + '.1.gz', 'wb') as fdesc:
+        fdesc.write(''.join('%s app %d\n' % (iso(i), i) for i in range(0, 10, 2)).encode())
+    tests.utils.write_file(app, ''.join('%s app %d\n' % (iso(i), i) for i in range(10, 20, 2))
+                           + 'traceback line\n')
+    tests.utils.write_file(nginx, ''.join(
+        '10.0.0.1 - - [17/May/2020:10:00:%02d +0000] "GET /%d"\n' % (i, i)
+        for i in range(1, 20, 2)))
+    old = os.path.getmtime(app) - 10
+    os.utime(app + '.1.gz', (old, old))
+    try:
+        records, cursor = merge([app, nginx])
+        assert cursor is None
+        assert [stamp for stamp, _, _ in records] == sorted(stamp for stamp, _, _ in records)
+        assert [record.split(' ')[-1] for _, _, record in records[:4]] == \
+            ['0', '/1"', '2', '/3"']
+        assert records[-3:-1] == [(BASE + 18, app, '%s app 18' % iso(18)),
+                                  (BASE + 18, app, 'traceback line')]
+        assert records[-1][:2] == (BASE + 19, nginx) and len(records) == 21
+
+        # pages (several records of same time) and time range
+        for limit in (5, 19):
+            pages, cursor = merge([app, nginx], limit=limit)
+            while cursor is not None:
+                page, cursor = merge([app, nginx], cursor[0], limit=limit, skip=cursor[1])
+                pages += page
+            assert pages == records
+        records, _ = merge([app, nginx], BASE + 5, BASE + 8)
+        assert [stamp - BASE for stamp, _, _ in records] == [5, 6, 7, 8]
+    finally:
+        tests.utils.delete_files([app, app + '.1.gz', nginx])
+
+def test_dateext_merge():
+    path = 'test_timeline_date.log'
+    files = [path + '-20200101.gz', path + '-20200201', path]
+    with gzip.open(files[0], 'wb') as fdesc:
+        fdesc.write(''.join('%s old %d\n' % (iso(i), i) for i in range(0, 5)).encode())
+    tests.utils.write_file(files[1], ''.join('%s mid %d\n' % (iso(i), i) for i in range(5, 10)))
+    tests.utils.write_file(files[2], ''.join('%s new %d\n' % (iso(i), i) for i in range(10, 15)))
+    try:
+        records, cursor = merge([path, 'test_timeline_missing.log'])
+        assert cursor is None
+        assert [stamp - BASE for stamp, _, _ in records] == list(range(15))
+        records, _ = merge([path], BASE + 3, limit=4)
+        assert [record.split(' ', 1)[1] for _, _, record in records] == \
+            ['old 3', 'old 4', 'mid 5', 'mid 6']
+    finally:
+        tests.utils.delete_files(files)
+
+def test_seek():
+    path = 'test_timeline_seek.log'
+    with gzip.open(path + '.gz', 'wb') as fdesc:
+        fdesc.write(''.join('%s record %d\n' % (iso(i / 10), i) for i in range(20000)).encode())
+    tests.utils.write_file(path, ''.join('%s record %d\n' % (iso(i / 10), i)
+                                         for i in range(20000)))
+    try:
+        for rotation in logtracker.history.rotations(path):
+            reader = logtracker.history.HISTORY.reader(rotation)
+            size = reader.size if rotation.compressed else rotation.size
+            offset = seek(reader, size, BASE + 1500, TimeParser())
+            # offset is close before records of since
+            first = next(logtracker.history.lines(reader, offset))[1]
+            assert size // 2 < offset and TimeParser().parse(first.decode()) < BASE + 1500
+            assert seek(reader, size, BASE, TimeParser()) == 0
+        records = list(file_records(path, BASE + 1500, BASE + 1501))
+        assert [record for _, _, record in records] == \
+            ['%s record %d' % (iso(i / 10), i) for i in range(15000, 15011)]
+    finally:
+        tests.utils.delete_files([path, path + '.gz'])
+
+def test_live_timeline():
+    timeline = LiveTimeline(['/a.log', '/b.log'], 0.5)
+    now = BASE + 100
+    events = [RecordsEvent('/b.log', 0, [iso(100.2) + ' b1', 'b2 without time']),
+              RecordsEvent('/a.log', 0, [iso(100.1) + ' a1', iso(100.3) + ' a2']),
+              RecordsEvent('/c.log', 0, ['not subscribed'])]
+    for event in events:
+        event._time = now + 0.3 # pylint: disable=protected-access
+        timeline.add(event)
+    assert timeline.release(now + 0.5) == []
+    assert timeline.buffered() == sum(len(record) for event in events[:2]
+                                      for record in event.records)
+    assert [record for _, _, record in timeline.release(now + 0.75)] == \
+        [iso(100.1) + ' a1', iso(100.2) + ' b1', 'b2 without time']
+    late = RecordsEvent('/b.log', 2, [iso(100.15) + ' late'])
+    late._time = now + 0.4 # pylint: disable=protected-access
+    timeline.add(late)
+    # late record of a released time is released with it, after released records
+    assert [record for _, _, record in timeline.release(now + 1)] == \
+        [iso(100.15) + ' late', iso(100.3) + ' a2']